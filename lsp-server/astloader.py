@@ -0,0 +1,305 @@
+from json.decoder import JSONDecodeError, scanstring
+from json.scanner import NUMBER_RE
+import json
+import os
+import re
+
+"""
+Loads the class ASTs written by main.go
+
+load_ast parses a file once and shares the result, keyed by path and modification
+time so an edited file is parsed again.
+
+stream_members reads the file incrementally and yields one member of a class at a
+time, peak memory is bounded by the largest member instead of the whole file. Any
+number of classes may follow each other in the file, one per line (NDJSON) or
+pretty printed, so large libraries can be streamed in one go. Files larger than
+STREAM_ABOVE are streamed by inference and the checker, see is_large.
+
+The C scanner of the json module recurses once per nesting level, a value nested
+deeper than the recursion limit (a long chain of Cat or LParen) is decoded again
+by raw_decode_deep, which keeps its own stack.
+"""
+
+# path -> (mtime, parsed class)
+loaded = {}
+
+CHUNK_SIZE = 1 << 16
+
+# size in bytes from which a class file is streamed instead of loaded whole
+STREAM_ABOVE = 32 << 20
+
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+decoder = json.JSONDecoder()
+
+
+def load_ast(path="ast.json") -> dict:
+    mtime = os.stat(path).st_mtime_ns
+    if (cached := loaded.get(path)) is None or cached[0] != mtime:
+        with open(path) as fobj:
+            text = fobj.read()
+        value, end = raw_decode(text, WHITESPACE.match(text).end())
+        if WHITESPACE.match(text, end).end() != len(text):
+            raise JSONDecodeError("Extra data", text, end)
+        cached = loaded[path] = (mtime, value)
+    return cached[1]
+
+def is_large(path="ast.json") -> bool:
+    return os.path.getsize(path) > STREAM_ABOVE
+
+
+def raw_decode(text, pos=0):
+    """
+    JSONDecoder.raw_decode, values nested too deep for it go to raw_decode_deep
+    """
+    try:
+        return decoder.raw_decode(text, pos)
+    except RecursionError:
+        return raw_decode_deep(text, pos)
+
+def read_key(text, pos):
+    """
+    @return: (key, position after the colon)
+    """
+    pos = WHITESPACE.match(text, pos).end()
+    if text[pos:pos + 1] != '"':
+        raise JSONDecodeError("Expecting property name enclosed in double quotes", text, pos)
+    key, pos = scanstring(text, pos + 1)
+    pos = WHITESPACE.match(text, pos).end()
+    if text[pos:pos + 1] != ":":
+        raise JSONDecodeError("Expecting ':' delimiter", text, pos)
+    return key, pos + 1
+
+def raw_decode_deep(text, pos=0):
+    """
+    decodes the value at pos like JSONDecoder.raw_decode, iteratively so that
+    any depth fits, raises JSONDecodeError on a value cut short like it does
+
+    @return: (value, end)
+    """
+    # [container, key] of every open object or array, innermost last
+    stack = []
+    while True:
+        pos = WHITESPACE.match(text, pos).end()
+        char = text[pos:pos + 1]
+        if char == "{" or char == "[":
+            container = {} if char == "{" else []
+            pos = WHITESPACE.match(text, pos + 1).end()
+            if text[pos:pos + 1] == ("}" if char == "{" else "]"):
+                value, pos = container, pos + 1
+            else:
+                key = None
+                if char == "{":
+                    key, pos = read_key(text, pos)
+                stack.append([container, key])
+                continue
+        elif char == '"':
+            value, pos = scanstring(text, pos + 1)
+        elif (number := NUMBER_RE.match(text, pos)) is not None:
+            integer, frac, exp = number.groups()
+            value = float(integer + (frac or "") + (exp or "")) if frac or exp else int(integer)
+            pos = number.end()
+        elif text.startswith("null", pos):
+            value, pos = None, pos + 4
+        elif text.startswith("true", pos):
+            value, pos = True, pos + 4
+        elif text.startswith("false", pos):
+            value, pos = False, pos + 5
+        else:
+            raise JSONDecodeError("Expecting value", text, pos)
+
+        # adds value to the innermost container, closing every container it completes
+        while stack:
+            container, key = entry = stack[-1]
+            if key is None:
+                container.append(value)
+            else:
+                container[key] = value
+            pos = WHITESPACE.match(text, pos).end()
+            char = text[pos:pos + 1]
+            if char == ",":
+                if key is not None:
+                    entry[1], pos = read_key(text, pos + 1)
+                else:
+                    pos += 1
+                break
+            if char != ("]" if key is None else "}"):
+                raise JSONDecodeError("Expecting ',' delimiter", text, pos)
+            stack.pop()
+            value, pos = container, pos + 1
+        else:
+            return value, pos
+
+
+class JSONStream:
+    """
+    a cursor over a JSON text read in chunks, values are decoded with raw_decode
+    once enough of the text has been read
+    """
+
+    def __init__(self, fobj, chunk_size=CHUNK_SIZE):
+        self.fobj = fobj
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size) -> bool:
+        """
+        reads at least size more characters, dropping everything before pos
+        @return: False once the file is exhausted
+        """
+        if self.eof:
+            return False
+        chunk = self.fobj.read(max(size, self.chunk_size))
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        if not chunk:
+            self.eof = True
+        return bool(chunk)
+
+    def peek(self) -> str:
+        """
+        the next non whitespace character, empty at the end of the file
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.fill(self.chunk_size):
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if (found := self.peek()) != char:
+            raise ValueError(f"expected {char!r} in JSON stream, got {found!r}")
+        self.pos += 1
+
+    def value(self):
+        """
+        decodes the next value, the read ahead doubles until the value fits
+        """
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill(size):
+                    raise
+                size *= 2
+                continue
+            # a number may continue past the end of the buffer
+            if end == len(self.buffer) and not self.eof and isinstance(value, (int, float)):
+                if self.fill(size):
+                    continue
+            self.pos = end
+            return value
+
+    def members(self):
+        """
+        yields (key, cursor) for every member of the object at the cursor, the
+        caller reads or skips the value before asking for the next member
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key, self
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+
+def stream_members(path="ast.json", sections=("Methods", "Attributes")):
+    """
+    yields (class, section, name, member) for every member of the given sections
+    of every class in the file, in file order
+
+    class holds the scalar fields (Name, ID, ...) of the class read so far
+    """
+    with open(path) as fobj:
+        stream = JSONStream(fobj)
+        while stream.peek():
+            clss = {}
+            for key, cursor in stream.members():
+                if key in sections and cursor.peek() == "{":
+                    for name, member in cursor.members():
+                        yield clss, key, name, member.value()
+                elif key in ("Methods", "Attributes") and cursor.peek() == "{":
+                    # skipped a member at a time, never decoded whole
+                    for _, member in cursor.members():
+                        member.value()
+                else:
+                    value = cursor.value()
+                    if not isinstance(value, (dict, list)):
+                        clss[key] = value
+
+def iter_methods(path="ast.json"):
+    """
+    yields (method name, Function node) one method at a time
+    """
+    for _, _, name, member in stream_members(path, sections=("Methods",)):
+        yield name, member[0]
+
+def load_attributes(path="ast.json") -> dict:
+    """
+    the Attributes of every class in the file, without holding any method in memory
+    """
+    return {name: member for _, _, name, member in stream_members(path, sections=("Attributes",))}
+
+
+def test_test():
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "classes.json")
+    classes = [
+        {"Tag": "Class", "Name": "A", "Methods": {"f": [{"Body": [], "Weight": 1.5e3}], "g": [{"Body": [[1]]}]}, "Attributes": {}},
+        {"Tag": "Class", "Name": "B", "Methods": {}, "Attributes": {"x": [{"Value": "x \"}\" {"}]}},
+    ]
+    with open(path, "w") as fobj:
+        fobj.write("\n".join(json.dumps(c) for c in classes) + "\n")
+
+    members = [(c["Name"], s, n, m) for c, s, n, m in stream_members(path)]
+    assert members == [
+        ("A", "Methods", "f", [{"Body": [], "Weight": 1500.0}]),
+        ("A", "Methods", "g", [{"Body": [[1]]}]),
+        ("B", "Attributes", "x", [{"Value": "x \"}\" {"}]),
+    ]
+
+    # a tiny chunk size forces values to straddle reads
+    with open(path) as fobj:
+        stream = JSONStream(fobj, chunk_size=3)
+        assert [k for k, c in stream.members() if c.value() is not None] == list(classes[0])
+
+    assert [n for n, _ in iter_methods("ast.json")] == list(load_ast("ast.json")["Methods"])
+    assert load_attributes(path) == {"x": [{"Value": "x \"}\" {"}]}
+    assert load_attributes("ast.json") == load_ast("ast.json")["Attributes"]
+    assert load_ast("ast.json") is load_ast("ast.json")
+
+    # decodes what the json module does, and what it cannot for depth
+    text = json.dumps(classes + [1, -2.5e-3, 0, True, False, None, "\\u00e9\\n", {"": []}, [[], {}]], indent=1)
+    assert raw_decode_deep(text) == (json.loads(text), len(text))
+    for cut in range(1, len(text)):
+        try:
+            raw_decode_deep(text[:cut])
+        except JSONDecodeError:
+            continue
+        raise AssertionError(f"decoded {text[:cut]!r}")
+    depth = 10 ** 4
+    value, end = raw_decode("[" * depth + "]" * depth)
+    assert end == 2 * depth
+    for _ in range(depth - 1):
+        value, = value
+    assert value == []
+
+    print("tests passed")
+
+if __name__ == "__main__":
+    test_test()
@@ -0,0 +1,118 @@
+from sutypes import SuTypes, TypeRepr
+
+"""
+Lowered AST nodes for inference
+
+Each line of a method body is lowered into AstNode objects right before it is
+inferred, the fields inference reads are plain slots and Type_t is resolved to
+its primitive TypeRepr a single time per distinct string instead of at every
+use. infer_generic dispatches on the tag through a handler table
+(type_inference.HANDLERS). The lowered line is dropped once inferred, so
+nothing outlives the JSON it came from nor goes stale when the JSON changes.
+"""
+
+# Type_t string -> primitive TypeRepr, or None when it names no SuTypes
+resolved = {}
+
+
+def resolve(type_t):
+    try:
+        r = TypeRepr.primitive(SuTypes.from_str(type_t))
+    except ValueError:
+        r = None
+    # without hash consing every primitive is a fresh instance, keep none
+    if TypeRepr.hash_consing:
+        resolved[type_t] = r
+    return r
+
+
+class AstNode:
+    """
+    @param args: tuple of the lowered Args, empty when the JSON has none
+    @param actual: Type_t as its primitive TypeRepr, None when Type_t is not a
+                   SuTypes name
+    """
+
+    __slots__ = ("tag", "value", "type_t", "actual", "args", "id")
+
+    def __repr__(self) -> str:
+        return f"AstNode(tag = {self.tag}, value = {self.value}, type_t = {self.type_t}, id = {self.id})"
+
+    def __init__(self, tag, value, type_t, id, args=()):
+        self.tag = tag
+        self.value = value
+        self.type_t = type_t
+        self.id = id
+        if (actual := resolved.get(type_t, False)) is False:
+            actual = resolve(type_t)
+        self.actual = actual
+        self.args = args
+
+
+def lower(stmt) -> AstNode:
+    """
+    lowers a JSON statement and everything below it, iteratively so that deep
+    expressions do not hit the recursion limit
+    """
+    new = AstNode.__new__
+    get = resolved.get
+    root = new(AstNode)
+    # nodes[i] is filled from stmts[i], leaves are filled by their parent
+    nodes, stmts = [root], [stmt]
+    while nodes:
+        node = nodes.pop()
+        stmt = stmts.pop()
+        node.tag = stmt["Tag"]
+        node.value = stmt["Value"]
+        node.type_t = type_t = stmt["Type_t"]
+        node.id = stmt["ID"]
+        if (actual := get(type_t, False)) is False:
+            actual = resolve(type_t)
+        node.actual = actual
+        if not (args := stmt["Args"]):
+            node.args = ()
+            continue
+
+        children = []
+        for arg in args:
+            children.append(child := new(AstNode))
+            if arg["Args"]:
+                nodes.append(child)
+                stmts.append(arg)
+                continue
+            child.tag = arg["Tag"]
+            child.value = arg["Value"]
+            child.type_t = type_t = arg["Type_t"]
+            child.id = arg["ID"]
+            if (actual := get(type_t, False)) is False:
+                actual = resolve(type_t)
+            child.actual = actual
+            child.args = ()
+        node.args = tuple(children)
+    return root
+
+
+def test_test():
+    stmt = {"Tag": "Binary", "Value": "Eq", "Type_t": "Operator", "ID": "b", "Args": [
+        {"Tag": "Identifier", "Value": "x", "Type_t": "Variable", "Args": None, "ID": "x"},
+        {"Tag": "Constant", "Value": "1", "Type_t": "Number", "Args": None, "ID": "c"},
+    ]}
+    node = lower(stmt)
+    assert node.tag == "Binary" and node.actual is TypeRepr.primitive(SuTypes.InBuiltOperator)
+    assert [a.id for a in node.args] == ["x", "c"] and node.args[0].args == ()
+    assert node.args[1].actual is TypeRepr.primitive(SuTypes.Number)
+    assert AstNode("Parameter", "p", "", "p").actual is None
+
+    # deeper than the recursion limit
+    deep = leaf = {"Tag": "Constant", "Value": "1", "Type_t": "Number", "Args": None, "ID": "leaf"}
+    for i in range(5000):
+        deep = {"Tag": "Unary", "Value": "LParen", "Type_t": "Operator", "Args": [deep], "ID": str(i)}
+    node = lower(deep)
+    while node.args:
+        node = node.args[0]
+    assert node.id == leaf["ID"]
+
+    print("tests passed")
+
+if __name__ == "__main__":
+    test_test()
@@ -0,0 +1,409 @@
+# Micro benchmarks for the inference engine
+# Run with `python3 bench.py <name>` or `python3 bench.py all`
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from graph import CompactGraph, Graph, Node
+from kvstore import KVStore, StoreValue
+from snapshot import Snapshot, write_snapshot
+from sutypes import SuTypes, TypeRepr
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def build_graph(n, cls=Graph):
+    """
+    mirrors the shape process_methods produces, every statement node is chained
+    to the previous one and tied back to one of the basal types
+    """
+    graph = cls()
+    basal = ["String", "Number", "Boolean"]
+    prev = None
+    for x in range(n):
+        node = Node(uuid.uuid4().hex)
+        graph.add_node(node)
+        if prev is not None and x % 4 != 0:
+            graph.add_edge(prev.value, node.value)
+        else:
+            graph.add_edge(node.value, basal[x % len(basal)])
+        prev = node
+    return graph
+
+
+def bench_graph_construction(sizes=(10**3, 10**4, 10**5)):
+    print("graph construction")
+    results = []
+    for n in sizes:
+        elapsed = timed(build_graph, n)
+        results.append((n, elapsed))
+        print(f"    n = {n:>7}  {elapsed * 1000:>9.2f} ms  {elapsed / n * 1e6:>6.2f} us/node")
+
+    # linear scaling keeps the per node cost flat as n grows
+    (n0, t0), (n1, t1) = results[0], results[-1]
+    ratio = (t1 / n1) / (t0 / n0)
+    print(f"    per node cost ratio {n1} vs {n0}: {ratio:.2f}x")
+    return ratio
+
+
+def bench_graph_memory(n=10**5):
+    print("graph memory")
+    for cls in (Graph, CompactGraph):
+        tracemalloc.start()
+        graph = build_graph(n, cls)
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"    {cls.__name__:<13} n = {n}  {used / 2**20:>7.2f} MiB  {used / n:>7.1f} bytes/node (traced)")
+
+    usage = graph.memory_usage()
+    print(f"    {'':<13} {usage['bytes_per_node']:.1f} bytes/node  {usage['bytes_per_edge']:.1f} bytes/edge (CompactGraph.memory_usage)")
+    return usage
+
+
+# regression target for starting the inference and checker, see bench_import_time
+IMPORT_BUDGET_MS = 100
+HEAVY_MODULES = ["matplotlib", "networkx", "numpy"]
+
+
+def bench_import_time(modules=("type_inference", "type_checker")):
+    """
+    cold start of the inference and checker modules in a fresh interpreter,
+    measured with `python -X importtime`
+    """
+    print("import time")
+    code = f"import sys, {', '.join(modules)}; print(','.join(m for m in {HEAVY_MODULES} if m in sys.modules))"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True)
+
+    # lines look like `import time: self [us] | cumulative | imported package`
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        parts = line.removeprefix("import time:").split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit() and not parts[2].startswith("  "):
+            total_us += int(parts[1])
+            if parts[2].strip() in modules:
+                print(f"    {parts[2].strip():<15} {int(parts[1]) / 1000:>7.2f} ms")
+
+    heavy = [m for m in proc.stdout.strip().split(",") if m]
+    total_ms = total_us / 1000
+    status = "ok" if total_ms < IMPORT_BUDGET_MS and not heavy else "REGRESSION"
+    print(f"    total           {total_ms:>7.2f} ms  (budget {IMPORT_BUDGET_MS} ms) {status}")
+    if heavy:
+        print(f"    heavy modules imported: {', '.join(heavy)}")
+    return total_ms
+
+
+def bench_snapshot(n=10**5):
+    """
+    loading the store and graph back for the checker, JSON vs binary snapshot
+    """
+    print("snapshot load")
+    graph = build_graph(n)
+    store = KVStore()
+    number_t = TypeRepr.primitive(SuTypes.Number)
+    for node in graph.get_nodes():
+        store.db[node.value] = StoreValue(node.value, number_t, number_t)
+
+    directory = tempfile.mkdtemp()
+    store_path, graph_path = os.path.join(directory, "store.json"), os.path.join(directory, "graph.json")
+    snapshot_path = os.path.join(directory, "snapshot.bin")
+    with open(store_path, "w") as fobj:
+        json.dump(store.to_json(), fobj, indent=4)
+    with open(graph_path, "w") as fobj:
+        json.dump(graph.to_json(), fobj, indent=4)
+    write_snapshot(snapshot_path, store, graph)
+
+    def load_json():
+        with open(store_path) as fobj:
+            KVStore.from_json(json.load(fobj))
+        with open(graph_path) as fobj:
+            Graph.from_json(fobj.read()).conflicting_components()
+
+    def load_snapshot():
+        with Snapshot.open(snapshot_path) as snapshot:
+            snapshot.get(graph.get_nodes()[-1].value)
+            snapshot.conflicting_components()
+
+    json_size = os.path.getsize(store_path) + os.path.getsize(graph_path)
+    print(f"    json      {json_size / 2**20:>7.2f} MiB  {timed(load_json) * 1000:>9.2f} ms")
+    print(f"    snapshot  {os.path.getsize(snapshot_path) / 2**20:>7.2f} MiB  {timed(load_snapshot) * 1000:>9.2f} ms")
+
+
+def bench_typerepr(n_methods=34, lines=50):
+    """
+    TypeRepr allocations of inferring a synthetic class with and without hash
+    consing, each in a session of its own, see TypeRepr.of
+    """
+    from type_inference import process_custom_types, process_methods, process_parameters, propogate_infer
+
+    def infer(methods):
+        store, graph = KVStore(), Graph()
+        process_custom_types(methods, {}, {}, {}, store, graph, {})
+        process_parameters(methods, {}, {}, {}, store, graph, {})
+        process_methods(methods, store, graph, {})
+        propogate_infer(store, graph, {}, {})
+        return store, graph
+
+    print("typerepr allocations")
+    for hash_consing in (False, True):
+        methods = build_class(n_methods, lines)
+        # every line is `x = 1 + 2 + y`, six expressions
+        n = n_methods * lines * 6
+        TypeRepr.hash_consing = hash_consing
+        with TypeRepr.session():
+            gc.collect()
+            before = TypeRepr.allocations
+            tracemalloc.start()
+            start = time.perf_counter()
+            kept = infer(methods)
+            elapsed = time.perf_counter() - start
+            used, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            allocations = TypeRepr.allocations - before
+        del kept
+        label = "interned" if hash_consing else "fresh"
+        print(f"    {label:<9} {n} expressions  {allocations:>6} TypeReprs  "
+              f"{used / 2**20:>6.2f} MiB  {elapsed * 1000:>8.2f} ms (traced)")
+    TypeRepr.hash_consing = True
+    return allocations
+
+
+def bench_spill(n_methods=1000, per_method=20, capacity=2000):
+    """
+    a BoundedKVStore holding a tenth of the values in memory, queried with a
+    skewed access pattern where most lookups hit a few hot methods
+    """
+    from spillstore import BoundedKVStore
+
+    print("spill store")
+    number_t = TypeRepr.primitive(SuTypes.Number)
+    store = BoundedKVStore(capacity)
+    start = time.perf_counter()
+    for m in range(n_methods):
+        store.owner = f"method_{m}"
+        for i in range(per_method):
+            store.set(f"{m}_{i}", StoreValue(f"v{i}", number_t, number_t))
+    store.owner = None
+    fill = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for x in range(10**5):
+        m = x % 10 if x % 10 else (x * 7919) % n_methods
+        store.get(f"{m}_{x % per_method}")
+    lookups = time.perf_counter() - start
+
+    stats = store.stats()
+    store.close()
+    print(f"    {n_methods * per_method} values, capacity {capacity}  fill {fill * 1000:.2f} ms  10^5 gets {lookups * 1000:.2f} ms")
+    print(f"    hits {stats['hits']}  misses {stats['misses']}  evictions {stats['evictions']}  resident {stats['resident']}")
+    return stats
+
+
+def bench_ast_loading(n_methods=2000, lines=50):
+    """
+    peak memory of loading a large class file whole vs streaming it one method at a time
+    """
+    from astloader import iter_methods
+
+    print("ast loading")
+    body = [[{"Tag": "Constant", "Value": str(x), "Type_t": "Number", "Args": None, "ID": uuid.uuid4().hex}]
+            for x in range(lines)]
+    clss = {"Tag": "Class", "Name": "Big", "Methods": {
+        f"method_{m}": [{"Tag": "Function", "Name": f"method_{m}", "Parameters": [], "Body": body}]
+        for m in range(n_methods)
+    }, "Attributes": {}}
+    path = os.path.join(tempfile.mkdtemp(), "big.json")
+    with open(path, "w") as fobj:
+        json.dump(clss, fobj)
+    del clss, body
+
+    def load_whole():
+        with open(path) as fobj:
+            return len(json.load(fobj)["Methods"])
+
+    def load_streaming():
+        return sum(1 for _ in iter_methods(path))
+
+    print(f"    {n_methods} methods, {os.path.getsize(path) / 2**20:.2f} MiB")
+    for name, fn in (("json.load", load_whole), ("streaming", load_streaming)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"    {name:<10} peak {peak / 2**20:>7.2f} MiB  {elapsed * 1000:>9.2f} ms")
+
+
+def build_class(n_methods, lines):
+    """
+    a synthetic class shaped like main.go output, every line is `x = 1 + 2 + y`
+    """
+    def node(tag, value, type_t, args=None):
+        return {"Tag": tag, "Value": value, "Type_t": type_t, "Args": args, "ID": uuid.uuid4().hex}
+
+    methods = {}
+    for m in range(n_methods):
+        body = []
+        for x in range(lines):
+            add = node("Nary", "Add", "Operator", [
+                node("Constant", "1", "Number"), node("Constant", "2", "Number"), node("Identifier", "y", "Variable"),
+            ])
+            body.append([node("Binary", "Eq", "Operator", [node("Identifier", f"x{x}", "Variable"), add])])
+        methods[f"method_{m}"] = {"Tag": "Function", "Name": f"method_{m}", "Parameters": [], "Body": body}
+    return methods
+
+
+def bench_inference(n_methods=200, lines=50, repeat=7):
+    """
+    process_methods over a large synthetic class, best of repeat runs each
+        dict+match  the inference before astnodes.py, walking the JSON dicts (see dictwalk.py)
+        lowered     lowering every line (see astnodes.lower) then inferring it
+    the runs alternate so that both see the same machine
+    """
+    import dictwalk
+    from type_inference import process_methods
+
+    print("inference")
+    n = n_methods * lines
+    methods = build_class(n_methods, lines)
+    runs = {"dict+match": dictwalk.process_methods, "lowered": process_methods}
+    best = dict.fromkeys(runs, float("inf"))
+    for _ in range(repeat):
+        for label, fn in runs.items():
+            gc.collect()
+            best[label] = min(best[label], timed(fn, methods, KVStore(), Graph(), {}))
+
+    baseline = best["dict+match"]
+    for label, elapsed in best.items():
+        print(f"    {label:<10} {n} lines  {elapsed * 1000:>9.2f} ms  {elapsed / n * 1e6:>6.2f} us/line  {baseline / elapsed:>5.2f}x")
+    return baseline / best["lowered"]
+
+
+def bench_parallel(n_methods=400, lines=50, jobs=(1, 2, 4)):
+    """
+    the per method passes serially and in worker processes, see parallel.py
+    the merge runs in the parent alone and bounds the speed up. in process infers
+    the fragments without a pool and merges them, what a worker and the parent
+    cost together without sending anything. every line runs with the collector
+    on except inside merge, the last two lines show what pausing it there saves
+    """
+    from parallel import infer_batch, infer_parallel, merge
+    from type_inference import process_custom_types, process_methods, process_parameters
+
+    print(f"parallel inference ({os.cpu_count()} cores)")
+    methods = build_class(n_methods, lines)
+    n = n_methods * lines
+
+    def serial():
+        store, graph = KVStore(), Graph()
+        process_custom_types(methods, {}, {}, {}, store, graph, {})
+        process_parameters(methods, {}, {}, {}, store, graph, {})
+        process_methods(methods, store, graph, {})
+
+    def in_process():
+        fragments, _ = infer_batch(methods, {}, {}, {}, {})
+        merge(fragments, KVStore(), Graph())
+
+    gc.collect()
+    baseline = timed(serial)
+    print(f"    serial    {n} lines  {baseline * 1000:>9.2f} ms")
+    gc.collect()
+    elapsed = timed(in_process)
+    print(f"    in process {n} lines {elapsed * 1000:>9.2f} ms  {baseline / elapsed:>5.2f}x")
+    for j in jobs:
+        gc.collect()
+        elapsed = timed(infer_parallel, methods, {}, {}, {}, KVStore(), Graph(), {}, j)
+        print(f"    jobs = {j:<2} {n} lines  {elapsed * 1000:>9.2f} ms  {baseline / elapsed:>5.2f}x")
+
+    fragments, _ = infer_batch(methods, {}, {}, {}, {})
+    gc.collect()
+    elapsed = timed(merge, fragments, KVStore(), Graph())
+    print(f"    merge alone           {elapsed * 1000:>9.2f} ms  {elapsed / baseline:>5.0%} of serial")
+
+    def merge_collecting(fragments, store, graph):
+        for fragment in fragments:
+            fragment.merge_into(store, graph, [TypeRepr.of(t) for t in fragment.types])
+
+    gc.collect()
+    elapsed = timed(merge_collecting, fragments, KVStore(), Graph())
+    print(f"    merge collecting      {elapsed * 1000:>9.2f} ms  {elapsed / baseline:>5.0%} of serial")
+
+
+def bench_method_cache(n_methods=400, lines=50):
+    """
+    a cold run, warm runs and a run after editing one method, see methodcache.py
+    warm walks every method for its key, warm file reuses the keys recorded for
+    the unchanged class file as the command line does. the serial line and every
+    cached run infer with the collector on, only the merge of the cached runs
+    pauses it, as measured by bench.py parallel
+    """
+    from methodcache import MethodCache, infer_cached
+    from type_inference import process_methods
+
+    print("method cache")
+    methods = build_class(n_methods, lines)
+    directory = tempfile.mkdtemp()
+    path, source = os.path.join(directory, "methods.sqlite"), os.path.join(directory, "ast.json")
+
+    def write_source():
+        with open(source, "w") as fobj:
+            json.dump({"Methods": methods}, fobj)
+
+    def run(label, source=None):
+        # the previous run's store and graph are not collected on this run's time
+        gc.collect()
+        with MethodCache(path) as cache:
+            elapsed = timed(infer_cached, methods, {}, {}, {}, KVStore(), Graph(), {}, cache, None, source)
+            stats = cache.stats()
+        print(f"    {label:<9} {elapsed * 1000:>9.2f} ms  {baseline / elapsed:>5.2f}x  hits {stats['hits']:>4}  misses {stats['misses']:>4}")
+
+    gc.collect()
+    baseline = timed(process_methods, methods, KVStore(), Graph(), {})
+    print(f"    serial    {baseline * 1000:>9.2f} ms")
+    write_source()
+    run("cold", source)
+    run("warm")
+    run("warm file", source)
+    body = methods["method_0"]["Body"]
+    methods["method_0"]["Body"] = body + body[:1]
+    write_source()
+    run("one edit", source)
+
+
+BENCHMARKS = {
+    "graph": bench_graph_construction,
+    "memory": bench_graph_memory,
+    "import": bench_import_time,
+    "snapshot": bench_snapshot,
+    "typerepr": bench_typerepr,
+    "spill": bench_spill,
+    "ast": bench_ast_loading,
+    "inference": bench_inference,
+    "parallel": bench_parallel,
+    "cache": bench_method_cache,
+}
+
+
+def main():
+    p = argparse.ArgumentParser("TypeLoom Benchmarks")
+    p.add_argument("name", nargs="?", default="all", choices=["all", *BENCHMARKS])
+    args = p.parse_args()
+
+    for name, fn in BENCHMARKS.items():
+        if args.name in ("all", name):
+            fn()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,602 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+from graph import Graph, Node
+from kvstore import KVStore, StoreValue
+from snapshot import Snapshot, write_snapshot
+from sutypes import SuTypesEncoder, TypeRepr
+
+"""
+An append-only log of KVStore and Graph mutations with periodic compaction
+
+    <path>              a header line then one JSON array per mutation
+                            {"format": "typeloom-log", "version": 1, "generation": n}
+                            ["set", id, value, actual, inferred]
+                            ["delete", id]
+                            ["basal", value] | ["node", value] | ["edge", a, b]
+                            ["remove_node", value] | ["remove_edge", a, b]
+                            ["remove_basal", value]
+                            ["normalise"]
+                            ["commit", n]
+    <path>.<n>.snap     binary snapshot (see snapshot.py) of every mutation before
+                        generation n, the log only holds what came after it
+    <path>.state        sqlite digest of the logged state, see LogState
+
+Mutations of an attached store and graph are written as they happen and made
+durable by ChangeLog.commit, which ends them with a commit record. Records only
+count once their commit record is on disk: replay drops a delta cut short by a
+crash and reopening the log cuts it off before appending. ChangeLog.append_delta
+instead compares a freshly inferred store and graph with the state tracked next
+to the log and only appends the differences, it never replays the log unless
+that state is missing or behind a compaction.
+Compaction writes the next snapshot first and then atomically swaps in an empty
+log pointing at it, so a crash at any point leaves either the old snapshot and
+log or the new ones.
+"""
+
+LOG_FORMAT = {"format": "typeloom-log", "version": 2}
+
+
+class ChangeLog:
+
+    def __repr__(self) -> str:
+        return f"ChangeLog(path = {self.path}, generation = {self.generation}, records = {self.records})"
+
+    def __init__(self, path, compact_every=10**5):
+        """
+        @param compact_every: commit compacts once the log holds this many records
+        """
+        self.path = path
+        self.compact_every = compact_every
+        self.generation = 0
+        self.records = 0
+        # records appended since the last commit record
+        self.pending = 0
+        self.store = None
+        self.graph = None
+        self.fobj = None
+
+    def snapshot_path(self, generation=None) -> str:
+        return f"{self.path}.{self.generation if generation is None else generation}.snap"
+
+    def state_path(self) -> str:
+        return f"{self.path}.state"
+
+    def attach(self, store, graph):
+        """
+        starts logging every mutation of store and graph, opens the log for appending
+        """
+        if self.fobj is None:
+            self.open()
+        self.store, self.graph = store, graph
+        store.log = self
+        graph.log = self
+
+    def detach(self):
+        if self.store is not None:
+            self.store.log = None
+            self.graph.log = None
+        self.store = self.graph = None
+
+    def open(self):
+        if not os.path.exists(self.path):
+            self.write_header(self.path, 0)
+        else:
+            self.truncate_uncommitted()
+            self.generation, self.records = self.scan()
+        self.fobj = open(self.path, "a")
+
+    def truncate_uncommitted(self):
+        """
+        drops the records after the last complete commit record, left by a crash,
+        so they are not committed along with the next delta
+        """
+        with open(self.path, "rb+") as fobj:
+            data = fobj.read()
+            # the header is written atomically, see write_header
+            end = data.find(b"\n") + 1
+            start = len(data)
+            while (i := data.rfind(b'\n["commit", ', 0, start)) != -1:
+                if (j := data.find(b"\n", i + 1)) != -1:
+                    end = j + 1
+                    break
+                start = i
+            if end != len(data):
+                fobj.truncate(end)
+
+    def close(self):
+        self.detach()
+        if self.fobj is not None:
+            self.commit()
+            self.fobj.close()
+            self.fobj = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    @staticmethod
+    def write_header(path, generation):
+        """
+        writes a log holding only the header, atomically replacing path
+        """
+        tmp = path + ".tmp"
+        with open(tmp, "w") as fobj:
+            fobj.write(json.dumps({**LOG_FORMAT, "generation": generation}) + "\n")
+            fobj.flush()
+            os.fsync(fobj.fileno())
+        os.replace(tmp, path)
+
+    def scan(self):
+        """
+        @return: (generation, number of records) of the log on disk
+        """
+        records = 0
+        with open(self.path, "r") as fobj:
+            header = self.read_header(fobj)
+            for _ in self.read_records(fobj):
+                records += 1
+        return header["generation"], records
+
+    @staticmethod
+    def read_header(fobj) -> dict:
+        header = json.loads(fobj.readline())
+        if {k: header.get(k) for k in LOG_FORMAT} != LOG_FORMAT:
+            raise ValueError(f"not a TypeLoom change log, got header {header}")
+        return header
+
+    @staticmethod
+    def read_records(fobj, lines=False):
+        """
+        yields every committed record, the records of a delta are held back until
+        its commit record is read, a delta cut short by a crash has none
+
+        @param lines: yield (record, line) instead, the line without its newline
+        """
+        pending = []
+        for line in fobj:
+            # a line without its newline was cut short by a crash, it was never committed
+            if not line.endswith("\n"):
+                return
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record[0] == "commit":
+                yield from pending
+                pending = []
+            else:
+                pending.append((record, line[:-1]) if lines else record)
+
+    def append(self, record):
+        self.append_line(json.dumps(record, cls=SuTypesEncoder))
+
+    def append_line(self, line):
+        self.fobj.write(line + "\n")
+        self.records += 1
+        self.pending += 1
+
+    # mutation hooks, called by KVStore and Graph once the mutation succeeded
+
+    @staticmethod
+    def set_line(var_id, value, encoded=None) -> str:
+        """
+        the set record of value as written to the log
+
+        @param encoded: id(TypeRepr) -> (TypeRepr, JSON), values share their types
+                        so each one is only encoded once
+        """
+        if encoded is None:
+            encoded = {}
+        types = []
+        for t in (value.actual, value.inferred):
+            if (entry := encoded.get(id(t))) is None:
+                entry = encoded[id(t)] = (t, json.dumps(t.to_flat(), cls=SuTypesEncoder))
+            types.append(entry[1])
+        return f'["set", {json.dumps(var_id)}, {json.dumps(value.value, cls=SuTypesEncoder)}, {types[0]}, {types[1]}]'
+
+    def set(self, var_id, value):
+        self.append_line(self.set_line(var_id, value))
+
+    def delete(self, var_id):
+        self.append(["delete", var_id])
+
+    def add_basal_type(self, value):
+        self.append(["basal", value])
+
+    def add_node(self, value):
+        self.append(["node", value])
+
+    def add_edge(self, node1, node2):
+        self.append(["edge", node1, node2])
+
+    def remove_node(self, value):
+        self.append(["remove_node", value])
+
+    def remove_edge(self, node1, node2):
+        self.append(["remove_edge", node1, node2])
+
+    def remove_basal_type(self, value):
+        self.append(["remove_basal", value])
+
+    def normalise(self):
+        self.append(["normalise"])
+
+    def commit(self):
+        """
+        makes every record appended so far durable, compacts once the log is long enough
+        """
+        if self.pending:
+            self.fobj.write(json.dumps(["commit", self.pending]) + "\n")
+            self.pending = 0
+        self.fobj.flush()
+        os.fsync(self.fobj.fileno())
+        if self.store is not None and self.records >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """
+        folds the attached store and graph into the next snapshot and starts an empty log
+        """
+        generation = self.generation + 1
+        write_snapshot(self.snapshot_path(generation), self.store, self.graph)
+        with open(self.snapshot_path(generation), "rb") as fobj:
+            os.fsync(fobj.fileno())
+
+        self.fobj.close()
+        self.write_header(self.path, generation)
+        self.fobj = open(self.path, "a")
+
+        if os.path.exists(previous := self.snapshot_path()):
+            os.remove(previous)
+        self.generation, self.records = generation, 0
+
+    @classmethod
+    def delta(cls, state, store, graph):
+        """
+        yields the lines of the records turning the logged state into store and graph
+
+        @param state: (digests, basal, nodes, edges), see LogState.load
+        """
+        digests, old_basal, old_nodes, old_edges = state
+        known = set(old_nodes)
+
+        basal = [n.value for n in graph.get_basal_types()]
+        for value in basal:
+            if value not in known:
+                yield json.dumps(["basal", value])
+        nodes = graph.get_nodes()
+        present = {node.value: node for node in nodes}
+        basal = set(basal)
+        for node in nodes:
+            if node.value not in known and node.value not in basal:
+                yield json.dumps(["node", node.value])
+
+        old_basal = set(old_basal)
+        for value in old_nodes:
+            if value not in present:
+                # a typedef no method binds anymore
+                yield json.dumps(["remove_basal" if value in old_basal else "remove_node", value])
+        edges = set()
+        for a, b in old_edges:
+            edges.add((a, b))
+            if a in present and b in present and b not in present[a].edges:
+                yield json.dumps(["remove_edge", a, b])
+
+        for node in nodes:
+            for edge in node.edges:
+                if node.value < edge and (node.value, edge) not in edges:
+                    yield json.dumps(["edge", node.value, edge])
+
+        # read through items(), see spillstore.BoundedKVStore
+        encoded = {}
+        keys = set()
+        for k, v in store.items():
+            keys.add(k)
+            line = cls.set_line(k, v, encoded)
+            if digests.get(k) != digest(line):
+                yield line
+        for k in digests:
+            if k not in keys:
+                yield json.dumps(["delete", k])
+
+    def append_delta(self, store, graph):
+        """
+        appends only what changed between the logged state and store and graph,
+        a run that changed nothing appends nothing
+
+        @return: number of records appended
+        """
+        if self.fobj is None:
+            self.open()
+        state = LogState(self.state_path())
+        try:
+            self.sync(state)
+            lines = list(self.delta(state.load(), store, graph))
+            for line in lines:
+                self.append_line(line)
+
+            # compaction snapshots the new state
+            self.store, self.graph = store, graph
+            self.commit()
+            self.store = self.graph = None
+            state.update(lines, self.generation, os.path.getsize(self.path))
+        finally:
+            state.close()
+        return len(lines)
+
+    def sync(self, state):
+        """
+        brings state up to the committed end of the log, folding in what was
+        committed since it was last updated
+        """
+        end = os.path.getsize(self.path)
+        if (position := state.position()) is None or position[0] != self.generation or position[1] > end:
+            self.rebuild(state, end)
+            return
+
+        generation, offset = position
+        with open(self.path, "rb") as fobj:
+            fobj.seek(offset)
+            lines = [line for _, line in self.read_records((raw.decode() for raw in fobj), lines=True)]
+        try:
+            state.update(lines, generation, end)
+        except ValueError:
+            # normalise rewrites the graph, only a replay knows its outcome
+            self.rebuild(state, end)
+
+    def rebuild(self, state, end):
+        store, graph = self.replay(self.path)
+        state.reset()
+        state.update(list(self.delta(({}, [], [], []), store, graph)), self.generation, end)
+
+    @classmethod
+    def replay(cls, path):
+        """
+        rebuilds the store and graph from the last snapshot plus the records after it
+
+        @return: (store, graph)
+        """
+        log = cls(path)
+        with open(path, "r") as fobj:
+            log.generation = cls.read_header(fobj)["generation"]
+
+            if os.path.exists(log.snapshot_path()):
+                with Snapshot.open(log.snapshot_path()) as snapshot:
+                    store, graph = snapshot.to_store(), snapshot.to_graph()
+            else:
+                store, graph = KVStore(), Graph()
+
+            for record in cls.read_records(fobj):
+                cls.apply(record, store, graph)
+
+        return store, graph
+
+    @staticmethod
+    def apply(record, store, graph):
+        match record:
+            case ["set", var_id, value, actual, inferred]:
+                # the record is the outcome of a set that already passed its checks
+                store.write(var_id, StoreValue(value, TypeRepr.of(actual), TypeRepr.of(inferred)))
+            case ["delete", var_id]:
+                store.delete(var_id)
+            case ["basal", value]:
+                graph.add_basal_type(Node(value))
+            case ["node", value]:
+                graph.add_node(Node(value))
+            case ["edge", node1, node2]:
+                graph.add_edge(node1, node2)
+            case ["remove_node", value]:
+                graph.remove_node(value)
+            case ["remove_edge", node1, node2]:
+                graph.remove_edge(node1, node2)
+            case ["remove_basal", value]:
+                graph.remove_basal_type(value)
+            case ["normalise"]:
+                graph.normalise()
+            case _:
+                raise ValueError(f"Unknown change log record {record}")
+
+
+def digest(line) -> str:
+    return hashlib.blake2b(line.encode(), digest_size=8).hexdigest()
+
+
+class LogState:
+    """
+    what a change log holds without its types: a digest of the set record of
+    every value, the basal types, nodes and edges, enough to tell which records
+    a new store and graph need. Kept in sqlite next to the log and updated with
+    what each commit appended, up to the log offset it records
+    """
+
+    def __repr__(self) -> str:
+        return f"LogState(path = {self.path}, position = {self.position()})"
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS position (generation INTEGER, offset INTEGER);
+            CREATE TABLE IF NOT EXISTS digests (id TEXT PRIMARY KEY, digest TEXT);
+            CREATE TABLE IF NOT EXISTS basal (value TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS nodes (value TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS edges (a TEXT, b TEXT, PRIMARY KEY (a, b));
+            CREATE INDEX IF NOT EXISTS edges_b ON edges (b);
+        """)
+
+    def close(self):
+        self.db.close()
+
+    def position(self):
+        """
+        @return: (generation, offset) of the log the state is up to, None when empty
+        """
+        return self.db.execute("SELECT generation, offset FROM position").fetchone()
+
+    def load(self):
+        """
+        @return: (id -> digest, [basal], [node], [(a, b)]) in the order they were logged,
+                 a < b for every edge
+        """
+        return (
+            dict(self.db.execute("SELECT id, digest FROM digests")),
+            [v for v, in self.db.execute("SELECT value FROM basal ORDER BY rowid")],
+            [v for v, in self.db.execute("SELECT value FROM nodes ORDER BY rowid")],
+            self.db.execute("SELECT a, b FROM edges ORDER BY rowid").fetchall(),
+        )
+
+    def reset(self):
+        with self.db:
+            for table in ("position", "digests", "basal", "nodes", "edges"):
+                self.db.execute(f"DELETE FROM {table}")
+
+    def update(self, lines, generation, offset):
+        """
+        folds the records of lines in, all or nothing
+
+        @raises ValueError: on a record the state cannot follow
+        """
+        with self.db:
+            for line in lines:
+                self.apply(json.loads(line), line)
+            self.db.execute("DELETE FROM position")
+            self.db.execute("INSERT INTO position VALUES (?, ?)", (generation, offset))
+
+    def apply(self, record, line):
+        match record:
+            case ["set", var_id, *_]:
+                self.db.execute("INSERT OR REPLACE INTO digests VALUES (?, ?)", (var_id, digest(line)))
+            case ["delete", var_id]:
+                self.db.execute("DELETE FROM digests WHERE id = ?", (var_id,))
+            case ["basal", value]:
+                self.db.execute("INSERT OR IGNORE INTO basal VALUES (?)", (value,))
+                self.db.execute("INSERT OR IGNORE INTO nodes VALUES (?)", (value,))
+            case ["node", value]:
+                self.db.execute("INSERT OR IGNORE INTO nodes VALUES (?)", (value,))
+            case ["edge", node1, node2]:
+                self.db.execute("INSERT OR IGNORE INTO edges VALUES (?, ?)", sorted((node1, node2)))
+            case ["remove_node" | "remove_basal", value]:
+                self.db.execute("DELETE FROM basal WHERE value = ?", (value,))
+                self.db.execute("DELETE FROM nodes WHERE value = ?", (value,))
+                self.db.execute("DELETE FROM edges WHERE a = ? OR b = ?", (value, value))
+            case ["remove_edge", node1, node2]:
+                self.db.execute("DELETE FROM edges WHERE a = ? AND b = ?", sorted((node1, node2)))
+            case _:
+                raise ValueError(f"Change log record {record} cannot be folded into the state")
+
+
+def test_test():
+    import tempfile
+
+    from sutypes import SuTypes
+
+    path = os.path.join(tempfile.mkdtemp(), "types.log")
+    number_t = TypeRepr.primitive(SuTypes.Number)
+
+    store, graph = KVStore(), Graph()
+    log = ChangeLog(path, compact_every=4)
+    log.attach(store, graph)
+
+    graph.add_basal_type(Node("Currency"))
+    graph.add_node(Node("x"))
+    graph.add_edge("Number", "x")
+    log.commit()
+    # compacted into the first snapshot
+    assert log.generation == 1 and log.records == 0
+
+    graph.add_node(Node("y"))
+    graph.add_edge("x", "y")
+    store.set("log_x", StoreValue("x", number_t, number_t))
+    log.commit()
+
+    # a crash mid write leaves a torn line behind
+    with open(path, "a") as fobj:
+        fobj.write('["node", "tor')
+    log.fobj.close()
+    log.fobj = None
+
+    restored_store, restored_graph = ChangeLog.replay(path)
+    assert restored_store.get("log_x").inferred == number_t
+    assert restored_graph.path_exists("Number", "y") is True
+    assert restored_graph.find_node("tor") is None
+    assert [n.value for n in restored_graph.get_basal_types()] == [n.value for n in graph.get_basal_types()]
+
+    # reopening cuts the torn line off before appending
+    log.open()
+    assert log.generation == 1 and log.records == 3
+    log.close()
+
+    # an unchanged state appends nothing, a retyped variable appends one set
+    log = ChangeLog(path)
+    assert log.append_delta(restored_store, restored_graph) == 0
+    string_t = TypeRepr.primitive(SuTypes.String)
+    restored_store.write("log_x", StoreValue("x", string_t, string_t))
+    restored_graph.add_node(Node("z"))
+    assert log.append_delta(restored_store, restored_graph) == 2
+    log.close()
+    assert ChangeLog.replay(path)[0].get("log_x").inferred.is_(string_t)
+
+    # a delta cut short before its commit record is dropped by replay and by the next open
+    with open(path, "a") as fobj:
+        fobj.write('["node", "half"]\n["edge", "half", "z"]\n')
+    assert ChangeLog.replay(path)[1].find_node("half") is None
+    with ChangeLog(path) as log:
+        log.open()
+    with open(path) as fobj:
+        assert "half" not in fobj.read()
+
+    # later runs diff against the state tracked next to the log, nothing is replayed
+    replay, ChangeLog.replay = ChangeLog.replay, None
+    try:
+        with ChangeLog(path) as log:
+            assert log.append_delta(restored_store, restored_graph) == 0
+        # what an attached store logged since is folded into it
+        with ChangeLog(path) as log:
+            log.attach(restored_store, restored_graph)
+            restored_store.set("log_y", StoreValue("y", number_t, number_t))
+        with ChangeLog(path) as log:
+            assert log.append_delta(restored_store, restored_graph) == 0
+    finally:
+        ChangeLog.replay = replay
+
+    # Currency is no longer bound by any method, the next runs still replay
+    store, graph = ChangeLog.replay(path)
+    fresh = Graph()
+    for node in graph.get_nodes():
+        if node.value != "Currency":
+            fresh.add_node(Node(node.value))
+    for node in graph.get_nodes():
+        for edge in node.edges:
+            if "Currency" not in (node.value, edge):
+                fresh.add_edge(node.value, edge)
+    with ChangeLog(path) as log:
+        assert log.append_delta(store, fresh) == 1
+    for _ in range(2):
+        with ChangeLog(path) as log:
+            assert log.append_delta(store, fresh) == 0
+    replayed = ChangeLog.replay(path)[1]
+    assert replayed.find_node("Currency") is None and replayed.path_exists("Number", "y")
+    assert [n.value for n in replayed.get_basal_types()] == [n.value for n in fresh.get_basal_types()]
+
+    # the same record is logged when the basal type is removed in place
+    path = os.path.join(tempfile.mkdtemp(), "types.log")
+    graph = Graph()
+    with ChangeLog(path) as log:
+        log.attach(KVStore(), graph)
+        graph.add_basal_type(Node("Currency"))
+        graph.add_node(Node("code"))
+        graph.add_edge("code", "Currency")
+        log.commit()
+        graph.remove_basal_type("Currency")
+    replayed = ChangeLog.replay(path)[1]
+    assert replayed.find_node("Currency") is None and replayed.find_node("code") is not None
+    assert [n.value for n in replayed.get_basal_types()] == [n.value for n in graph.get_basal_types()]
+
+    print("tests passed")
+
+if __name__ == "__main__":
+    test_test()
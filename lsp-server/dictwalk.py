@@ -0,0 +1,286 @@
+from graph import Node
+from kvstore import StoreValue
+from sutypes import SuTypes, TypeRepr
+from type_inference import get_type_assertion_functions, get_valid_type_for_operator, set_owner
+
+"""
+The inference as it was before astnodes.py: it walks the JSON dicts of a method
+body directly, recursing into the arguments and dispatching on the tag with
+match, and resolves Type_t at every use
+
+Only bench.py imports it, as the baseline the lowered inference in
+type_inference.py is measured against (bench.py inference)
+"""
+
+
+def infer_generic(stmt, store, graph, attributes) -> TypeRepr:
+    match stmt["Tag"]:
+        case "Unary":
+            return infer_unary(stmt, store, graph, attributes)
+        case "Binary":
+            return infer_binary(stmt, store, graph, attributes)
+        case "Nary":
+            return infer_nary(stmt, store, graph, attributes)
+        case "Identifier":
+            if store.get(stmt["ID"]) is not None:
+                return store.get(stmt["ID"]).inferred
+            return TypeRepr.primitive(SuTypes.Any)
+        case "If":
+            return infer_if(stmt, store, graph, attributes)
+        case "Compound":
+            # ! possible useless expression error?
+            if len(stmt["Args"]) == 0:
+                return None
+            return infer_generic(stmt["Args"][0], store, graph, attributes)
+        case "Call":
+            if store.get(stmt["Args"][0]["ID"]) is not None:
+                if store.get(stmt["Args"][0]["ID"]).inferred != TypeRepr.primitive(SuTypes.Function):
+                    raise TypeError(f"{store.get(stmt['Args'][0]['ID']).value} is not callable, it is of type {store.get(stmt['Args'][0]['ID']).inferred} instead")
+            return infer_generic(stmt["Args"][0], store, graph, attributes)
+        case "Return":
+            return infer_generic(stmt["Args"][0], store, graph, attributes)
+        case "Object":
+            return infer_object(stmt["Args"], store, graph, attributes)
+        case "Member":
+            return infer_attribute(stmt, store, graph, attributes)
+        case "Constant":
+            return TypeRepr.primitive(SuTypes.from_str(stmt["Type_t"]))
+        case _:
+            raise NotImplementedError(f"missed case {stmt['Tag']}")
+
+def infer_unary(stmt, store, graph, attributes) -> TypeRepr:
+    args = stmt["Args"]
+    value = stmt["Value"]
+
+    if value in ["LParen", "RParen"]:
+        ret_t = infer_generic(args[0], store, graph, attributes)
+        v = StoreValue(args[0]["Value"], 
+                       TypeRepr.primitive(SuTypes.from_str(args[0]["Type_t"])),
+                       ret_t)
+        store.set(args[0]["ID"], v)
+        return ret_t
+     
+
+    node = Node(args[0]["ID"])
+    graph.add_node(node)
+
+    valid_t = get_valid_type_for_operator(value)
+    vn = Node(valid_t.name)
+    graph.add_node(vn)
+    graph.add_edge(node.value, vn.value)
+
+    return valid_t
+
+
+def infer_binary(stmt, store, graph, attributes) -> TypeRepr:
+    args = stmt["Args"]
+    lhs = args[0]
+    rhs = args[1::][0]
+
+    # inferred types of lhs and rhs should be the same
+    lhs_t = infer_generic(lhs, store, graph, attributes)
+    if lhs_t is not None and lhs["Type_t"] != "Operator":
+        v = StoreValue(
+            lhs["Value"], 
+            TypeRepr.primitive(SuTypes.from_str(lhs["Type_t"])),
+            lhs_t
+        )
+        store.set(lhs["ID"], v)
+    rhs_t = infer_generic(rhs, store, graph, attributes)
+    if rhs_t is not None and rhs["Type_t"] != "Operator":
+        v = StoreValue(
+            rhs["Value"], 
+            TypeRepr.primitive(SuTypes.from_str(rhs["Type_t"])),
+            rhs_t)
+        store.set(rhs["ID"], v)
+
+    # if not check_type_equivalence(lhs_t, rhs_t):
+    #     raise TypeError(f"Type mismatch for {lhs_t} and {rhs_t}")
+    lhs_n = Node(lhs["ID"])
+    rhs_n = Node(rhs["ID"])
+    graph.add_node(lhs_n)
+    graph.add_node(rhs_n)
+    graph.add_edge(lhs_n.value, rhs_n.value)
+
+    if lhs_t != rhs_t:
+        raise TypeError(f"Conflicting inferred types for variable {lhs['ID']}\nexisting: {lhs_t}, \ngot: {rhs_t}")
+    elif lhs_t == TypeRepr.primitive(SuTypes.Any):
+        store.set(lhs["ID"], StoreValue(rhs["Value"], 
+            TypeRepr.primitive(SuTypes.from_str(rhs["Type_t"])),
+            rhs_t
+            )
+        )
+        return rhs_t
+    elif rhs_t == TypeRepr.primitive(SuTypes.Any):
+        store.set(rhs["ID"], StoreValue(lhs["Value"], 
+                TypeRepr.primitive(SuTypes.from_str(lhs["Type_t"])),
+                lhs_t
+            )
+        )
+        return lhs_t
+
+    return None
+
+
+def infer_nary(stmt, store, graph, attributes) -> TypeRepr:
+    value = stmt["Value"]
+    args = stmt["Args"]
+
+    valid_t = get_valid_type_for_operator(value)
+
+    prev = None
+    for i in args:
+        if i["Tag"] == "Call":
+            i = i["Args"][0]
+            if i["Value"] in get_type_assertion_functions():
+                typed_check_t = SuTypes.from_str(i["Value"].removesuffix("?"))
+                typed_check_t = TypeRepr.primitive(typed_check_t)
+                type_checked_var = i["Args"][0]
+
+                v = StoreValue(
+                    type_checked_var["Value"], 
+                    TypeRepr.primitive(SuTypes.from_str(type_checked_var["Type_t"])),
+                    typed_check_t 
+                    )
+                store.set(type_checked_var["ID"], v)
+
+                n = Node(type_checked_var["ID"])
+                graph.add_node(n)
+                primitive_type_node = graph.find_node(typed_check_t.get_name())
+                graph.add_edge(n.value, primitive_type_node.value)
+
+        n = Node(i["ID"])
+        """
+        NOTE: Infer Generic cause Args might not always be constants and variables,
+                so infer a generic somewhere here to infer further
+        """
+        n_infer = infer_generic(i, store, graph, attributes)
+        # v = StoreValue(i["Value"], TypeRepr.primitive(SuTypes.from_str(i["Type_t"])), valid_t)
+        v = StoreValue(i["Value"], n_infer, valid_t)
+        store.set(i["ID"], v)
+        graph.add_node(n)
+        if prev is not None:
+            graph.add_edge(prev.value, n.value)
+        prev = n
+
+    valid_str = valid_t.get_name()
+    n = graph.find_node(valid_str)
+    # n.add_edge(prev)
+    graph.add_edge(prev.value, n.value)
+
+    return valid_t
+
+def infer_if(stmt, store, graph, attributes):
+    cond = stmt["Args"][0]
+    cond_t = infer_generic(cond, store, graph, attributes)
+    if cond_t is not None:
+        v = StoreValue(
+            cond["Value"], 
+            TypeRepr.primitive(SuTypes.from_str(cond["Type_t"])),
+            cond_t)
+        store.set(cond["ID"], v)
+
+    then = stmt["Args"][1]
+    then_t = infer_generic(then, store, graph, attributes)
+    if then_t is not None:
+        v = StoreValue(
+            then["Value"], 
+            TypeRepr.primitive(SuTypes.from_str(then["Type_t"])), 
+            then_t)
+        store.set(then["ID"], v)
+
+    if len(stmt["Args"]) == 3:
+        else_t = infer_generic(stmt["Args"][2], store, graph, attributes)
+        if else_t is not None:
+            v = StoreValue(
+                stmt["Args"][2]["Value"], 
+                TypeRepr.primitive(SuTypes.from_str(stmt["Args"][2]["Type_t"])), 
+                else_t)
+            store.set(stmt["Args"][2]["ID"], v)
+
+    return None
+
+def infer_attribute(stmt, store, graph, attributes) -> TypeRepr:
+    value = stmt["Value"]
+    attrb_t = attributes.get(value, None)
+
+    if attrb_t is None:
+        raise TypeError(f"Attribute `{value}` not found in current class")
+    
+    valid_t = TypeRepr.primitive(SuTypes.from_str(attrb_t["Type_t"]))
+    v = StoreValue(stmt["Value"], 
+                   TypeRepr.primitive(SuTypes.from_str(stmt["Type_t"])),
+                   valid_t
+                )
+    store.set(stmt["ID"], v)
+
+    n = Node(stmt["ID"])
+    graph.add_node(n)
+    t = graph.find_node(valid_t.get_name())
+    # t.add_edge(n)
+    graph.add_edge(n.value, t.value)
+
+    return valid_t
+
+def infer_object(stmt, store, graph, attributes):
+    obj_def = {}
+
+    for i in stmt:
+        t = infer_generic(i["Args"][0], store, graph, attributes)
+        v = StoreValue(i["Args"][0]["Value"], TypeRepr.primitive(SuTypes.from_str(i["Args"][0]["Type_t"])), t)
+        store.set(i["Args"][0]["ID"], v)
+        # construct obj def struct for TypeRepr
+        obj_def[i["Value"]] = t
+        n = Node(i["Args"][0]["ID"])
+        graph.add_node(n)
+        graph.add_edge(n.value, graph.find_node(t.get_name()).value)
+
+    return TypeRepr.of({"form": "Object", "meaning": obj_def})
+
+def process_methods(methods, store, graph, attributes, dbg=None):
+    for k, v in methods.items():
+        if dbg is not None:
+            dbg.set_func(k)
+        set_owner(store, graph, k)
+        for x, i in enumerate(v["Body"]):
+            if dbg is not None:
+                dbg.set_line(x + 1)
+            valid_t = infer_generic(i[0], store, graph, attributes)
+            if valid_t is None:
+                continue
+            v = StoreValue(
+                i[0]["Value"], 
+                TypeRepr.primitive(SuTypes.from_str(i[0]["Type_t"])), 
+                valid_t
+                )
+            store.set(i[0]["ID"], v)
+            n = Node(i[0]["ID"])
+            graph.add_node(n)
+
+            if graph.find_node(valid_t.get_name()) is None:
+                graph.add_node(Node(valid_t.get_name()))
+
+            graph.add_edge(n.value, graph.find_node(valid_t.get_name()).value)
+
+    set_owner(store, graph, None)
+
+
+def test_test():
+    from bench import build_class
+    from graph import Graph
+    from kvstore import KVStore
+    import type_inference
+
+    # both walks infer the same store and graph
+    methods = build_class(3, 4)
+    results = []
+    for walk in (type_inference.process_methods, process_methods):
+        store, graph = KVStore(), Graph()
+        walk(methods, store, graph, {})
+        results.append(([(k, v.value, v.actual.name, v.inferred.name) for k, v in store.items()], graph.to_json()))
+    assert results[0] == results[1]
+
+    print("tests passed")
+
+if __name__ == "__main__":
+    test_test()
@@ -1,9 +1,11 @@
-from matplotlib import pyplot as plt
-import networkx as nx
+from array import array
+from collections import deque
+from itertools import compress, count
 import json
+import sys
 
 from kvstore import StoreValue
-from sutypes import SuTypes, TypeRepr
+from sutypes import TypeRepr
 
 """
 A graph data structure with nodes and edges
@@ -17,13 +19,37 @@ class Graph:
 
     nodes = None
     primitive_type_nodes = None
+    # filled in by propogate, see Graph.propogate
+    conflicts = None
+
+    # connected component labels, value -> label and label -> {value}
+    # kept up to date by add_edge and remove_edge, rebuilt lazily once invalidated
+    component = None
+    members = None
+    components_stale = False
+
+    # method currently adding nodes, and method -> {value} of the nodes it added
+    # see Graph.drop_method
+    owner = None
+    owned = None
+    node_owners = None
+
+    # receives every mutation once it succeeded, see changelog.ChangeLog
+    log = None
 
     def __repr__(self) -> str:
         return f"Graph(\n\t{self.nodes}\n)"
 
     def __init__(self):
-        self.nodes = []
+        # value -> Node, insertion ordered so that exports stay stable
+        self.nodes = {}
         self.primitive_type_nodes = []
+        self.component = {}
+        self.members = {}
+        self.components_stale = False
+        self.labels = count()
+        self.owned = {}
+        self.node_owners = {}
 
         # add primitive types
         for i in self.get_primitive_type_nodes():
@@ -61,31 +87,34 @@ class Graph:
 
         existsq = self.find_node(ty.value)
         if existsq is None:
+            if self.log is not None:
+                self.log.add_basal_type(ty.value)
             self.add_node(ty)
             self.primitive_type_nodes.append(ty)
 
 
     def get_nodes(self):
-        return self.nodes
+        return list(self.nodes.values())
 
     def find_node(self, name):
-        """
-        for node in self.nodes:
-            if node.value == name:
-                return node
-        return None
-        """
-        for node in self.nodes:
-            if node.value == name:
-                return node
-        return None
+        return self.nodes.get(name, None)
 
     def add_node(self, node):
         """
         @param node: Node instance
         """
-        if self.find_node(node.value) is None:
-            self.nodes.append(node)
+        if node.value not in self.nodes:
+            self.nodes[node.value] = node
+            if not self.components_stale:
+                label = next(self.labels)
+                self.component[node.value] = label
+                self.members[label] = {node.value: None}
+            if self.log is not None:
+                self.log.add_node(node.value)
+
+        if self.owner is not None:
+            self.owned.setdefault(self.owner, {})[node.value] = None
+            self.node_owners.setdefault(node.value, set()).add(self.owner)
 
     def add_edge(self, node1, node2):
         """
@@ -98,65 +127,369 @@ class Graph:
         n1 = self.find_node(node1)
         n2 = self.find_node(node2)
 
-        if n1 is not None and n1 is not None:
+        if n1 is not None and n2 is not None:
             n1.add_edge(n2)
             n2.add_edge(n1)
+            if not self.components_stale:
+                self.merge_components(node1, node2)
+            if self.log is not None:
+                self.log.add_edge(node1, node2)
         else:
             raise Exception("Node not found")
 
-    def are_connected(self, node1, node2):
+    def merge_components(self, node1, node2):
+        """
+        relabels the smaller component into the larger one
+        """
+        c1, c2 = self.component[node1], self.component[node2]
+        if c1 == c2:
+            return
+        if len(self.members[c1]) < len(self.members[c2]):
+            c1, c2 = c2, c1
+
+        moved = self.members.pop(c2)
+        for value in moved:
+            self.component[value] = c1
+        self.members[c1].update(moved)
+
+    def union(self, values, adjacency):
+        """
+        add_node for every value of values then add_edge for every neighbour of
+        every (value, [value]) of adjacency, in bulk: neighbours are linked in
+        the order given and new nodes are not given a component of their own
+        first, they join the one of the first neighbour they are linked to
+
+        @param adjacency: neighbours as Node.edges holds them, no value is its own neighbour
+        @raises Exception: when a neighbour is not in the graph
+        """
+        nodes = self.nodes
+        new = [v for v in dict.fromkeys(values) if v not in nodes]
+        nodes.update((v, Node(v)) for v in new)
+        if self.owner is not None:
+            self.owned.setdefault(self.owner, {}).update(dict.fromkeys(values))
+            for v in values:
+                self.node_owners.setdefault(v, set()).add(self.owner)
+
+        labelled = not self.components_stale
+        component, members = self.component, self.members
+        node_of = nodes.__getitem__
+        for value, neighbours in adjacency:
+            try:
+                node_of(value).edges.update(zip(neighbours, map(node_of, neighbours), strict=True))
+            except KeyError:
+                raise Exception("Node not found") from None
+            if not labelled:
+                continue
+
+            # like merge_components, a new node joins its neighbour's component
+            label = component.get(value)
+            for neighbour in neighbours:
+                if (other := component.get(neighbour)) is None:
+                    if label is None:
+                        label = next(self.labels)
+                        members[label] = {value: None}
+                        component[value] = label
+                    component[neighbour] = label
+                    members[label][neighbour] = None
+                elif label is None:
+                    label = component[value] = other
+                    members[label][value] = None
+                elif other != label:
+                    self.merge_components(value, neighbour)
+                    label = component[value]
+
+        if self.log is not None:
+            for v in new:
+                self.log.add_node(v)
+            for value, neighbours in adjacency:
+                for neighbour in neighbours:
+                    if value < neighbour:
+                        self.log.add_edge(value, neighbour)
+        if labelled:
+            for v in new:
+                if v not in component:
+                    component[v] = label = next(self.labels)
+                    members[label] = {v: None}
+
+    def remove_edge(self, node1, node2):
+        """
+        @param node1: node value
+        @param node2: node value
+
+        @side-effect: removes the edge bothways, splits the component if this was its last link
+        """
         n1 = self.find_node(node1)
         n2 = self.find_node(node2)
 
-        if n1 is not None and n2 is not None:
-            for edge in n1.get_connected_edges():
-                if edge == n2:
-                    return True
-        return False
+        if n1 is None or n2 is None or node2 not in n1.edges:
+            return
 
-    def path_exists(self, node1, node2):
+        del n1.edges[node2]
+        del n2.edges[node1]
+        if not self.components_stale:
+            self.split_components(node1, node2)
+        if self.log is not None:
+            self.log.remove_edge(node1, node2)
+
+    def remove_node(self, value):
+        """
+        @side-effect: removes every edge of the node, basal types cannot be removed
+        """
+        node = self.find_node(value)
+        if node is None:
+            return
+        if node in self.primitive_type_nodes:
+            raise ValueError(f"Cannot remove basal type {value}")
+
+        for edge in list(node.edges):
+            self.remove_edge(value, edge)
+
+        del self.nodes[value]
+        if not self.components_stale:
+            label = self.component.pop(value)
+            del self.members[label][value]
+            if not self.members[label]:
+                del self.members[label]
+
+        for method in self.node_owners.pop(value, ()):
+            self.owned[method].pop(value, None)
+        if self.log is not None:
+            self.log.remove_node(value)
+
+    def remove_basal_type(self, value):
+        """
+        removes a typedef basal type along with its edges, primitive types cannot be removed
+        """
+        node = self.find_node(value)
+        if node is None or node not in self.primitive_type_nodes:
+            return
+        if value in (n.value for n in self.get_primitive_type_nodes()):
+            raise ValueError(f"Cannot remove primitive type {value}")
+
+        self.primitive_type_nodes.remove(node)
+        # logged as a single record, replaying it removes the edges and the node too
+        log, self.log = self.log, None
+        try:
+            self.remove_node(value)
+        finally:
+            self.log = log
+        if self.log is not None:
+            self.log.remove_basal_type(value)
+
+    def drop_method(self, method) -> list:
+        """
+        removes every node only owned by method, along with their edges
+        nodes still owned by another method and basal types are kept
+
+        @return: values of the removed nodes
+        """
+        removed = []
+        basal = {n.value for n in self.primitive_type_nodes}
+
+        for value in self.owned.pop(method, {}):
+            owners = self.node_owners.get(value)
+            owners.discard(method)
+            if not owners and value not in basal:
+                self.remove_node(value)
+                removed.append(value)
+
+        return removed
+
+    def split_components(self, node1, node2):
+        """
+        after removing the edge node1 - node2, searches from both ends in lockstep,
+        if one side runs out before meeting the other it becomes a new component
+        the cost is bounded by the smaller side, or by the detour when they still meet
+        """
+        searches = [self.search_component(node1), self.search_component(node2)]
+        seen = [{node1}, {node2}]
+
+        while True:
+            for side in (0, 1):
+                try:
+                    value = next(searches[side])
+                except StopIteration:
+                    self.relabel_component(seen[side])
+                    return
+                if value is None:
+                    continue
+                if value in seen[1 - side]:
+                    return
+                seen[side].add(value)
+
+    def search_component(self, start):
+        """
+        BFS from start yielding every newly reached value, one edge at a time
+        edges to already visited nodes yield None so hubs are scanned in lockstep too
+        """
+        visited = {start}
+        queue = deque([self.nodes[start]])
+        while queue:
+            for edge in queue.popleft().get_connected_edges():
+                if edge.value not in visited:
+                    visited.add(edge.value)
+                    queue.append(edge)
+                    yield edge.value
+                else:
+                    yield None
+
+    def relabel_component(self, values):
+        old = self.component[next(iter(values))]
+        label = next(self.labels)
+        self.members[label] = {}
+        for value in values:
+            self.component[value] = label
+            del self.members[old][value]
+            self.members[label][value] = None
+
+    def invalidate_components(self):
+        """
+        call after removing edges or nodes, labels are rebuilt on next use
+        """
+        self.components_stale = True
+        self.component = {}
+        self.members = {}
+
+    def get_components(self) -> dict:
+        """
+        @return: value -> component label
+        """
+        if not self.components_stale:
+            return self.component
+
+        for node in self.nodes.values():
+            if node.value in self.component:
+                continue
+            label = next(self.labels)
+            self.component[node.value] = label
+            found = {node.value: None}
+            stack = [node]
+            while stack:
+                for edge in stack.pop().get_connected_edges():
+                    if edge.value not in self.component:
+                        self.component[edge.value] = label
+                        found[edge.value] = None
+                        stack.append(edge)
+            self.members[label] = found
+
+        self.components_stale = False
+        return self.component
+
+    def component_of(self, node):
+        return self.get_components().get(node, None)
+
+    def basal_type_of(self, node):
         """
-        simple BFS to find a path from node1 to node2
+        @return: value of the first basal type sharing a component with node, or None
         """
+        label = self.component_of(node)
+        if label is None:
+            return None
+        for basal in self.primitive_type_nodes:
+            if self.component.get(basal.value) == label:
+                return basal.value
+        return None
+
+    def conflicting_components(self, basal=None) -> list:
+        """
+        @param basal: list of basal type values, defaults to every basal type of the graph
+        @return: the basal types of every component holding more than one of them,
+                 as lists ordered like basal
+        """
+        if basal is None:
+            basal = [n.value for n in self.primitive_type_nodes]
+
+        components = self.get_components()
+        found = {}
+        for value in basal:
+            if value in components:
+                found.setdefault(components[value], []).append(value)
+
+        return [v for v in found.values() if len(v) > 1]
+
+    def are_connected(self, node1, node2):
         n1 = self.find_node(node1)
         n2 = self.find_node(node2)
 
         if n1 is not None and n2 is not None:
-            visited = []
-            queue = []
+            return n2.value in n1.edges
+        return False
 
-            queue.append(n1)
+    def path_exists(self, node1, node2):
+        """
+        node1 and node2 are connected when they share a component label
+        """
+        components = self.get_components()
+        c1, c2 = components.get(node1), components.get(node2)
+        return c1 is not None and c1 == c2
 
-            while len(queue) > 0:
-                node = queue.pop(0)
-                visited.append(node)
+    def propogate(self, store, sources, check=False):
+        """
+        @param sources: list of (basal type value, TypeRepr) in basal order
+        @return: list of conflicts (node value, basal type that labelled it, basal type that arrived later)
+                 one per pair of basal types that meet
 
-                for edge in node.get_connected_edges():
-                    if edge == n2:
-                        return True
-                    if edge not in visited:
-                        queue.append(edge)
-                        
-        return False
+        multi-source BFS from every basal type at once, each node is visited once and
+        takes the type of the basal type that reached it first
+        """
+        origin = {}
+        types = {}
+        queue = deque()
+        self.conflicts = []
+        reported = set()
+
+        for value, new_type in sources:
+            types[value] = new_type
+            if value in origin:
+                self.conflicts.append((value, origin[value], value))
+                continue
+            origin[value] = value
+            queue.append(self.find_node(value))
+
+        primitive_str = self.get_primitive_type_string()
+        while queue:
+            node = queue.popleft()
+            source = origin[node.value]
+            node.sutype = types[source]
+
+            if node.value not in primitive_str:
+                store.set_on_type_equivalence(node.value, StoreValue(node.value, node.sutype, node.sutype), check=check)
+
+            for edge in node.edges.values():
+                seen = origin.get(edge.value)
+                if seen is None:
+                    origin[edge.value] = source
+                    queue.append(edge)
+                elif seen != source and (pair := frozenset((seen, source))) not in reported:
+                    # a boundary between two basal types is seen from both sides, report it once
+                    reported.add(pair)
+                    self.conflicts.append((edge.value, seen, source))
+
+        return self.conflicts
 
-    
     def visualise(self):
+        # only needed for debugging, kept out of the import path of the inference and checker
+        from matplotlib import pyplot as plt
+        import networkx as nx
+
         G = nx.Graph()
 
-        for node in self.nodes:
+        for node in self.nodes.values():
             G.add_node(node.value)
             for edge in node.get_connected_edges():
                 G.add_edge(node.value, edge.value)
 
         pos = nx.spring_layout(G, k=0.95)
-        labels = {node.value: node.value for node in self.nodes}
+        labels = {value: value for value in self.nodes}
 
         nx.draw(G, pos, with_labels=True, labels=labels)
         plt.show()
 
-    def normalise(self):
+    def normalise(self) -> dict:
         """
-        This shortens the edges from the primitive types
+        This shortens the edges from the primitive types, every component is
+        rewritten into a star around its first basal type (or its first node
+        when it has none) in a single pass over the components
 
         Before:
             String -> x -> y -> z
@@ -164,14 +497,37 @@ class Graph:
             String -> x
             String -> y
             String -> z
+
+        Connectivity, and so the component labels, are unchanged. The original
+        edges are lost, so run it once the graph is no longer edited
+
+        @return: node and edge counts before and after
         """
-        for node in self.nodes:
-            if node.sutype in [SuTypes.String, SuTypes.Number, SuTypes.Boolean]:
-                for edge in node.get_connected_edges():
-                    if edge.sutype not in [SuTypes.String, SuTypes.Number, SuTypes.Boolean]:
-                        for edge2 in edge.get_connected_edges():
-                            self.add_edge(node.value, edge2.value)
-                        self.nodes.remove(edge)
+        stats = {"nodes_before": len(self.nodes), "edges_before": self.edge_count()}
+
+        self.get_components()
+        basal = [n.value for n in self.primitive_type_nodes]
+        centres = {}
+        for value in basal:
+            centres.setdefault(self.component[value], value)
+
+        for label, members in self.members.items():
+            centre = self.nodes[centres.get(label, next(iter(members)))]
+            centre.edges = {}
+            for value in members:
+                if value != centre.value:
+                    node = self.nodes[value]
+                    node.edges = {centre.value: centre}
+                    centre.edges[value] = node
+
+        stats["nodes_after"] = len(self.nodes)
+        stats["edges_after"] = self.edge_count()
+        if self.log is not None:
+            self.log.normalise()
+        return stats
+
+    def edge_count(self) -> int:
+        return sum(len(node.edges) for node in self.nodes.values()) // 2
 
     def to_json(self) -> dict:
         return {
@@ -180,7 +536,7 @@ class Graph:
                     "value": node.value,
                     "edges": [edge.value for edge in node.get_connected_edges()]
                 }
-                for node in self.nodes
+                for node in self.nodes.values()
             ]
         }
 
@@ -210,55 +566,342 @@ class Node:
     value = None
 
     # neighbours, what it can see
+    # value -> Node, used as an ordered set so dedupe is O(1)
     edges = None
 
+    # TypeRepr assigned when a basal type is propogated to this node
+    sutype = None
+
     def __repr__(self) -> str:
-        return f"Node(value = {self.value}, edges = {self.edges})"
+        return f"Node(value = {self.value}, edges = {list(self.edges)})"
 
     def __init__(self, uuid):
         self.value = uuid
-        self.edges = []
+        self.edges = {}
 
     def get_connected_edges(self):
-        return self.edges
+        return self.edges.values()
     
     # type edge = Node
     def add_edge(self, edge):
         """
         @note do not use this method directly, use graph.add_edge instead
         """
-        for i in self.edges:
-            if i.value == edge.value:
-                return # edge already exists
         if self.value != edge.value:
-            self.edges.append(edge)
+            self.edges.setdefault(edge.value, edge)
 
     def propogate_type(self, store, new_type:TypeRepr=None, visited=None, check=False):
         """
-        simple DFS to find all connected edges and set their type to new_type if provided
+        iterative DFS to find all connected edges and set their type to new_type if provided
         if new_type is not provided the current node's type is propogated
         """
         if visited is None:
             visited = set()
 
-        if self in visited:
+        if new_type is None:
+            new_type = self.sutype
+
+        primitive_str = Graph.get_primitive_type_string()
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node in visited:
+                continue
+            visited.add(node)
+
+            node.sutype = new_type
+            if node.value not in primitive_str:
+                store.set_on_type_equivalence(node.value, StoreValue(node.value, node.sutype, new_type), check=check)
+
+            stack.extend(e for e in node.edges.values() if e not in visited)
+
+
+
+class CompactGraph:
+    """
+    A memory lean alternative to Graph with the same surface
+
+    Node values are interned to dense integer ids and the edges live in flat
+    `array` buffers instead of per node Python objects. Edges are appended to an
+    edge list as they are added, a CSR (offsets + adjacency) view is built lazily
+    the first time the graph is traversed after a change, dropping repeated edges
+    from the list as it goes.
+
+    find_node and get_basal_types hand out detached Node handles, they only
+    carry the value and never any edges
+    """
+
+    def __repr__(self) -> str:
+        return f"CompactGraph(nodes = {len(self.values)}, edges = {len(self.edge_src)})"
+
+    def __init__(self):
+        # value -> id and id -> value
+        self.ids = {}
+        self.values = []
+        # undirected edge list in the order edges were added, repeats are dropped by build_csr
+        self.edge_src = array("i")
+        self.edge_dst = array("i")
+        # CSR view over the edge list, rebuilt when stale
+        self.offsets = array("i")
+        self.adjacency = array("i")
+        self.csr_edges = -1
+        self.basal_ids = array("i")
+        self.conflicts = None
+
+        for i in Graph.get_primitive_type_nodes():
+            self.add_node(i)
+            self.basal_ids.append(self.ids[i.value])
+
+    @staticmethod
+    def get_primitive_type_string():
+        return Graph.get_primitive_type_string()
+
+    def get_basal_types(self):
+        return [Node(self.values[i]) for i in self.basal_ids]
+
+    def add_basal_type(self, ty):
+        """
+        @side-effect: also adds the node to the graph
+        """
+        if not isinstance(ty, Node):
+            raise ValueError("ty must be of type Node")
+
+        if ty.value not in self.ids:
+            self.add_node(ty)
+            self.basal_ids.append(self.ids[ty.value])
+
+    def get_nodes(self):
+        return [Node(v) for v in self.values]
+
+    def find_node(self, name):
+        if name in self.ids:
+            return Node(name)
+        return None
+
+    def intern(self, value) -> int:
+        if (i := self.ids.get(value)) is None:
+            i = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return i
+
+    def add_node(self, node):
+        """
+        @param node: Node instance or node value
+        """
+        self.intern(node.value if isinstance(node, Node) else node)
+
+    def add_edge(self, node1, node2):
+        """
+        @param node1: node value
+        @param node2: node value
+        """
+        n1, n2 = self.ids.get(node1), self.ids.get(node2)
+        if n1 is None or n2 is None:
+            raise Exception("Node not found")
+        if n1 != n2:
+            self.append_edge(n1, n2)
+
+    def append_edge(self, n1, n2):
+        """
+        @param n1: node id
+        @param n2: node id
+        """
+        self.edge_src.append(n1)
+        self.edge_dst.append(n2)
+
+    def dedupe_edges(self):
+        """
+        drops every edge added before, in either direction, keeping the first one
+        so the edge list stays in the order edges were added
+        """
+        # both ids of every edge packed into one int, lower id first
+        keys = array("q", [(a << 32 | b) if a < b else (b << 32 | a)
+                           for a, b in zip(self.edge_src, self.edge_dst, strict=True)])
+        # sorted is stable, the first of a run of equal keys is the first one added
+        keep = bytearray(len(keys))
+        prev = -1
+        for i in sorted(range(len(keys)), key=keys.__getitem__):
+            if keys[i] != prev:
+                keep[i] = 1
+                prev = keys[i]
+        if keep.count(0):
+            self.edge_src = array("i", compress(self.edge_src, keep))
+            self.edge_dst = array("i", compress(self.edge_dst, keep))
+
+    def build_csr(self):
+        """
+        dedupes the edge list then counting sorts it into offsets + adjacency,
+        O(V + E log E)
+        """
+        if self.csr_edges == len(self.edge_src) and len(self.offsets) == len(self.values) + 1:
             return
-        
-        visited.add(self)
 
-        if new_type is not None:
-            self.sutype = new_type
-        else:
-            new_type = self.sutype
+        self.dedupe_edges()
+        n = len(self.values)
+        degree = array("i", bytes(4 * (n + 1)))
+        for a, b in zip(self.edge_src, self.edge_dst, strict=True):
+            degree[a + 1] += 1
+            degree[b + 1] += 1
+        for i in range(n):
+            degree[i + 1] += degree[i]
+
+        fill = array("i", degree)
+        adjacency = array("i", bytes(4 * degree[n]))
+        for a, b in zip(self.edge_src, self.edge_dst, strict=True):
+            adjacency[fill[a]] = b
+            fill[a] += 1
+            adjacency[fill[b]] = a
+            fill[b] += 1
+
+        self.offsets = degree
+        self.adjacency = adjacency
+        self.csr_edges = len(self.edge_src)
+
+    def neighbours(self, i):
+        self.build_csr()
+        return self.adjacency[self.offsets[i]:self.offsets[i + 1]]
+
+    def are_connected(self, node1, node2):
+        n1, n2 = self.ids.get(node1), self.ids.get(node2)
+        if n1 is None or n2 is None:
+            return False
+        return n2 in self.neighbours(n1)
+
+    def path_exists(self, node1, node2):
+        n1, n2 = self.ids.get(node1), self.ids.get(node2)
+        if n1 is None or n2 is None:
+            return False
+
+        self.build_csr()
+        visited = bytearray(len(self.values))
+        visited[n1] = 1
+        queue = deque([n1])
+        while queue:
+            i = queue.popleft()
+            for j in self.adjacency[self.offsets[i]:self.offsets[i + 1]]:
+                if j == n2:
+                    return True
+                if not visited[j]:
+                    visited[j] = 1
+                    queue.append(j)
+        return False
+
+    def propogate(self, store, sources, check=False):
+        """
+        same as Graph.propogate, over the CSR buffers
+        """
+        self.build_csr()
+        origin = array("i", [-1]) * len(self.values)
+        types = {}
+        queue = deque()
+        self.conflicts = []
+        reported = set()
+
+        for value, new_type in sources:
+            i = self.ids[value]
+            types[i] = new_type
+            if origin[i] != -1:
+                self.conflicts.append((value, self.values[origin[i]], value))
+                continue
+            origin[i] = i
+            queue.append(i)
+
+        primitive_str = self.get_primitive_type_string()
+        while queue:
+            i = queue.popleft()
+            source = origin[i]
+            value = self.values[i]
+            if value not in primitive_str:
+                new_type = types[source]
+                store.set_on_type_equivalence(value, StoreValue(value, new_type, new_type), check=check)
+
+            for j in self.adjacency[self.offsets[i]:self.offsets[i + 1]]:
+                seen = origin[j]
+                if seen == -1:
+                    origin[j] = source
+                    queue.append(j)
+                elif seen != source and (pair := frozenset((seen, source))) not in reported:
+                    reported.add(pair)
+                    self.conflicts.append((self.values[j], self.values[seen], self.values[source]))
+
+        return self.conflicts
+
+    def conflicting_components(self, basal=None) -> list:
+        """
+        same as Graph.conflicting_components, only the components holding a basal
+        type are labelled, by a BFS over the CSR buffers
+        """
+        if basal is None:
+            basal = [self.values[i] for i in self.basal_ids]
+
+        self.build_csr()
+        component = array("i", [-1]) * len(self.values)
+        found = {}
+        for value in basal:
+            if (i := self.ids.get(value)) is None:
+                continue
+            if component[i] == -1:
+                component[i] = i
+                queue = deque([i])
+                while queue:
+                    k = queue.popleft()
+                    for j in self.adjacency[self.offsets[k]:self.offsets[k + 1]]:
+                        if component[j] == -1:
+                            component[j] = i
+                            queue.append(j)
+            found.setdefault(component[i], []).append(value)
+
+        return [v for v in found.values() if len(v) > 1]
+
+    def memory_usage(self) -> dict:
+        """
+        approximate resident bytes, interned strings and the intern table are
+        charged to nodes while the edge list and the CSR view are charged to edges
+        """
+        self.build_csr()
+        node_bytes = sys.getsizeof(self.ids) + sys.getsizeof(self.values) + sys.getsizeof(self.offsets)
+        node_bytes += sum(sys.getsizeof(v) for v in self.values)
+        edge_bytes = sys.getsizeof(self.edge_src) + sys.getsizeof(self.edge_dst) + sys.getsizeof(self.adjacency)
+
+        nodes, edges = len(self.values), len(self.edge_src)
+        return {
+            "nodes": nodes,
+            "edges": edges,
+            "node_bytes": node_bytes,
+            "edge_bytes": edge_bytes,
+            "bytes_per_node": node_bytes / nodes if nodes else 0,
+            "bytes_per_edge": edge_bytes / edges if edges else 0,
+        }
+
+    def to_json(self) -> dict:
+        self.build_csr()
+        return {
+            "nodes": [
+                {
+                    "value": value,
+                    "edges": [self.values[j] for j in dict.fromkeys(self.neighbours(i))]
+                }
+                for i, value in enumerate(self.values)
+            ]
+        }
+
+    @classmethod
+    def from_json(cls, json_data):
+        graph_instance = cls()
+        graph_data = json.loads(json_data)
 
-        if self.value == '0522ea9ed76c4277a38cbe518a1af134':
-            pass
-        if self.value not in Graph.get_primitive_type_string():
-            store.set_on_type_equivalence(self.value, StoreValue(self.value, self.sutype, new_type), check=check)
+        for node_data in graph_data.get('nodes', []):
+            graph_instance.intern(node_data.get('value'))
 
-        for edge in self.edges:
-            edge.propogate_type(store, new_type, visited, check=check)
+        # edges are listed from both ends, keep one direction only
+        for node_data in graph_data.get('nodes', []):
+            i = graph_instance.ids[node_data.get('value')]
+            for edge_value in node_data.get('edges', []):
+                j = graph_instance.ids.get(edge_value)
+                if j is not None and i < j:
+                    graph_instance.append_edge(i, j)
 
+        return graph_instance
 
 
 def test_test():
@@ -283,6 +926,76 @@ def test_test():
     assert graph.path_exists("Number", "y") is True
     assert graph.are_connected("Number", "String") is False
 
+    graph.add_edge("x", "Number")
+    assert len(graph.find_node("x").get_connected_edges()) == 2
+    assert graph.find_node("y") is node_vary
+
+    compact = CompactGraph()
+    for i in ["x", "y", "z"]:
+        compact.add_node(Node(i))
+    compact.add_edge("Number", "x")
+    compact.add_edge("x", "y")
+    compact.add_edge("y", "x")
+    compact.add_edge("Number", "x")
+    # repeats are dropped once the graph is traversed
+    assert len(compact.edge_src) == 4
+    assert list(compact.neighbours(compact.ids["x"])) == [compact.ids["Number"], compact.ids["y"]] and len(compact.edge_src) == 2
+
+    assert compact.are_connected("Number", "x") is True
+    assert compact.path_exists("Number", "y") is True
+    assert compact.path_exists("Number", "z") is False
+    graph.add_node(Node("z"))
+    graph.add_edge("z", "String")
+    assert graph.conflicting_components() == []
+    graph.add_edge("z", "y")
+    assert graph.conflicting_components() == [["String", "Number"]]
+    graph.remove_edge("z", "y")
+    assert graph.conflicting_components() == []
+    assert graph.path_exists("y", "Number") is True
+    graph.remove_node("x")
+    assert graph.path_exists("y", "Number") is False
+    graph.add_basal_type(Node("Currency"))
+    graph.add_edge("z", "Currency")
+    graph.remove_basal_type("Currency")
+    assert graph.find_node("Currency") is None and graph.find_node("z").edges.keys() == {"String"}
+    try:
+        graph.remove_basal_type("Number")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("primitive types cannot be removed")
+
+    graph = Graph()
+    for i in ["x", "y", "z"]:
+        graph.add_node(Node(i))
+    graph.add_edge("Number", "x")
+    graph.add_edge("x", "y")
+    graph.add_edge("y", "z")
+    graph.add_edge("z", "x")
+    stats = graph.normalise()
+    assert stats["edges_before"] == 4 and stats["edges_after"] == 3
+    assert graph.are_connected("Number", "z") is True
+    assert graph.are_connected("x", "y") is False
+    assert graph.path_exists("x", "y") is True
+
+    # union links in the order given and labels components like add_edge does
+    bulk = Graph()
+    bulk.union(["p", "q", "r", "s"], [("p", ["q"]), ("q", ["p", "Number"]), ("Number", ["q", "r"]), ("r", ["Number"])])
+    assert list(bulk.find_node("q").edges) == ["p", "Number"] and bulk.basal_type_of("r") == "Number"
+    assert bulk.component_of("p") == bulk.component_of("r") != bulk.component_of("s")
+    try:
+        bulk.union(["t"], [("t", ["missing"])])
+    except Exception as e:
+        assert str(e) == "Node not found"
+    else:
+        raise AssertionError("missing neighbour")
+
+    assert CompactGraph.from_json(json.dumps(compact.to_json())).path_exists("y", "Number") is True
+    assert compact.conflicting_components() == []
+    compact.add_edge("z", "String")
+    compact.add_edge("z", "y")
+    assert compact.conflicting_components() == [["String", "Number"]]
+
     print("tests passed")
 
 if __name__ == "__main__":
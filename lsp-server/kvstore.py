@@ -1,10 +1,14 @@
+from contextlib import contextmanager
 import json
 
 
-from sutypes import SuTypes, TypeRepr
+from sutypes import SuTypes, SuTypesEncoder, TypeRepr
 
 
 
+STORE_FORMAT = {"format": "typeloom-store", "version": 2}
+
+
 class StoreValue:
 
     def __init__(self, value, actual: TypeRepr, inferred: TypeRepr) -> None:
@@ -37,46 +41,342 @@ class SymbolTable:
     It is a two way mapping
     """
 
+    def __init__(self):
+        # (method, name) -> [ID], IDs are kept in the order they appear
+        self.ids = {}
+        # ID -> name and ID -> method
+        self.names = {}
+        self.owners = {}
+        # method -> {name}, the methods that have been indexed
+        self.indexed = {}
+
+    def __repr__(self) -> str:
+        return f"SymbolTable({self.ids})"
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, method, name, var_id):
+        if var_id in self.names:
+            return
+        self.ids.setdefault((method, name), []).append(var_id)
+        self.indexed.setdefault(method, {})[name] = None
+        self.names[var_id] = name
+        self.owners[var_id] = method
+
+    def lookup(self, method, name) -> list:
+        """
+        all IDs bound to the variable name inside method
+        """
+        return self.ids.get((method, name), [])
+
+    def name_of(self, var_id):
+        return self.names.get(var_id, None)
+
+    def method_of(self, var_id):
+        return self.owners.get(var_id, None)
+
+    def index_method(self, method, func):
+        """
+        @param func: the Function node of a method as found in ast.json
+        single pass over the parameters and body, every Identifier is recorded
+        """
+        self.indexed.setdefault(method, {})
+        for p in func.get("Parameters") or []:
+            self.add(method, p["Value"], p["ID"])
+
+        stack = [stmt for line in reversed(func.get("Body") or []) for stmt in reversed(line)]
+        while stack:
+            stmt = stack.pop()
+            if stmt["Tag"] == "Identifier":
+                self.add(method, stmt["Value"], stmt["ID"])
+            stack.extend(reversed(stmt.get("Args") or []))
+
+    def remove_method(self, method):
+        for name in self.indexed.pop(method, {}):
+            for var_id in self.ids.pop((method, name), []):
+                del self.names[var_id]
+                del self.owners[var_id]
+
+    def merge(self, other):
+        for (method, name), ids in other.ids.items():
+            for var_id in ids:
+                self.add(method, name, var_id)
+        for method in other.indexed:
+            self.indexed.setdefault(method, {})
+
+    @classmethod
+    def from_methods(cls, methods):
+        table = cls()
+        for k, v in methods.items():
+            table.index_method(k, v)
+        return table
+
 
 
 class KVStore:
 
-    db = {}
+    # var_id -> StoreValue, every instance owns its own
+    db = None
+
+    # method currently writing to the store, see KVStore.drop_method
+    owner = None
+
+    # receives every mutation once it succeeded, see changelog.ChangeLog
+    log = None
+
+    # undo entries of the open transaction, see KVStore.begin
+    journal = None
 
     def __init__(self):
-        pass
+        self.db = {}
+        self.symbols = SymbolTable()
+        # method -> {var_id} written while that method was the owner
+        self.owned = {}
+        # shard key (file or method) -> KVStore, see KVStore.shard
+        self.shards = {}
+        # secondary indexes, variable name -> {var_id} and inferred type name -> {var_id}
+        # the owning method index is owned, see KVStore.query
+        self.by_name = {}
+        self.by_type = {}
+
+    def __len__(self) -> int:
+        return len(self.db)
+
+    def size(self) -> int:
+        return len(self.db)
+
+    def shard(self, key):
+        """
+        @return: the shard for key, created empty on first use
+        shards are independent stores that can be filled in parallel and later
+        folded back in with merge_shards
+        """
+        if (shard := self.shards.get(key)) is None:
+            shard = self.shards[key] = KVStore()
+        return shard
+
+    def shard_sizes(self) -> dict:
+        return {k: v.size() for k, v in self.shards.items()}
+
+    def merge(self, other):
+        """
+        writes every value of other through set, so the usual conflict rules apply
+        @raises TypeError: on the first conflicting value
+        """
+        for k, v in other.items():
+            self.set(k, v)
+        for method, ids in other.owned.items():
+            self.owned.setdefault(method, {}).update(ids)
+        self.symbols.merge(other.symbols)
+
+    def merge_shards(self):
+        """
+        merges the shards in the order they were created and drops them
+        """
+        for key in list(self.shards):
+            self.merge(self.shards[key])
+            del self.shards[key]
 
     def to_json(self) -> str:
         json_data = {}
-        for k, v in self.db.items():
+        for k, v in self.items():
             json_data[k] = v.to_json()
         return json_data
 
     def get(self, var) -> SuTypes | None:
         return self.db.get(var, None)
 
+    def current(self, var_id) -> StoreValue | None:
+        """
+        the value set checks a new one against, unlike get it is not a lookup
+        made on behalf of a caller, see spillstore.BoundedKVStore
+        """
+        return self.db.get(var_id, None)
+
+    def lookup_symbol(self, method, name) -> list:
+        """
+        hover query, every stored value for the variable name inside method
+        """
+        return [(i, v) for i in self.symbols.lookup(method, name) if (v := self.get(i)) is not None]
+
+    def query(self, name=None, type_name=None, method=None) -> list:
+        """
+        editor queries, every stored (var_id, StoreValue) matching all of the given
+        variable name, inferred type name and owning method, in insertion order
+        """
+        found = None
+        for index, key in ((self.by_name, name), (self.by_type, type_name), (self.owned, method)):
+            if key is None:
+                continue
+            ids = index.get(key, {})
+            found = ids if found is None else {i: None for i in found if i in ids}
+        if found is None:
+            return list(self.items())
+        return [(i, v) for i in found if (v := self.get(i)) is not None]
+
+    def items(self) -> list:
+        return list(self.db.items())
+
+    def unresolved(self, method=None) -> list:
+        """
+        values still inferred as Any or Unknown, optionally only the ones owned by method
+        """
+        return self.query(type_name="Any", method=method) + self.query(type_name="Unknown", method=method)
+
+    def begin(self):
+        """
+        opens a transaction, every write until commit can be undone with rollback
+        """
+        if self.journal is not None:
+            raise ValueError("a transaction is already open")
+        self.journal = []
+
+    def commit(self):
+        self.journal = None
+
+    def rollback(self):
+        """
+        undoes every write since begin, newest first, and closes the transaction
+        """
+        journal, self.journal = self.journal or [], None
+        for entry in reversed(journal):
+            match entry:
+                case ("owned", method, var_id):
+                    ids = self.owned[method]
+                    del ids[var_id]
+                    if not ids:
+                        del self.owned[method]
+                case ("value", var_id, None):
+                    self.delete(var_id)
+                case ("value", var_id, previous):
+                    self.write(var_id, previous)
+                    if self.log is not None:
+                        self.log.set(var_id, previous)
+
+    @contextmanager
+    def transaction(self):
+        """
+        with store.transaction(): ...
+        commits when the block finishes, rolls back and re-raises when it raises
+        """
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+
+    def write(self, var_id, value):
+        """
+        stores value without any checks, keeps the secondary indexes in sync
+        """
+        if self.journal is not None:
+            self.journal.append(("value", var_id, self.db.get(var_id)))
+        if (curr_val := self.db.get(var_id)) is not None:
+            self.unindex(var_id, curr_val)
+        self.db[var_id] = value
+        self.by_name.setdefault(value.value, {})[var_id] = None
+        self.by_type.setdefault(value.inferred.name, {})[var_id] = None
+
+    def unindex(self, var_id, value):
+        for index, key in ((self.by_name, value.value), (self.by_type, value.inferred.name)):
+            ids = index[key]
+            del ids[var_id]
+            if not ids:
+                del index[key]
+
+    def delete(self, var_id):
+        if (value := self.db.pop(var_id, None)) is None:
+            return
+        if self.journal is not None:
+            self.journal.append(("value", var_id, value))
+        self.unindex(var_id, value)
+        if self.log is not None:
+            self.log.delete(var_id)
+
+    def drop_method(self, method) -> list:
+        """
+        removes every value written on behalf of method and forgets its symbols
+        @return: the removed IDs
+        """
+        removed = list(self.owned.pop(method, {}))
+        for var_id in removed:
+            self.delete(var_id)
+        self.symbols.remove_method(method)
+        return removed
+
     def set(self, var_id, value) ->  bool:
         if not isinstance(value, StoreValue):
             raise ValueError("Value should be of type StoreVale")
 
-        if (curr_val := self.get(var_id)) is None:
-            self.db[var_id] = value
+        if self.owner is not None:
+            ids = self.owned.setdefault(self.owner, {})
+            if var_id not in ids:
+                ids[var_id] = None
+                if self.journal is not None:
+                    self.journal.append(("owned", self.owner, var_id))
+
+        if (curr_val := self.current(var_id)) is None:
+            self.write(var_id, value)
         elif curr_val is not None:
             # check if the new type is a subtype of the existing type
             # or if it is an equivalent type
             # if not check_type_equal_or_subtype(value.inferred, curr_val.inferred):
-            if curr_val.inferred == TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.Any)):
+            if curr_val.inferred == TypeRepr.primitive(SuTypes.Any):
                 # if current is Any then it should be overwritable
-                self.db[var_id] = value
+                self.write(var_id, value)
             elif not (curr_val.inferred <= value.inferred):
                 raise TypeError(f"Conflicting inferred types for variable {var_id}\nexisting: {curr_val.inferred}, got: {value.inferred}") 
             else:
-                self.db[var_id] = value
+                self.write(var_id, value)
         else:
-            raise ValueError(f"Variable already exists in the store\nexists: {self.get(var_id)},\ngot: {value}")
+            raise ValueError(f"Variable already exists in the store\nexists: {curr_val},\ngot: {value}")
+
+        if self.log is not None:
+            self.log.set(var_id, value)
+
+    def set_many(self, values, check=True):
+        """
+        set for every var_id -> StoreValue of values at once, only the var_ids
+        already stored can conflict so only those are checked, all of them before
+        anything is written, the rest is written without going through set
+
+        @param check: False for values known not to conflict, such as a cached
+                      fragment merged after the same methods as before, see methodcache.py
+        @raises TypeError: on the first conflict in the order of values, nothing is written
+        """
+        stored = [(k, curr) for k in values.keys() & self.db.keys() if (curr := self.current(k)) is not None]
+        if check:
+            any_t = TypeRepr.primitive(SuTypes.Any)
+            conflicts = {k for k, curr in stored if not (curr.inferred == any_t or curr.inferred <= values[k].inferred)}
+            if conflicts:
+                var_id = next(k for k in values if k in conflicts)
+                raise TypeError(f"Conflicting inferred types for variable {var_id}\nexisting: {self.current(var_id).inferred}, got: {values[var_id].inferred}")
+
+        if self.owner is not None:
+            ids = self.owned.setdefault(self.owner, {})
+            if self.journal is not None:
+                self.journal.extend(("owned", self.owner, k) for k in values if k not in ids)
+            ids.update(dict.fromkeys(values))
+        if self.journal is not None:
+            self.journal.extend(("value", k, self.db.get(k)) for k in values)
+
+        for k, curr in stored:
+            self.unindex(k, curr)
+        self.db.update(values)
+        by_name, by_type = self.by_name, self.by_type
+        for k, v in values.items():
+            by_name.setdefault(v.value, {})[k] = None
+            by_type.setdefault(v.inferred.name, {})[k] = None
+
+        if self.log is not None:
+            for k, v in values.items():
+                self.log.set(k, v)
 
     def set_on_type_equivalence(self, var_id, value, check=False):
-        if (val := self.get(var_id)) is None:
+        if (val := self.current(var_id)) is None:
             self.set(var_id, value)
             return
 
@@ -97,23 +397,81 @@ class KVStore:
 
 
 
+    @staticmethod
+    def value_from_json(v: dict) -> StoreValue:
+        """
+        @param v: a value as written by to_json, types are JSON strings holding a JSON string definition
+        """
+        value = v.get("value")
+        actual, inferred = json.loads(v.get("actual")), json.loads(v.get("inferred"))
+        actual_meaning = json.loads(actual["definition"])
+        inferred_meaning = json.loads(inferred["definition"])
+        actual_meaning["name"] = actual["name"]
+        inferred_meaning["name"] = inferred["name"]
+        actual, inferred = TypeRepr.of(actual_meaning), TypeRepr.of(inferred_meaning)
+        return StoreValue(
+            value,
+            actual,
+            inferred,
+            )
+
     @classmethod
     def from_json(cls, json_data: dict):
         kv_instance = cls()
 
         for k, v in json_data.items():
-            value = v.get("value")
-            actual, inferred = json.loads(v.get("actual")), json.loads(v.get("inferred"))
-            actual_meaning = json.loads(actual["definition"])
-            inferred_meaning = json.loads(inferred["definition"])
-            actual_meaning["name"] = actual["name"]
-            inferred_meaning["name"] = inferred["name"]
-            actual, inferred = TypeRepr(actual_meaning), TypeRepr(inferred_meaning)
-            store_value = StoreValue(
-                value,
-                actual,
-                inferred,
-                )
-            kv_instance.set(k, store_value)
+            kv_instance.set(k, cls.value_from_json(v))
+
+        return kv_instance
+
+    def write_flat(self, fobj):
+        """
+        flat schema, a header line then one JSON object per value with the type
+        definitions inlined, so every line is decoded exactly once
+
+            {"format": "typeloom-store", "version": 2}
+            {"id": ..., "value": ..., "actual": {"form": ..., "name": ..., "meaning": ...}, "inferred": {...}}
+        """
+        fobj.write(json.dumps(STORE_FORMAT) + "\n")
+        for k, v in self.items():
+            line = {"id": k, **self.value_to_flat(v)}
+            fobj.write(json.dumps(line, cls=SuTypesEncoder) + "\n")
+
+    @staticmethod
+    def value_to_flat(v: StoreValue) -> dict:
+        return {"value": v.value, "actual": v.actual.to_flat(), "inferred": v.inferred.to_flat()}
+
+    @staticmethod
+    def value_from_flat(v: dict) -> StoreValue:
+        return StoreValue(v["value"], TypeRepr.of(v["actual"]), TypeRepr.of(v["inferred"]))
+
+    @classmethod
+    def iter_file(cls, path):
+        """
+        yields (var_id, StoreValue) one at a time
+        reads the flat schema line by line, the older to_json format is loaded whole
+        """
+        with open(path, "r") as fobj:
+            try:
+                header = json.loads(fobj.readline())
+            except json.JSONDecodeError:
+                header = None
+
+            if header != STORE_FORMAT:
+                fobj.seek(0)
+                for k, v in json.load(fobj).items():
+                    yield k, cls.value_from_json(v)
+                return
 
+            for line in fobj:
+                if not line.strip():
+                    continue
+                v = json.loads(line)
+                yield v["id"], cls.value_from_flat(v)
+
+    @classmethod
+    def from_file(cls, path):
+        kv_instance = cls()
+        for k, v in cls.iter_file(path):
+            kv_instance.set(k, v)
         return kv_instance
\ No newline at end of file
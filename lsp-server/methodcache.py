@@ -0,0 +1,331 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+from parallel import Fragment, collector_paused, infer_fragments, merge
+from sutypes import SuTypesEncoder
+
+"""
+Restores unchanged methods from a cache instead of inferring them again
+
+A method is keyed by a hash of everything its inference reads: its name,
+parameters and body, the parameter types given for it, its custom type bindings
+with the typedefs they name, and the attributes its body refers to. Its fragment
+(see parallel.Fragment) is stored in a sqlite file under that key, one row per
+method of each class file so an edited method replaces its old entry and a
+method of the same name in another file does not.
+
+On the next run every method whose key is cached is merged straight from the
+cache, only the others are inferred, then all fragments are merged in the order
+of methods as parallel.infer_parallel does.
+
+Walking every method for its key costs about as much as a tenth of inferring it,
+so when the methods come from a file the keys of a run are also recorded under
+a hash of the file and of the other inputs (see source_key). While neither
+changes the next run reuses them without looking at any method. A fragment
+merged into an empty store after the same methods as on a previous run, which
+it did not conflict with then, is merged without checking it again.
+"""
+
+# part of every key, bump it when a change to inference changes what a method infers to
+CACHE_VERSION = 2
+
+# keys looked up per query by MethodCache.get_many
+KEYS_BATCH = 512
+
+# layout of the sqlite file, a file of another layout is emptied on open
+SCHEMA_VERSION = 1
+
+
+def hash_tree(nodes):
+    """
+    walks the AST under nodes iteratively, so deep expressions do not hit the
+    recursion limit, and collects the fields inference reads (see astnodes.lower)
+
+    @return: (fields, names of the Member nodes in order)
+    """
+    fields, members = [], []
+    stack = list(reversed(nodes))
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            fields.append(len(node))
+            stack.extend(reversed(node))
+            continue
+        args = node.get("Args") or []
+        fields.extend((node.get("Tag"), node.get("Value"), node.get("Type_t"), node.get("ID"), len(args)))
+        if node.get("Tag") == "Member":
+            members.append(node.get("Value"))
+        stack.extend(reversed(args))
+    return fields, members
+
+def method_key(fn, func, typedefs, bindings, param_t, attributes) -> str:
+    """
+    @param func: the Function node of method fn as found in ast.json
+    """
+    fields, members = hash_tree([func.get("Parameters") or [], func.get("Body") or []])
+    bound = {k: v for k, v in bindings.items() if k.startswith(f"{fn}_")}
+    referenced = {
+        "version": CACHE_VERSION,
+        "method": fn,
+        "parameters": param_t.get(fn),
+        "bindings": bound,
+        "typedefs": {v: typedefs.get(v) for v in bound.values()},
+        "attributes": {m: attributes.get(m) for m in members},
+    }
+    h = hashlib.sha256(repr(fields).encode())
+    h.update(json.dumps(referenced, sort_keys=True, cls=SuTypesEncoder).encode())
+    return h.hexdigest()
+
+
+def source_key(path, typedefs, bindings, param_t) -> str:
+    """
+    content hash of the class file at path and of the inputs read next to it,
+    the method keys of a run depend on nothing else
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as fobj:
+        while chunk := fobj.read(1 << 20):
+            h.update(chunk)
+    inputs = {"version": CACHE_VERSION, "typedefs": typedefs, "bindings": bindings, "parameters": param_t}
+    h.update(json.dumps(inputs, sort_keys=True, cls=SuTypesEncoder).encode())
+    return h.hexdigest()
+
+
+class MethodCache:
+
+    def __repr__(self) -> str:
+        return f"MethodCache(path = {self.path}, hits = {self.hits}, misses = {self.misses})"
+
+    def __init__(self, path):
+        self.path = path
+        self.disk = sqlite3.connect(path)
+        if self.disk.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            for table in ("fragments", "sources", "merged"):
+                self.disk.execute(f"DROP TABLE IF EXISTS {table}")
+            self.disk.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        # source is the class file the method was read from, empty when unknown
+        self.disk.execute("CREATE TABLE IF NOT EXISTS fragments (key TEXT PRIMARY KEY, source TEXT, method TEXT, fragment TEXT)")
+        self.disk.execute("CREATE INDEX IF NOT EXISTS fragments_method ON fragments (source, method)")
+        # path -> source_key and method keys of the last run over that file
+        self.disk.execute("CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, digest TEXT, keys TEXT)")
+        # (source, method) -> hash of the keys of every method merged before it and
+        # its own, on the last run that merged it into an empty store without a conflict
+        self.disk.execute("CREATE TABLE IF NOT EXISTS merged (source TEXT, method TEXT, prefix TEXT, PRIMARY KEY (source, method))")
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self.disk.commit()
+        self.disk.close()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": self.disk.execute("SELECT COUNT(*) FROM fragments").fetchone()[0],
+        }
+
+    def get(self, key):
+        """
+        @return: the cached Fragment or None
+        """
+        return self.get_many([key])[key]
+
+    def get_many(self, keys) -> dict:
+        """
+        @return: key -> the cached Fragment or None, read a batch of keys per query
+        """
+        found = dict.fromkeys(keys)
+        keys = list(found)
+        for i in range(0, len(keys), KEYS_BATCH):
+            batch = keys[i:i + KEYS_BATCH]
+            rows = self.disk.execute(
+                f"SELECT key, fragment FROM fragments WHERE key IN ({', '.join('?' * len(batch))})", batch)
+            for key, fragment in rows:
+                found[key] = Fragment.from_json(json.loads(fragment))
+        hits = sum(fragment is not None for fragment in found.values())
+        self.hits += hits
+        self.misses += len(found) - hits
+        return found
+
+    def put(self, key, fragment, source=""):
+        """
+        replaces whatever was cached for the same method of the same source
+        """
+        self.disk.execute("DELETE FROM fragments WHERE source = ? AND method = ?", (source, fragment.method))
+        self.disk.execute("INSERT OR REPLACE INTO fragments VALUES (?, ?, ?, ?)",
+                          (key, source, fragment.method, json.dumps(fragment.to_json(), cls=SuTypesEncoder)))
+
+    def source_keys(self, path, digest):
+        """
+        @return: method -> key recorded for the file at path, None unless it was
+                 recorded under the same source_key
+        """
+        row = self.disk.execute("SELECT digest, keys FROM sources WHERE path = ?", (path,)).fetchone()
+        if row is None or row[0] != digest:
+            return None
+        return json.loads(row[1])
+
+    def put_source_keys(self, path, digest, keys):
+        self.disk.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?)", (path, digest, json.dumps(keys)))
+
+    def merged(self, source="") -> dict:
+        """
+        @return: method -> prefix it was last merged after, see the merged table
+        """
+        return dict(self.disk.execute("SELECT method, prefix FROM merged WHERE source = ?", (source,)))
+
+    def put_merged(self, method, prefix, source=""):
+        self.disk.execute("INSERT OR REPLACE INTO merged VALUES (?, ?, ?)", (source, method, prefix))
+
+
+def infer_cached(methods, typedefs, bindings, param_t, store, graph, attributes, cache, jobs=None, source=None):
+    """
+    runs process_custom_types, process_parameters and process_methods over the
+    methods missing from cache and merges every method into store and graph
+
+    @param jobs: number of worker processes for the missing methods, see parallel.py
+    @param source: path of the class file methods were read from, when given the
+                   method keys are reused while it is unchanged, see source_key,
+                   and only its own methods replace each other in the cache
+    @raises TypeError: on the first conflict in the order of methods, the methods
+                       before it are merged
+    """
+    digest = None if source is None else source_key(source, typedefs, bindings, param_t)
+    if digest is None or (keys := cache.source_keys(source, digest)) is None or list(keys) != list(methods):
+        keys = {fn: method_key(fn, func, typedefs, bindings, param_t, attributes) for fn, func in methods.items()}
+        if digest is not None:
+            cache.put_source_keys(source, digest, keys)
+
+    scope = source or ""
+    cached = cache.get_many(keys.values())
+    fragments = {fn: cached[key] for fn, key in keys.items()}
+
+    error = None
+    missing = {fn: methods[fn] for fn, fragment in fragments.items() if fragment is None}
+    if missing:
+        for inferred, error in infer_fragments(missing, typedefs, bindings, param_t, attributes, jobs):
+            for fragment in inferred:
+                fragments[fragment.method] = fragment
+                cache.put(keys[fragment.method], fragment, scope)
+            if error is not None:
+                break
+
+    # a merge into an empty store only depends on the fragments before it
+    clean = len(store) == 0
+    merged = cache.merged(scope) if clean else {}
+    prefix = hashlib.sha256()
+    # only the merge runs with the collector paused, as in parallel.merge
+    with collector_paused():
+        for fn in methods:
+            if (fragment := fragments[fn]) is None:
+                raise error
+            prefix.update(keys[fn].encode())
+            checked = prefix.hexdigest()
+            if merged.get(fn) == checked:
+                merge([fragment], store, graph, check=False)
+            else:
+                merge([fragment], store, graph)
+                if clean:
+                    cache.put_merged(fn, checked, scope)
+
+def test_test():
+    import tempfile
+
+    from bench import build_class
+    from graph import Graph
+    from kvstore import KVStore
+
+    path = os.path.join(tempfile.mkdtemp(), "methods.sqlite")
+    methods = build_class(6, 3)
+
+    def run(methods, typedefs=None, bindings=None, source=None):
+        store, graph = KVStore(), Graph()
+        with MethodCache(path) as cache:
+            infer_cached(methods, typedefs or {}, bindings or {}, {}, store, graph, {}, cache, source=source)
+            return store, graph, cache.stats()
+
+    cold_store, cold_graph, stats = run(methods)
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (0, 6, 6)
+
+    warm_store, warm_graph, stats = run(methods)
+    assert (stats["hits"], stats["misses"]) == (6, 0)
+    assert list(warm_store.to_json().items()) == list(cold_store.to_json().items())
+    assert warm_graph.to_json() == cold_graph.to_json() and warm_store.owned == cold_store.owned
+    assert warm_store.symbols.ids == cold_store.symbols.ids
+    # the warm run merged every fragment after the same methods as the cold one,
+    # unchecked, and still agrees with it
+    with MethodCache(path) as cache:
+        assert list(cache.merged()) == list(methods)
+
+    # adding a line only infers the edited method again
+    methods["method_2"]["Body"] = methods["method_2"]["Body"] + methods["method_1"]["Body"][:1]
+    _, _, stats = run(methods)
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (5, 1, 6)
+
+    # so does a binding, and a typedef only matters to the methods bound to it
+    typedefs = {"Currency": {"form": "Union", "name": "Currency", "meaning": ["USD", "CAD"]}}
+    _, _, stats = run(methods, typedefs, {"method_4_y": "Currency"})
+    assert (stats["hits"], stats["misses"]) == (5, 1)
+    typedefs["Unused"] = {"form": "Union", "name": "Unused", "meaning": ["A", "B"]}
+    _, _, stats = run(methods, typedefs, {"method_4_y": "Currency"})
+    assert (stats["hits"], stats["misses"]) == (6, 0)
+
+    # keyed by the class file, the keys of an unchanged file are reused
+    source = os.path.join(os.path.dirname(path), "ast.json")
+
+    def write_source():
+        with open(source, "w") as fobj:
+            json.dump({"Methods": methods}, fobj)
+
+    write_source()
+    run(methods, source=source)
+    digest = source_key(source, {}, {}, {})
+    with MethodCache(path) as cache:
+        assert cache.source_keys(source, digest) == {fn: method_key(fn, func, {}, {}, {}, {}) for fn, func in methods.items()}
+    _, _, stats = run(methods, source=source)
+    assert (stats["hits"], stats["misses"]) == (6, 0)
+    methods["method_3"]["Body"] = methods["method_3"]["Body"][:1]
+    write_source()
+    assert source_key(source, {}, {}, {}) != digest
+    _, _, stats = run(methods, source=source)
+    assert (stats["hits"], stats["misses"]) == (5, 1)
+
+    # methods of the same name from another class file keep their own entries
+    other_source = os.path.join(os.path.dirname(path), "other.json")
+    other = build_class(6, 2)
+    with open(other_source, "w") as fobj:
+        json.dump({"Methods": other}, fobj)
+    with MethodCache(path) as cache:
+        entries = cache.stats()["entries"]
+    _, _, stats = run(other, source=other_source)
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (0, 6, entries + 6)
+    _, _, stats = run(methods, source=source)
+    assert (stats["hits"], stats["misses"]) == (6, 0)
+    _, _, stats = run(other, source=other_source)
+    assert (stats["hits"], stats["misses"]) == (6, 0)
+
+    # a file of an older layout is emptied rather than misread
+    with MethodCache(path) as cache:
+        cache.disk.execute("PRAGMA user_version = 0")
+    with MethodCache(path) as cache:
+        assert cache.stats()["entries"] == 0 and cache.merged() == {}
+
+    # keys do not depend on how deep the body is
+    deep = {"Tag": "Constant", "Value": "1", "Type_t": "Number", "Args": None, "ID": "deep"}
+    for i in range(10**4):
+        deep = {"Tag": "Unary", "Value": "LParen", "Type_t": "Operator", "Args": [deep], "ID": str(i)}
+    assert method_key("Deep", {"Parameters": [], "Body": [[deep]]}, {}, {}, {}, {})
+
+    print("tests passed")
+
+if __name__ == "__main__":
+    test_test()
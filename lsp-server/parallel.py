@@ -0,0 +1,243 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import repeat
+import gc
+import os
+
+from graph import Graph, Node
+from kvstore import KVStore, StoreValue
+from sutypes import TypeRepr
+from type_inference import process_custom_types, process_methods, process_parameters, set_owner
+
+"""
+Infers the methods of a class in worker processes
+
+Methods only share the attributes, typedefs and parameter bindings, so a worker
+infers every method of its batch into a KVStore and Graph of its own, like the
+shards of KVStore.shard. The parent merges the fragments in the order of methods
+as the batches come back: the values of a method go in with KVStore.set_many and
+its nodes and edges with Graph.union, so a conflict between methods raises the
+same TypeError a serial run does, and the result does not depend on which worker
+finishes first.
+
+The merge runs in the parent alone, it bounds how far this scales with cores
+(see bench.py parallel). The fragments also cost sending and rebuilding, so one
+worker is about half as fast as a serial run and it takes several cores before
+any number of workers catches up, which is why --jobs is off by default. The
+collector is paused during the merge only, that has its own line in the bench.
+"""
+
+
+class Fragment:
+    """
+    what one method added to its store and graph, values refer to their types by
+    number into types so each one is sent and rebuilt once
+    """
+
+    __slots__ = ("method", "types", "values", "symbols", "basal", "nodes", "edges")
+
+    def __init__(self, method, types, values, symbols, basal, nodes, edges):
+        """
+        @param types: flat definitions, see TypeRepr.to_flat
+        @param values: [(var_id, value, actual, inferred)] in insertion order
+        @param symbols: name -> [ID] of the method, see SymbolTable
+        @param basal: basal types the method added, nodes the rest of its nodes
+        @param edges: [(value, [value])] the neighbours of every linked node, in
+                      the order they were linked, see Graph.union
+        """
+        self.method = method
+        self.types = types
+        self.values = values
+        self.symbols = symbols
+        self.basal = basal
+        self.nodes = nodes
+        self.edges = edges
+
+    @classmethod
+    def of(cls, method, store, graph):
+        """
+        the fragment of a store and graph that only method wrote to
+        """
+        types, type_ids = [], {}
+
+        def type_id(t) -> int:
+            if (i := type_ids.get(key := t.get_key())) is None:
+                i = type_ids[key] = len(types)
+                types.append(t.to_flat())
+            return i
+
+        primitives = len(Graph.get_primitive_type_nodes())
+        return cls(
+            method,
+            types,
+            [(k, v.value, type_id(v.actual), type_id(v.inferred)) for k, v in store.items()],
+            {name: store.symbols.lookup(method, name) for name in store.symbols.indexed.get(method, {})},
+            [n.value for n in graph.get_basal_types()[primitives:]],
+            list(graph.owned.get(method, {})),
+            [(n.value, list(n.edges)) for n in graph.get_nodes() if n.edges],
+        )
+
+    def to_json(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    @classmethod
+    def from_json(cls, json_data):
+        return cls(**json_data)
+
+    def merge_into(self, store, graph, types, check=True):
+        """
+        @param types: the TypeReprs of self.types
+        @param check: False to skip the conflict check of the values, for a fragment
+                      known to pass it, see KVStore.set_many
+        """
+        set_owner(store, graph, self.method)
+        store.symbols.indexed.setdefault(self.method, {})
+        for name, ids in self.symbols.items():
+            for var_id in ids:
+                store.symbols.add(self.method, name, var_id)
+        store.set_many({var_id: StoreValue(value, types[actual], types[inferred])
+                        for var_id, value, actual, inferred in self.values}, check)
+
+        for value in self.basal:
+            graph.add_basal_type(Node(value))
+        graph.union(self.nodes, self.edges)
+        set_owner(store, graph, None)
+
+
+def infer_batch(methods, typedefs, bindings, param_t, attributes):
+    """
+    runs in a worker, every method starts from an empty store and graph
+
+    @return: ([Fragment], error) where error is the TypeError the batch stopped
+             at, the fragments are the methods before it
+    """
+    fragments = []
+    for fn, func in methods.items():
+        store, graph = KVStore(), Graph()
+        method = {fn: func}
+        try:
+            process_custom_types(method, typedefs, bindings, param_t, store, graph, attributes)
+            process_parameters(method, typedefs, bindings, param_t, store, graph, attributes)
+            process_methods(method, store, graph, attributes)
+        except TypeError as e:
+            return fragments, e
+        fragments.append(Fragment.of(fn, store, graph))
+    return fragments, None
+
+def batched(methods, batch_size) -> list:
+    names = list(methods)
+    return [{fn: methods[fn] for fn in names[i:i + batch_size]} for i in range(0, len(names), batch_size)]
+
+def infer_fragments(methods, typedefs, bindings, param_t, attributes, jobs=None, batch_size=None):
+    """
+    yields ([Fragment], error) per batch of methods in order, see infer_batch
+
+    @param jobs: number of worker processes, inferred in this process when None
+    @param batch_size: methods sent to a worker at a time, by default every
+                       worker gets about four batches so merging overlaps inference
+    """
+    if jobs is None:
+        yield infer_batch(methods, typedefs, bindings, param_t, attributes)
+        return
+
+    if batch_size is None:
+        batch_size = max(1, -(-len(methods) // (jobs * 4)))
+    with ProcessPoolExecutor(jobs) as pool:
+        yield from pool.map(infer_batch, batched(methods, batch_size),
+                            *(repeat(x) for x in (typedefs, bindings, param_t, attributes)))
+
+def infer_parallel(methods, typedefs, bindings, param_t, store, graph, attributes, jobs=None, batch_size=None):
+    """
+    runs process_custom_types, process_parameters and process_methods over methods
+    in jobs worker processes and merges the results into store and graph
+
+    @param jobs: number of workers, the number of cores when None
+    @raises TypeError: on the first conflict in the order of methods, the methods
+                       before it are merged
+    """
+    jobs = jobs or os.cpu_count() or 1
+    for fragments, error in infer_fragments(methods, typedefs, bindings, param_t, attributes, jobs, batch_size):
+        merge(fragments, store, graph)
+        if error is not None:
+            raise error
+
+@contextmanager
+def collector_paused():
+    """
+    for code that only creates objects that stay reachable, such as a merge into
+    the store and graph, the collector would walk them over and over without
+    freeing anything
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def merge(fragments, store, graph, check=True):
+    """
+    merges fragments into store and graph, in order
+
+    @param check: see Fragment.merge_into
+    """
+    with collector_paused():
+        for fragment in fragments:
+            fragment.merge_into(store, graph, [TypeRepr.of(t) for t in fragment.types], check)
+
+
+def test_test():
+    from bench import build_class
+
+    methods = build_class(12, 5)
+    # record = Object(name: "ok"), an unnamed type, see infer_object
+    methods["method_3"]["Body"].append([{"Tag": "Binary", "Value": "Eq", "Type_t": "Operator", "ID": "par_eq", "Args": [
+        {"Tag": "Identifier", "Value": "record", "Type_t": "Variable", "Args": None, "ID": "par_record"},
+        {"Tag": "Object", "Value": "Object", "Type_t": "Object", "ID": "par_obj", "Args": [
+            {"Tag": "Member", "Value": "name", "Type_t": "Variable", "ID": "par_name", "Args": [
+                {"Tag": "Constant", "Value": "\"ok\"", "Type_t": "String", "Args": None, "ID": "par_ok"}]}]},
+    ]}])
+    serial_store, serial_graph = KVStore(), Graph()
+    process_custom_types(methods, {}, {}, {}, serial_store, serial_graph, {})
+    process_parameters(methods, {}, {}, {}, serial_store, serial_graph, {})
+    process_methods(methods, serial_store, serial_graph, {})
+
+    # object types hold TypeReprs that to_json cannot write, compare by name
+    def values(store):
+        return [(k, v.value, v.actual.name, v.inferred.name) for k, v in store.items()]
+
+    def components(graph):
+        return {frozenset(m) for m in graph.members.values()}
+
+    # batches finish in any order, the merge does not depend on it, nor on the
+    # number of workers: the result is the one of a serial run
+    merged = []
+    for jobs, batch_size in ((2, None), (3, 1)):
+        store, graph = KVStore(), Graph()
+        infer_parallel(methods, {}, {}, {}, store, graph, {}, jobs=jobs, batch_size=batch_size)
+        assert values(store) == values(serial_store) and graph.to_json() == serial_graph.to_json()
+        assert store.owned == serial_store.owned and graph.owned == serial_graph.owned
+        assert components(graph) == components(serial_graph)
+        merged.append((values(store), graph.to_json()))
+    assert merged[0] == merged[1]
+
+    # x0 = 1 + 2 + y then x0 = "one" conflicts, the methods before it are merged
+    body = methods["method_5"]["Body"]
+    x0 = body[0][0]["Args"][0]
+    methods["method_5"]["Body"] = body + [[{"Tag": "Binary", "Value": "Eq", "Type_t": "Operator", "ID": "par_s", "Args": [
+        x0, {"Tag": "Constant", "Value": "\"one\"", "Type_t": "String", "Args": None, "ID": "par_c"},
+    ]}]]
+    store = KVStore()
+    try:
+        infer_parallel(methods, {}, {}, {}, store, Graph(), {}, jobs=2, batch_size=2)
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("method_5 should conflict")
+    assert "method_4" in store.owned and "method_5" not in store.owned
+
+    print("tests passed")
+
+if __name__ == "__main__":
+    test_test()
@@ -0,0 +1,36 @@
+# Runs inference and checking in one process over the same store and graph
+# files are only written when asked for, see --write
+import argparse
+
+from sutypes import TypeRepr
+from type_checker import check
+from type_inference import add_arguments, check_arguments, infer, write_outputs
+from utils import DebugInfo
+
+
+def run(engine="graph", normalise=False, dbg=None, jobs=None, cache=None, capacity=None, types=None):
+    """
+    @param types: the sutypes.TypeTable of the workspace, a fresh one when None
+    @return: (store, graph) once inferred and checked
+    @raises TypeError: when two primitive types end up equated
+    """
+    with TypeRepr.session(types):
+        store, graph = infer(engine, normalise, dbg=dbg, jobs=jobs, cache=cache, capacity=capacity)
+        check(store, graph)
+    return store, graph
+
+def main():
+    p = argparse.ArgumentParser("TypeLoom")
+    p.add_argument("--write", action="store_true",
+                   help="also write type_store.json and type_graph.json for the standalone checker")
+    add_arguments(p)
+    args = p.parse_args()
+    check_arguments(p, args)
+
+    store, graph = run(args.engine, args.normalise, dbg=DebugInfo(), jobs=args.jobs, cache=args.cache, capacity=args.capacity)
+    write_outputs(store, graph, json_files=args.write, snapshot=args.snapshot, log=args.log)
+    if args.capacity is not None:
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+from graph import Graph, Node
+from kvstore import KVStore, StoreValue
+from sutypes import SuTypesEncoder, TypeRepr
+from unionfind import DisjointSet
+
+"""
+A versioned binary snapshot of a Graph and a KVStore
+
+    header      magic, version, section counts and byte offsets
+    strings     u32 offsets (count + 1) followed by one utf-8 blob, every node value,
+                variable ID, variable name and type definition is interned here once,
+                the graph nodes come first so string ids below the node count are nodes
+    edges       u32 source ids then u32 destination ids, each undirected edge once
+    basal       u32 string ids of the basal types of the graph, in basal order
+    types       u32 string id of the JSON definition of each distinct TypeRepr
+    entries     (key, value, actual, inferred) u32 records sorted by key
+
+All integers are little endian. Snapshot.open memory maps the file and only
+decodes the strings and types that are asked for, so the checker can query a
+large snapshot without rebuilding every Node and StoreValue up front.
+"""
+
+MAGIC = b"TLSNAP\x00\x00"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIIIIIQQQQQQ")
+ENTRY_WIDTH = 4
+
+
+def to_little_endian(arr):
+    if sys.byteorder != "little":
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+class StringTable:
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, s) -> int:
+        if (i := self.ids.get(s)) is None:
+            i = self.ids[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+
+def type_to_json(t: TypeRepr) -> str:
+    definition = dict(t.definition)
+    definition["name"] = t.name
+    return json.dumps(definition, cls=SuTypesEncoder)
+
+
+def graph_edges(graph, strings):
+    """
+    interns every node of the graph then returns (source ids, destination ids)
+    with each undirected edge once
+    """
+    src, dst = array("I"), array("I")
+
+    if hasattr(graph, "edge_src"):
+        # drops repeated edges from the list
+        graph.build_csr()
+        for value in graph.values:
+            strings.intern(value)
+        for a, b in zip(graph.edge_src, graph.edge_dst, strict=True):
+            src.append(strings.ids[graph.values[a]])
+            dst.append(strings.ids[graph.values[b]])
+        return src, dst
+
+    nodes = graph.to_json()["nodes"]
+    for node in nodes:
+        strings.intern(node["value"])
+    for node in nodes:
+        i = strings.ids[node["value"]]
+        for edge in node["edges"]:
+            j = strings.ids[edge]
+            if i < j:
+                src.append(i)
+                dst.append(j)
+    return src, dst
+
+
+def write_snapshot(path, store, graph):
+    strings = StringTable()
+    types = StringTable()
+
+    src, dst = graph_edges(graph, strings)
+    n_nodes = len(strings.strings)
+
+    basal = array("I", [strings.intern(n.value) for n in graph.get_basal_types()])
+
+    entries = []
+    for k, v in store.items():
+        entries.append((
+            k,
+            strings.intern(k),
+            strings.intern(v.value),
+            types.intern(type_to_json(v.actual)),
+            types.intern(type_to_json(v.inferred)),
+        ))
+    entries.sort(key=lambda e: e[0])
+    records = array("I", [x for e in entries for x in e[1:]])
+
+    type_ids = array("I", [strings.intern(t) for t in types.strings])
+
+    blob = bytearray()
+    offsets = array("I", [0])
+    for s in strings.strings:
+        blob += s.encode("utf-8")
+        offsets.append(len(blob))
+
+    sections = [to_little_endian(offsets), bytes(blob), to_little_endian(src) + to_little_endian(dst),
+                to_little_endian(basal), to_little_endian(type_ids), to_little_endian(records)]
+    starts = []
+    position = HEADER.size
+    for section in sections:
+        starts.append(position)
+        position += len(section)
+
+    with open(path, "wb") as fobj:
+        fobj.write(HEADER.pack(MAGIC, VERSION, len(strings.strings), n_nodes, len(src), len(basal),
+                               len(type_ids), len(entries), *starts))
+        for section in sections:
+            fobj.write(section)
+
+
+class Snapshot:
+    """
+    read only view over a snapshot file, see Snapshot.open
+    """
+
+    def __repr__(self) -> str:
+        return f"Snapshot(strings = {self.n_strings}, edges = {self.n_edges}, entries = {self.n_entries})"
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        (magic, version, self.n_strings, self.n_nodes, self.n_edges, self.n_basal, self.n_types, self.n_entries,
+         offsets_at, blob_at, edges_at, basal_at, types_at, entries_at) = HEADER.unpack_from(buffer, 0)
+
+        if magic != MAGIC:
+            raise ValueError("not a TypeLoom snapshot")
+        if version != VERSION:
+            raise ValueError(f"unsupported snapshot version {version}, expected {VERSION}")
+
+        view = self.view = memoryview(buffer)
+        self.blob = view[blob_at:edges_at]
+        self.offsets = self.u32(view, offsets_at, self.n_strings + 1)
+        self.src = self.u32(view, edges_at, self.n_edges)
+        self.dst = self.u32(view, edges_at + 4 * self.n_edges, self.n_edges)
+        self.basal = self.u32(view, basal_at, self.n_basal)
+        self.type_ids = self.u32(view, types_at, self.n_types)
+        self.entries = self.u32(view, entries_at, self.n_entries * ENTRY_WIDTH)
+        self.types = {}
+
+    @staticmethod
+    def u32(view, start, n):
+        section = view[start:start + 4 * n]
+        if sys.byteorder == "little":
+            return section.cast("I")
+        arr = array("I", section.tobytes())
+        arr.byteswap()
+        return arr
+
+    @classmethod
+    def open(cls, path):
+        with open(path, "rb") as fobj:
+            buffer = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def close(self):
+        for attr in ("blob", "offsets", "src", "dst", "basal", "type_ids", "entries", "view"):
+            view = getattr(self, attr)
+            if isinstance(view, memoryview):
+                view.release()
+        self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def string(self, i) -> str:
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], "utf-8")
+
+    def type(self, i) -> TypeRepr:
+        if (t := self.types.get(i)) is None:
+            definition = json.loads(self.string(self.type_ids[i]))
+            t = self.types[i] = TypeRepr.of(definition)
+        return t
+
+    def key(self, n) -> str:
+        return self.string(self.entries[n * ENTRY_WIDTH])
+
+    def entry(self, n):
+        _, value, actual, inferred = self.entries[n * ENTRY_WIDTH:(n + 1) * ENTRY_WIDTH]
+        return StoreValue(self.string(value), self.type(actual), self.type(inferred))
+
+    def get(self, var_id) -> StoreValue | None:
+        """
+        binary search over the sorted entries, decodes O(log n) keys
+        """
+        lo, hi = 0, self.n_entries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < var_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_entries and self.key(lo) == var_id:
+            return self.entry(lo)
+        return None
+
+    def items(self):
+        for n in range(self.n_entries):
+            yield self.key(n), self.entry(n)
+
+    def basal_types(self) -> list:
+        return [self.string(i) for i in self.basal]
+
+    def conflicting_components(self, basal=None) -> list:
+        """
+        same as Graph.conflicting_components, computed over the integer edge
+        arrays without building the graph
+        """
+        sets = DisjointSet()
+        for a, b in zip(self.src, self.dst, strict=True):
+            sets.union(a, b)
+
+        ids = {self.string(i): i for i in self.basal}
+        if basal is None:
+            basal = list(ids)
+
+        found = {}
+        for value in basal:
+            if value in ids:
+                found.setdefault(sets.find(ids[value]), []).append(value)
+
+        return [v for v in found.values() if len(v) > 1]
+
+    def to_store(self) -> KVStore:
+        store = KVStore()
+        for k, v in self.items():
+            store.set(k, v)
+        return store
+
+    def to_graph(self) -> Graph:
+        graph = Graph()
+        # basal types first, add_basal_type skips values that already are nodes
+        for value in self.basal_types():
+            graph.add_basal_type(Node(value))
+        for i in range(self.n_nodes):
+            graph.add_node(Node(self.string(i)))
+        for a, b in zip(self.src, self.dst, strict=True):
+            graph.add_edge(self.string(a), self.string(b))
+        return graph
+
+
+def test_test():
+    import os
+    import tempfile
+
+    from sutypes import SuTypes
+
+    graph = Graph()
+    graph.add_basal_type(Node("Currency"))
+    for i in ["x", "y", "z"]:
+        graph.add_node(Node(i))
+    graph.add_edge("Number", "x")
+    graph.add_edge("x", "y")
+    graph.add_edge("z", "Currency")
+
+    store = KVStore()
+    number_t = TypeRepr.primitive(SuTypes.Number)
+    store.set("snap_x", StoreValue("x", number_t, number_t))
+
+    path = os.path.join(tempfile.mkdtemp(), "snapshot.bin")
+    write_snapshot(path, store, graph)
+
+    with Snapshot.open(path) as snap:
+        assert snap.get("snap_x").inferred == number_t
+        assert snap.get("snap_missing") is None
+        assert snap.conflicting_components() == []
+        assert "Currency" in snap.basal_types()
+
+        restored = snap.to_graph()
+        assert restored.path_exists("Number", "y") is True
+        assert restored.path_exists("Number", "z") is False
+        assert [n.value for n in restored.get_basal_types()] == [n.value for n in graph.get_basal_types()]
+
+    print("tests passed")
+
+if __name__ == "__main__":
+    test_test()
@@ -0,0 +1,269 @@
+from collections import OrderedDict
+import os
+import sqlite3
+import tempfile
+
+from kvstore import KVStore, StoreValue
+
+"""
+A KVStore that keeps at most capacity values in memory
+
+Values are grouped by the method that owns them (see KVStore.owned). Once the
+store holds more than capacity values, the least recently queried method has all
+of its values moved to a sqlite table, a get for any of them faults the whole
+method back in. Values without an owning method always stay in memory.
+
+The secondary indexes and the symbol table stay in memory, so queries still find
+spilled values and fault them in as they go. So do the TypeReprs, they are shared
+between values (see TypeRepr.of) and spilled rows only refer to them by number.
+Whole store readers (items, to_json, write_flat, snapshots) stream spilled rows
+from sqlite instead, they never fault anything in.
+"""
+
+# spilled rows read from sqlite at a time by items
+ITEMS_BATCH = 512
+
+
+class BoundedKVStore(KVStore):
+
+    def __repr__(self) -> str:
+        return f"BoundedKVStore(resident = {len(self.db)}, spilled = {len(self.spilled)}, capacity = {self.capacity})"
+
+    def __init__(self, capacity, path=None):
+        """
+        @param capacity: number of values kept in memory
+        @param path: sqlite file for spilled values, a temporary file when None
+        """
+        super().__init__()
+        self.capacity = capacity
+        self.temporary = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix=".sqlite")
+            os.close(fd)
+        self.path = path
+        self.disk = sqlite3.connect(path)
+        self.disk.execute("CREATE TABLE IF NOT EXISTS spilled (id TEXT PRIMARY KEY, method TEXT, value TEXT, actual INTEGER, inferred INTEGER)")
+        self.disk.execute("CREATE INDEX IF NOT EXISTS spilled_method ON spilled (method)")
+
+        # var_id -> method of every spilled value
+        self.spilled = {}
+        # var_id -> first method that wrote it, and method -> None in least recently used order
+        self.method_of = {}
+        self.recent = OrderedDict()
+        # TypeRepr key -> number and number -> TypeRepr of every spilled type
+        self.type_ids = {}
+        self.types = []
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.db) + len(self.spilled)
+
+    def size(self) -> int:
+        return len(self)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "resident": len(self.db),
+            "spilled": len(self.spilled),
+        }
+
+    def close(self):
+        self.disk.close()
+        if self.temporary:
+            os.remove(self.path)
+
+    def touch(self, var_id):
+        if (method := self.method_of.get(var_id)) is not None:
+            self.recent[method] = None
+            self.recent.move_to_end(method)
+
+    def get(self, var):
+        if (value := self.db.get(var)) is not None:
+            self.hits += 1
+        elif var in self.spilled:
+            self.misses += 1
+            self.fault(self.spilled[var])
+            value = self.db[var]
+        else:
+            return None
+        self.touch(var)
+        self.evict()
+        return value
+
+    def current(self, var_id):
+        # set needs the value resident to replace it, but it is not a lookup
+        if var_id in self.spilled:
+            self.fault(self.spilled[var_id])
+        return self.db.get(var_id)
+
+    def set(self, var_id, value):
+        if var_id not in self.method_of and self.owner is not None:
+            self.method_of[var_id] = self.owner
+        super().set(var_id, value)
+        self.touch(var_id)
+        self.evict()
+
+    def set_many(self, values, check=True):
+        # the spilled values set_many will check or replace
+        for var_id in values.keys() & self.spilled.keys():
+            if var_id in self.spilled:
+                self.fault(self.spilled[var_id])
+        if self.owner is not None:
+            for var_id in values:
+                self.method_of.setdefault(var_id, self.owner)
+        super().set_many(values, check)
+        for var_id in values:
+            self.touch(var_id)
+        self.evict()
+
+    def write(self, var_id, value):
+        if var_id in self.spilled:
+            self.fault(self.spilled[var_id])
+        super().write(var_id, value)
+        self.evict()
+
+    def delete(self, var_id):
+        if var_id in self.spilled:
+            self.fault(self.spilled[var_id])
+        super().delete(var_id)
+        self.evict()
+
+    def items(self):
+        """
+        yields every (var_id, StoreValue), the resident values first then the
+        spilled ones read from sqlite a batch at a time, without faulting any in
+        """
+        yield from list(self.db.items())
+
+        spilled = list(self.spilled)
+        for i in range(0, len(spilled), ITEMS_BATCH):
+            batch = spilled[i:i + ITEMS_BATCH]
+            rows = self.disk.execute(
+                f"SELECT id, value, actual, inferred FROM spilled WHERE id IN ({', '.join('?' * len(batch))})", batch)
+            found = {var_id: StoreValue(value, self.types[actual], self.types[inferred])
+                     for var_id, value, actual, inferred in rows}
+            for var_id in batch:
+                # faulted in, or deleted, since items started
+                if (value := found.get(var_id, self.db.get(var_id))) is not None:
+                    yield var_id, value
+
+    def fault(self, method):
+        """
+        moves every spilled value of method back into memory, it becomes the most
+        recently used method so the next evict spills the others first
+        """
+        rows = self.disk.execute("SELECT id, value, actual, inferred FROM spilled WHERE method = ?", (method,))
+        for var_id, value, actual, inferred in rows.fetchall():
+            self.db[var_id] = StoreValue(value, self.types[actual], self.types[inferred])
+            del self.spilled[var_id]
+        self.disk.execute("DELETE FROM spilled WHERE method = ?", (method,))
+        self.recent[method] = None
+        self.recent.move_to_end(method)
+
+    def evict(self):
+        """
+        spills least recently used methods until the store is back under capacity,
+        the most recently used method always stays
+        """
+        while len(self.db) > self.capacity and len(self.recent) > 1:
+            method, _ = self.recent.popitem(last=False)
+            rows = []
+            for var_id in self.owned.get(method, {}):
+                if self.method_of.get(var_id) == method and (value := self.db.pop(var_id, None)) is not None:
+                    rows.append((var_id, method, value.value, self.type_id(value.actual), self.type_id(value.inferred)))
+                    self.spilled[var_id] = method
+            self.disk.executemany("INSERT OR REPLACE INTO spilled VALUES (?, ?, ?, ?, ?)", rows)
+            self.evictions += len(rows)
+
+    def type_id(self, t) -> int:
+        if (i := self.type_ids.get(key := t.get_key())) is None:
+            i = self.type_ids[key] = len(self.types)
+            self.types.append(t)
+        return i
+
+
+def test_test():
+    from sutypes import SuTypes, TypeRepr
+
+    number_t = TypeRepr.primitive(SuTypes.Number)
+    string_t = TypeRepr.primitive(SuTypes.String)
+
+    store = BoundedKVStore(capacity=4)
+    for method, t in (("First", number_t), ("Second", string_t), ("Third", number_t)):
+        store.owner = method
+        for i in range(3):
+            store.set(f"{method}_{i}", StoreValue(f"v{i}", t, t))
+    store.owner = None
+
+    assert len(store.db) == 3 and store.size() == 9
+    assert store.stats()["evictions"] > 0 and "First_0" in store.spilled
+
+    # faulting First back in spills the least recently used method instead
+    assert store.get("First_1").inferred.is_(number_t)
+    assert store.stats()["misses"] == 1 and "First_0" in store.db
+    assert "Second_0" in store.spilled
+
+    # indexes still see spilled values
+    assert sorted(i for i, _ in store.query(type_name="String")) == ["Second_0", "Second_1", "Second_2"]
+
+    # replacing a value is not a lookup
+    hits, misses = store.hits, store.misses
+    store.owner = "Third"
+    store.set("Third_1", StoreValue("v1", number_t, number_t))
+    store.owner = None
+    assert (store.hits, store.misses) == (hits, misses)
+
+    store.delete("Third_0")
+    assert store.size() == 8 and store.get("Third_0") is None
+    store.close()
+
+    # deleting faults a method in, it is spilled again once another one is
+    store = BoundedKVStore(capacity=4)
+    methods = [f"Method{m}" for m in range(5)]
+    for method in methods:
+        store.owner = method
+        for i in range(4):
+            store.set(f"{method}_{i}", StoreValue(f"v{i}", number_t, number_t))
+    store.owner = None
+    for method in methods:
+        store.delete(f"{method}_0")
+        assert len(store.db) <= 4
+    assert store.size() == 15
+    store.close()
+
+    # whole store readers see every value and leave the cap alone
+    import io
+    import os
+    from graph import Graph
+    from snapshot import Snapshot, write_snapshot
+
+    store = BoundedKVStore(capacity=2)
+    for method in ("First", "Second", "Third"):
+        store.owner = method
+        for i in range(2):
+            store.set(f"{method}_{i}", StoreValue(f"v{i}", number_t, number_t))
+    store.owner = None
+    resident = len(store.db)
+    assert resident <= 2 and len(store.spilled) == 4
+
+    assert len(store.to_json()) == 6 and len(store.query()) == 6
+    fobj = io.StringIO()
+    store.write_flat(fobj)
+    assert len(fobj.getvalue().splitlines()) == 7
+    path = os.path.join(tempfile.mkdtemp(), "snapshot.bin")
+    write_snapshot(path, store, Graph())
+    with Snapshot.open(path) as snapshot:
+        assert snapshot.n_entries == 6
+    assert len(store.db) == resident and store.stats()["misses"] == 0
+    store.close()
+
+    print("tests passed")
+
+if __name__ == "__main__":
+    test_test()
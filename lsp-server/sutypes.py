@@ -1,3 +1,4 @@
+from contextlib import contextmanager
 from enum import Enum
 import json
 import uuid
@@ -93,6 +94,28 @@ class SuTypesEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+class TypeTable:
+    """
+    the interned instances, named types and memoised subtype results of one
+    session, a long running server keeps one per workspace so types neither
+    leak nor mix between them, see TypeRepr.session
+    """
+
+    def __repr__(self) -> str:
+        return f"TypeTable(interned = {len(self.interned)}, named = {len(self.named)}, subtypes = {len(self.subtypes)})"
+
+    def __init__(self):
+        # canonical key -> shared instance of every named type, see TypeRepr.of
+        self.interned = {}
+        # name -> instance of every named type built through TypeRepr.of, resolves
+        # typedef names used as object field types
+        self.named = {}
+        # (shape, shape, strict equality) -> bool, see structural_le
+        self.subtypes = {}
+        # names an object field referred to before they were defined, see field_type
+        self.unresolved = set()
+
+
 class TypeRepr:
 
     name = None
@@ -131,7 +154,77 @@ class TypeRepr:
 
     """
 
+    # hash consing, see TypeRepr.of
+    hash_consing = True
+    # the tables of the current session, see TypeRepr.session
+    table = TypeTable()
+    # SuTypes -> primitive and canonical key -> primitive, primitives never
+    # change so every session shares them
+    primitives = {}
+    # number of TypeRepr instances constructed in this process
+    allocations = 0
+
+    # canonical key of an interned instance
+    key = None
+
+    # canonical key of the definition, structural for unnamed types, see structural_le
+    shape = None
+
+    # (SuTypes bitmask, frozenset of the other members) of the meaning, see meaning_bits
+    bits = None
+
+    @classmethod
+    def of(cls, definition) -> "TypeRepr":
+        """
+        canonicalising factory, returns one shared instance per structurally
+        distinct named definition. Unnamed types are built fresh and get a name
+        of their own, two object literals of the same shape stay apart.
+        Shared instances must be treated as immutable
+        """
+        name = definition.get("name")
+        if not cls.hash_consing or name is None:
+            t = cls(dict(definition))
+        else:
+            key = canonical_key(definition)
+            if (t := cls.primitives.get(key)) is None and (t := cls.table.interned.get(key)) is None:
+                t = cls.table.interned[key] = cls(dict(definition))
+                t.key = key
+
+        if name is not None and (table := cls.table).named.get(name) is not t:
+            if name in table.named or name in table.unresolved:
+                # a comparison cached while name meant something else, or nothing,
+                # may now have another answer
+                table.subtypes.clear()
+                table.unresolved.clear()
+            table.named[name] = t
+        return t
+
+    @classmethod
+    def primitive(cls, t: SuTypes) -> "TypeRepr":
+        if cls.hash_consing and (p := cls.primitives.get(t)) is not None:
+            return p
+        p = cls(cls.construct_definition_from_primitive(t))
+        if cls.hash_consing:
+            p.key = canonical_key(cls.construct_definition_from_primitive(t))
+            cls.primitives[t] = cls.primitives[p.key] = p
+        return p
+
+    @classmethod
+    @contextmanager
+    def session(cls, table=None):
+        """
+        with TypeRepr.session(): ...
+        types are interned, named and compared in table (a fresh one when None)
+        until the block ends, then the previous tables are back in use
+        """
+        previous, cls.table = cls.table, table if table is not None else TypeTable()
+        try:
+            yield cls.table
+        finally:
+            cls.table = previous
+
     def __init__(self, definition):
+        TypeRepr.allocations += 1
         if not isinstance(definition, dict):
             raise ValueError(f"definition should be a dictionary, got {definition}")
         if definition.get("form") is None or definition.get("meaning") is None:
@@ -166,12 +259,14 @@ class TypeRepr:
         """
         if not isinstance(other, TypeRepr):
             raise ValueError(f"Cannot compare SuTypes with {other}")
+        if self is other:
+            return True
 
         self.solve_definition()
         other.solve_definition()
 
         # ? can there be a case where the types are unequal but the definitions are the same or vice-versa?
-        return set(self.definition.get("meaning", None)) == set(other.definition.get("meaning", None))
+        return self.get_bits() == other.get_bits()
 
     def is_not(self, other):
         return not self.is_(other)
@@ -181,15 +276,20 @@ class TypeRepr:
         a == b, when a or b is Any, Unknown will return True
         For more strict comparison use is_
         """
+        if self is other:
+            return True
+
         # ANY CATCH
         s = self.definition.get("meaning", None)
         o = other.definition.get("meaning", None)
         if (s is None or o is None) or (len(s) == 1 or len(o) == 1):
-            if set(s) <= set([SuTypes.Any, SuTypes.Unknown]) or set(o) <= set([SuTypes.Any, SuTypes.Unknown]):
+            if self.is_any() or other.is_any():
                 return True
 
         # OBJECT
         if self.definition["form"] == "Object":
+            if other.definition["form"] == "Object":
+                return structural_le(self, other, equal=True)
             # check if all keys of self are in other and vice-versa
             if not all(k in other.definition["meaning"] for k in self.definition["meaning"]):
                 return False
@@ -203,7 +303,7 @@ class TypeRepr:
             raise ValueError(f"Cannot compare SuTypes with {other}")
 
         # ? can there be a case where the types are unequal but the definitions are the same or vice-versa?
-        return set(self.definition.get("meaning", None)) == set(other.definition.get("meaning", None))
+        return self.get_bits() == other.get_bits()
 
     def __ne__(self, __value: object) -> bool:
         return not self.__eq__(__value)
@@ -216,26 +316,57 @@ class TypeRepr:
         s = self.definition.get("meaning")
         o = other.definition.get("meaning")
         if len(s) == 1 or len(o) == 1:
-            if set(s) <= set([SuTypes.Any, SuTypes.Unknown]) or set(o) <= set([SuTypes.Any, SuTypes.Unknown]):
+            if self.is_any() or other.is_any():
                 return True
 
         # OBJECT
         if self.definition["form"] == "Object":
+            if other.definition["form"] == "Object":
+                return structural_le(self, other) and not structural_le(other, self)
             # check if self keys are a subset of other
             if not all(k in other.definition["meaning"] for k in self.definition["meaning"]):
                 return False
 
-        return set(self.definition.get("meaning", None)) < set(other.definition.get("meaning", None))
+        mask, rest = self.get_bits()
+        o_mask, o_rest = other.get_bits()
+        return mask & ~o_mask == 0 and rest <= o_rest and (mask, rest) != (o_mask, o_rest)
 
     def __le__(self, other):
         if not isinstance(other, TypeRepr):
             raise ValueError(f"Cannot compare SuTypes with {other}")
+        if self is other:
+            return True
 
         return (self == other) or (self < other)
 
     def get_name(self):
         return self.name
 
+    def get_key(self):
+        """
+        canonical key, interned instances share it with TypeRepr.of
+        """
+        if self.key is None:
+            self.key = canonical_key(self.to_flat())
+        return self.key
+
+    def get_shape(self):
+        if self.shape is None:
+            self.shape = canonical_key(self.definition)
+        return self.shape
+
+    def get_bits(self):
+        if self.bits is None:
+            self.bits = meaning_bits(self.definition["meaning"])
+        return self.bits
+
+    def is_any(self):
+        """
+        meaning is made up of only Any and Unknown
+        """
+        mask, rest = self.get_bits()
+        return mask & ~ANY_BITS == 0 and not rest
+
     def get_equivalent_primitive_type(self):
         return self.solved_t
 
@@ -244,6 +375,12 @@ class TypeRepr:
 
     def to_json(self):
         return json.dumps(self, cls=TypeReprEncoder)
+
+    def to_flat(self) -> dict:
+        """
+        the definition with the name inlined, TypeRepr(t.to_flat()) rebuilds t
+        """
+        return {**self.definition, "name": self.name}
     
     @classmethod
     def from_json(self, json_str):
@@ -326,6 +463,107 @@ class TypeRepr:
         }
 
 
+ANY_BITS = (1 << SuTypes.Any.value) | (1 << SuTypes.Unknown.value)
+
+def meaning_bits(meaning):
+    """
+    splits a meaning into a bitmask over the SuTypes values and a frozenset of
+    everything else, union literals, object keys and typedef names
+    so set comparisons of meanings become bit operations
+    """
+    mask, rest = 0, []
+    for i in meaning:
+        if isinstance(i, SuTypes):
+            mask |= 1 << i.value
+        else:
+            rest.append(i)
+    return mask, frozenset(rest)
+
+def field_type(x):
+    """
+    TypeRepr for an object field, None when x names nothing known
+    """
+    if isinstance(x, TypeRepr):
+        return x
+    if isinstance(x, SuTypes):
+        return TypeRepr.primitive(x)
+    if isinstance(x, dict):
+        return TypeRepr.of(x if "form" in x else {"form": "Object", "meaning": x})
+    if isinstance(x, str):
+        if x in SuTypes.get_member_string():
+            return TypeRepr.primitive(SuTypes.from_str(x))
+        if (t := TypeRepr.table.named.get(x)) is None:
+            TypeRepr.table.unresolved.add(x)
+        return t
+    return None
+
+def structural_le(a, b, equal=False, assumed=None):
+    """
+    width and depth structural check of two Object types, every field of a is
+    a field of b (and the other way round when equal) with a compatible type,
+    object fields are compared recursively and everything else with ==
+
+    a pair that is already being compared further up is assumed to hold, so
+    recursive typedefs terminate. Results are cached in the subtypes of the
+    session (see TypeTable) by shape, so anonymous field types built for every
+    comparison still hit. A True reached through an assumption is only cached
+    once the outermost comparison holds
+    """
+    cache = TypeRepr.table.subtypes
+    pair = (a.get_shape(), b.get_shape(), equal)
+    if (result := cache.get(pair)) is not None:
+        return result
+
+    outermost = assumed is None
+    if outermost:
+        assumed = {}
+    elif pair in assumed:
+        return True
+    assumed[pair] = True
+
+    fields, other = a.definition["meaning"], b.definition["meaning"]
+    result = all(k in other for k in fields) and (not equal or len(fields) == len(other))
+    for k, v in fields.items() if result else ():
+        fa, fb = field_type(v), field_type(other[k])
+        if fa is None or fb is None:
+            result = v == other[k]
+        elif fa.definition["form"] == "Object" and fb.definition["form"] == "Object":
+            result = structural_le(fa, fb, equal, assumed)
+        else:
+            result = fa == fb
+        if not result:
+            break
+
+    if not result:
+        # a failure never depends on an assumption
+        cache[pair] = False
+        assumed.pop(pair)
+    elif outermost:
+        for p in assumed:
+            cache[p] = True
+    return result
+
+def canonical_key(definition):
+    """
+    hashable structural key of a definition, the name only counts when it is given
+    """
+    return (definition.get("name"), canonical({k: v for k, v in definition.items() if k != "name"}))
+
+def canonical(x):
+    if isinstance(x, dict):
+        return ("dict", tuple(sorted(((k, canonical(v)) for k, v in x.items()), key=lambda kv: kv[0])))
+    if isinstance(x, (list, tuple)):
+        return tuple(canonical(i) for i in x)
+    if isinstance(x, TypeRepr):
+        return ("type", x.name) if x.key is None else x.key
+    # keeps True and 1 apart
+    return (x.__class__, x)
+
+# every primitive exists before the first session, see TypeRepr.primitives
+for member in SuTypes:
+    TypeRepr.primitive(member)
+
+
 class TypeReprEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, TypeRepr):
@@ -404,3 +642,24 @@ if __name__ == "__main__":
     assert a == b
 
 
+    a = TypeRepr.primitive(SuTypes.Number)
+    assert a is TypeRepr.of({"form": "Primitive", "name": "Number", "meaning": [SuTypes.Number]})
+    assert TypeRepr.of({"form": "Object", "name": "Pair", "meaning": {"a": SuTypes.Number, "b": SuTypes.String}}) \
+        is TypeRepr.of({"form": "Object", "name": "Pair", "meaning": {"b": SuTypes.String, "a": SuTypes.Number}})
+    # unnamed types each keep their own name
+    a = TypeRepr.of({"form": "Object", "meaning": {"a": SuTypes.Number}})
+    assert a is not TypeRepr.of({"form": "Object", "meaning": {"a": SuTypes.Number}})
+    assert TypeRepr.of(a.to_flat()) is TypeRepr.of(a.to_flat())
+    a = TypeRepr.primitive(SuTypes.Number)
+    assert TypeRepr.primitive(SuTypes.String) is not a
+
+    a = TypeRepr({"form": "Alias", "name": "StrNum", "meaning": [SuTypes.String, SuTypes.Number]})
+    assert a.get_bits() == ((1 << SuTypes.String.value) | (1 << SuTypes.Number.value), frozenset())
+    assert TypeRepr.primitive(SuTypes.String) < a
+    assert TypeRepr.primitive(SuTypes.Any).is_any()
+
+    # sessions do not see each other's types
+    with TypeRepr.session() as table:
+        a = TypeRepr.of({"form": "Object", "name": "User", "meaning": {"name": SuTypes.Number}})
+        assert table.named["User"] is a and TypeRepr.primitive(SuTypes.Number).is_(TypeRepr.of(TypeRepr.construct_definition_from_primitive(SuTypes.Number)))
+    assert "User" not in TypeRepr.table.named
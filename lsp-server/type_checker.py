@@ -1,17 +1,22 @@
+import argparse
 import json
 
+from changelog import ChangeLog
 from graph import Graph
 from kvstore import KVStore
+from snapshot import Snapshot
 from sutypes import TypeRepr, SuTypes
 from type_inference import load_data_attributes
 
 
 
-def load_kv_data():
-    with open("type_store.json", "r") as fobj:
-        content = json.load(fobj)
-
-    return content
+def load_kv_data(store):
+    """
+    streams type_store.json into store, yielding each value as it is read
+    """
+    for k, v in KVStore.iter_file("type_store.json"):
+        store.set(k, v)
+        yield k, v
 
 def load_graph_data():
     with open("type_graph.json", "r") as fobj:
@@ -19,9 +24,64 @@ def load_graph_data():
 
     return content
 
+def check_store_values(items):
+    for k, v in items:
+        print(f"[DEBUG] Type: {k}, Value: {v}")
+        if v.actual == TypeRepr.primitive(SuTypes.InBuiltOperator):
+            # NOTE: currently avoids checking for inbuilt operators types
+            continue
+        if v.actual != v.inferred:
+            str_fmt = f"[ERROR] type node {k} expected \ntype: {v.inferred} but \ngot: {v.actual} instead. \nValue = {v}\n"
+            # raise TypeError(str_fmt)
+            print(str_fmt)
+
+def check_primitive_conflicts(graph):
+    # check if a path exists between two primitive types
+    primitive_types = [i.value for i in Graph().get_basal_types()]
+    for component in graph.conflicting_components(primitive_types):
+        raise TypeError(f"Types {component[0]} and {component[1]} cannot be equated")
+
+def check(store, graph):
+    """
+    checks a store and graph that are already in memory, see pipeline.py
+    """
+    check_store_values(store.items())
+    check_primitive_conflicts(graph)
+
+def check_snapshot(path):
+    """
+    checks a binary snapshot in place, entries are decoded one at a time and
+    the conflict check runs over the integer edge arrays
+    """
+    with Snapshot.open(path) as snapshot:
+        check_store_values(snapshot.items())
+        check_primitive_conflicts(snapshot)
+
+def check_log(path):
+    """
+    checks the state replayed from a change log written by type_inference.py --log
+    """
+    check(*ChangeLog.replay(path))
+
 def main():
+    p = argparse.ArgumentParser("Type Checker")
+    p.add_argument("--snapshot", metavar="PATH",
+                   help="check a binary snapshot written by type_inference.py --snapshot instead of the JSON files")
+    p.add_argument("--log", metavar="PATH",
+                   help="check the state replayed from a change log written by type_inference.py --log")
+    args = p.parse_args()
+
+    if args.snapshot is not None:
+        check_snapshot(args.snapshot)
+        return
+    if args.log is not None:
+        check_log(args.log)
+        return
+
+    # values are checked as they are read, before the whole store is loaded
+    store = KVStore()
+    check_store_values(load_kv_data(store))
 
-    store = KVStore().from_json(load_kv_data())
     ascii_store = """
      ____ _____ ___  ____  _____ 
     / ___|_   _/ _ \|  _ \| ____|
@@ -50,26 +110,9 @@ def main():
 
     attributes = load_data_attributes()
 
-    for k, v in store.db.items():
-        print(f"[DEBUG] Type: {k}, Value: {v}")
-        if v.actual == TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.InBuiltOperator)):
-            # NOTE: currently avoids checking for inbuilt operators types
-            continue
-        if v.actual != v.inferred:
-            str_fmt = f"[ERROR] type node {k} expected \ntype: {v.inferred} but \ngot: {v.actual} instead. \nValue = {store.get(k)}\n"
-            # raise TypeError(str_fmt)
-            print(str_fmt)
-
     # propogate_infer(store, graph, attributes, check=True)
 
-    # check if a path exists between two primitive types
-    primitive_types = Graph().get_basal_types()
-    for i in primitive_types:
-        for j in primitive_types:
-            if i.value == j.value:
-                continue
-            if graph.path_exists(i.value, j.value):
-                raise TypeError(f"Types {i.value} and {j.value} cannot be equated")
+    check_primitive_conflicts(graph)
 
 
 
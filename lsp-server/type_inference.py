@@ -3,27 +3,28 @@
 # Checks basic type safety
 import argparse
 import json
+from types import GeneratorType
+import uuid
 
-from graph import Graph, Node
+from astloader import is_large, iter_methods, load_ast, load_attributes
+from astnodes import lower, resolve, resolved
+from changelog import ChangeLog
+from graph import CompactGraph, Graph, Node
 from kvstore import KVStore, StoreValue
 from sutypes import SuTypes, TypeRepr
 from type_parser import get_test_custom_type_bindings, get_test_custom_type_values, get_test_parameter_type_values
+from snapshot import write_snapshot
+from unionfind import ConstraintSolver
 from utils import DebugInfo
 
 
 def load_data_body() -> dict:
-
-    with open('ast.json') as data_file:
-        data = json.load(data_file)
-
-    return data['Methods']
+    return load_ast('ast.json')['Methods']
 
 def load_data_attributes() -> dict:
-
-    with open('ast.json') as data_file:
-        data = json.load(data_file)
-
-    return data['Attributes']
+    if is_large('ast.json'):
+        return load_attributes('ast.json')
+    return load_ast('ast.json')['Attributes']
 
 
 def constraint_type_with_operator_value(value, type) -> bool:
@@ -54,7 +55,26 @@ def get_valid_type_for_operator(value) -> TypeRepr:
 
     if (x:= valid_types.get(value, None)) is None:
         raise NotImplementedError("valid operator type not implemented")
-    return TypeRepr({ "form": "Primitive", "meaning": [x], "name": SuTypes.to_str(x) })
+    return TypeRepr.primitive(x)
+
+# operator Value -> get_valid_type_for_operator, see operator_type
+operator_types = {}
+
+def operator_type(stmt) -> TypeRepr:
+    """
+    get_valid_type_for_operator of a lowered node, looked up once per distinct
+    operator like astnodes.resolve does for Type_t
+    """
+    if (t := operator_types.get(stmt.value)) is None:
+        t = get_valid_type_for_operator(stmt.value)
+        if TypeRepr.hash_consing:
+            operator_types[stmt.value] = t
+    return t
+
+def any_type() -> TypeRepr:
+    if (t := resolved.get("Any")) is None:
+        t = resolve("Any")
+    return t
 
 def get_type_assertion_functions() -> list[str]:
     return [
@@ -68,58 +88,90 @@ def get_type_assertion_functions() -> list[str]:
     ]
 
 
+def actual_type(stmt) -> TypeRepr:
+    """
+    the primitive type declared by Type_t of a lowered node
+    """
+    if stmt.actual is None:
+        # raises the usual error for a Type_t that names no SuTypes
+        return TypeRepr.primitive(SuTypes.from_str(stmt.type_t))
+    return stmt.actual
+
 def infer_generic(stmt, store, graph, attributes) -> TypeRepr:
-    match stmt["Tag"]:
-        case "Unary":
-            return infer_unary(stmt, store, graph, attributes)
-        case "Binary":
-            return infer_binary(stmt, store, graph, attributes)
-        case "Nary":
-            return infer_nary(stmt, store, graph, attributes)
-        case "Identifier":
-            if store.get(stmt["ID"]) is not None:
-                return store.get(stmt["ID"]).inferred
-            return TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.Any))
-        case "If":
-            return infer_if(stmt, store, graph, attributes)
-        case "Compound":
-            # ! possible useless expression error?
-            if len(stmt["Args"]) == 0:
-                return None
-            return infer_generic(stmt["Args"][0], store, graph, attributes)
-        case "Call":
-            if store.get(stmt["Args"][0]["ID"]) is not None:
-                if store.get(stmt["Args"][0]["ID"]).inferred != TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.Function)):
-                    raise TypeError(f"{store.get(stmt['Args'][0]['ID']).value} is not callable, it is of type {store.get(stmt['Args'][0]['ID']).inferred} instead")
-            return infer_generic(stmt["Args"][0], store, graph, attributes)
-        case "Return":
-            return infer_generic(stmt["Args"][0], store, graph, attributes)
-        case "Object":
-            return infer_object(stmt["Args"], store, graph, attributes)
-        case "Member":
-            return infer_attribute(stmt, store, graph, attributes)
-        case "Constant":
-            return TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.from_str(stmt["Type_t"])))
-        case _:
-            raise NotImplementedError(f"missed case {stmt['Tag']}")
+    """
+    walks stmt with an explicit stack instead of recursing, so expressions of any
+    depth can be inferred
+
+    a handler that needs the type of a child yields the child and is sent its
+    type back, one that needs none just returns, see HANDLERS
+    """
+    if (handler := HANDLERS.get(stmt.tag)) is None:
+        raise NotImplementedError(f"missed case {stmt.tag}")
+    t = handler(stmt, store, graph, attributes)
+    if type(t) is not GeneratorType:
+        return t
+
+    # send of every handler waiting on a child, the innermost one is send
+    waiting = []
+    send = t.send
+    t = None
+    while True:
+        try:
+            stmt = send(t)
+        except StopIteration as done:
+            if not waiting:
+                return done.value
+            send = waiting.pop()
+            t = done.value
+            continue
+        if (handler := HANDLERS.get(stmt.tag)) is None:
+            raise NotImplementedError(f"missed case {stmt.tag}")
+        t = handler(stmt, store, graph, attributes)
+        if type(t) is GeneratorType:
+            waiting.append(send)
+            send = t.send
+            t = None
+
+def infer_identifier(stmt, store, graph, attributes) -> TypeRepr:
+    if (v := store.get(stmt.id)) is not None:
+        return v.inferred
+    return any_type()
+
+def infer_compound(stmt, store, graph, attributes) -> TypeRepr:
+    # ! possible useless expression error?
+    if len(stmt.args) == 0:
+        return None
+    return (yield stmt.args[0])
+
+def infer_call(stmt, store, graph, attributes) -> TypeRepr:
+    if (v := store.get(stmt.args[0].id)) is not None:
+        if v.inferred != TypeRepr.primitive(SuTypes.Function):
+            raise TypeError(f"{v.value} is not callable, it is of type {v.inferred} instead")
+    return (yield stmt.args[0])
+
+def infer_return(stmt, store, graph, attributes) -> TypeRepr:
+    return (yield stmt.args[0])
+
+def infer_constant(stmt, store, graph, attributes) -> TypeRepr:
+    return actual_type(stmt)
 
 def infer_unary(stmt, store, graph, attributes) -> TypeRepr:
-    args = stmt["Args"]
-    value = stmt["Value"]
+    args = stmt.args
+    value = stmt.value
 
     if value in ["LParen", "RParen"]:
-        ret_t = infer_generic(args[0], store, graph, attributes)
-        v = StoreValue(args[0]["Value"], 
-                       TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.from_str(args[0]["Type_t"]))),
+        ret_t = yield args[0]
+        v = StoreValue(args[0].value, 
+                       actual_type(args[0]),
                        ret_t)
-        store.set(args[0]["ID"], v)
+        store.set(args[0].id, v)
         return ret_t
      
 
-    node = Node(args[0]["ID"])
+    node = Node(args[0].id)
     graph.add_node(node)
 
-    valid_t = get_valid_type_for_operator(value)
+    valid_t = operator_type(stmt)
     vn = Node(valid_t.name)
     graph.add_node(vn)
     graph.add_edge(node.value, vn.value)
@@ -128,47 +180,47 @@ def infer_unary(stmt, store, graph, attributes) -> TypeRepr:
 
 
 def infer_binary(stmt, store, graph, attributes) -> TypeRepr:
-    args = stmt["Args"]
+    args = stmt.args
     lhs = args[0]
     rhs = args[1::][0]
 
     # inferred types of lhs and rhs should be the same
-    lhs_t = infer_generic(lhs, store, graph, attributes)
-    if lhs_t is not None and lhs["Type_t"] != "Operator":
+    lhs_t = yield lhs
+    if lhs_t is not None and lhs.type_t != "Operator":
         v = StoreValue(
-            lhs["Value"], 
-            TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.from_str(lhs["Type_t"]))),
+            lhs.value, 
+            actual_type(lhs),
             lhs_t
         )
-        store.set(lhs["ID"], v)
-    rhs_t = infer_generic(rhs, store, graph, attributes)
-    if rhs_t is not None and rhs["Type_t"] != "Operator":
+        store.set(lhs.id, v)
+    rhs_t = yield rhs
+    if rhs_t is not None and rhs.type_t != "Operator":
         v = StoreValue(
-            rhs["Value"], 
-            TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.from_str(rhs["Type_t"]))),
+            rhs.value, 
+            actual_type(rhs),
             rhs_t)
-        store.set(rhs["ID"], v)
+        store.set(rhs.id, v)
 
     # if not check_type_equivalence(lhs_t, rhs_t):
     #     raise TypeError(f"Type mismatch for {lhs_t} and {rhs_t}")
-    lhs_n = Node(lhs["ID"])
-    rhs_n = Node(rhs["ID"])
+    lhs_n = Node(lhs.id)
+    rhs_n = Node(rhs.id)
     graph.add_node(lhs_n)
     graph.add_node(rhs_n)
     graph.add_edge(lhs_n.value, rhs_n.value)
 
     if lhs_t != rhs_t:
-        raise TypeError(f"Conflicting inferred types for variable {lhs['ID']}\nexisting: {lhs_t}, \ngot: {rhs_t}")
-    elif lhs_t == TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.Any)):
-        store.set(lhs["ID"], StoreValue(rhs["Value"], 
-            TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.from_str(rhs["Type_t"]))),
+        raise TypeError(f"Conflicting inferred types for variable {lhs.id}\nexisting: {lhs_t}, \ngot: {rhs_t}")
+    elif lhs_t == any_type():
+        store.set(lhs.id, StoreValue(rhs.value, 
+            actual_type(rhs),
             rhs_t
             )
         )
         return rhs_t
-    elif rhs_t == TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.Any)):
-        store.set(rhs["ID"], StoreValue(lhs["Value"], 
-                TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.from_str(lhs["Type_t"]))),
+    elif rhs_t == any_type():
+        store.set(rhs.id, StoreValue(lhs.value, 
+                actual_type(lhs),
                 lhs_t
             )
         )
@@ -178,41 +230,40 @@ def infer_binary(stmt, store, graph, attributes) -> TypeRepr:
 
 
 def infer_nary(stmt, store, graph, attributes) -> TypeRepr:
-    value = stmt["Value"]
-    args = stmt["Args"]
+    args = stmt.args
 
-    valid_t = get_valid_type_for_operator(value)
+    valid_t = operator_type(stmt)
 
     prev = None
     for i in args:
-        if i["Tag"] == "Call":
-            i = i["Args"][0]
-            if i["Value"] in get_type_assertion_functions():
-                typed_check_t = SuTypes.from_str(i["Value"].removesuffix("?"))
-                typed_check_t = TypeRepr(TypeRepr.construct_definition_from_primitive(typed_check_t))
-                type_checked_var = i["Args"][0]
+        if i.tag == "Call":
+            i = i.args[0]
+            if i.value in get_type_assertion_functions():
+                typed_check_t = SuTypes.from_str(i.value.removesuffix("?"))
+                typed_check_t = TypeRepr.primitive(typed_check_t)
+                type_checked_var = i.args[0]
 
                 v = StoreValue(
-                    type_checked_var["Value"], 
-                    TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.from_str(type_checked_var["Type_t"]))),
+                    type_checked_var.value, 
+                    actual_type(type_checked_var),
                     typed_check_t 
                     )
-                store.set(type_checked_var["ID"], v)
+                store.set(type_checked_var.id, v)
 
-                n = Node(type_checked_var["ID"])
+                n = Node(type_checked_var.id)
                 graph.add_node(n)
                 primitive_type_node = graph.find_node(typed_check_t.get_name())
                 graph.add_edge(n.value, primitive_type_node.value)
 
-        n = Node(i["ID"])
+        n = Node(i.id)
         """
         NOTE: Infer Generic cause Args might not always be constants and variables,
                 so infer a generic somewhere here to infer further
         """
-        n_infer = infer_generic(i, store, graph, attributes)
-        # v = StoreValue(i["Value"], TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.from_str(i["Type_t"]))), valid_t)
-        v = StoreValue(i["Value"], n_infer, valid_t)
-        store.set(i["ID"], v)
+        n_infer = yield i
+        # v = StoreValue(i.value, actual_type(i), valid_t)
+        v = StoreValue(i.value, n_infer, valid_t)
+        store.set(i.id, v)
         graph.add_node(n)
         if prev is not None:
             graph.add_edge(prev.value, n.value)
@@ -226,50 +277,50 @@ def infer_nary(stmt, store, graph, attributes) -> TypeRepr:
     return valid_t
 
 def infer_if(stmt, store, graph, attributes):
-    cond = stmt["Args"][0]
-    cond_t = infer_generic(cond, store, graph, attributes)
+    cond = stmt.args[0]
+    cond_t = yield cond
     if cond_t is not None:
         v = StoreValue(
-            cond["Value"], 
-            TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.from_str(cond["Type_t"]))),
+            cond.value, 
+            actual_type(cond),
             cond_t)
-        store.set(cond["ID"], v)
+        store.set(cond.id, v)
 
-    then = stmt["Args"][1]
-    then_t = infer_generic(then, store, graph, attributes)
+    then = stmt.args[1]
+    then_t = yield then
     if then_t is not None:
         v = StoreValue(
-            then["Value"], 
-            TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.from_str(then["Type_t"]))), 
+            then.value, 
+            actual_type(then), 
             then_t)
-        store.set(then["ID"], v)
+        store.set(then.id, v)
 
-    if len(stmt["Args"]) == 3:
-        else_t = infer_generic(stmt["Args"][2], store, graph, attributes)
+    if len(stmt.args) == 3:
+        else_t = yield stmt.args[2]
         if else_t is not None:
             v = StoreValue(
-                stmt["Args"][2]["Value"], 
-                TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.from_str(stmt["Args"][2]["Type_t"]))), 
+                stmt.args[2].value, 
+                actual_type(stmt.args[2]), 
                 else_t)
-            store.set(stmt["Args"][2]["ID"], v)
+            store.set(stmt.args[2].id, v)
 
     return None
 
 def infer_attribute(stmt, store, graph, attributes) -> TypeRepr:
-    value = stmt["Value"]
+    value = stmt.value
     attrb_t = attributes.get(value, None)
 
     if attrb_t is None:
         raise TypeError(f"Attribute `{value}` not found in current class")
     
-    valid_t = TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.from_str(attrb_t["Type_t"])))
-    v = StoreValue(stmt["Value"], 
-                   TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.from_str(stmt["Type_t"]))),
+    valid_t = TypeRepr.primitive(SuTypes.from_str(attrb_t["Type_t"]))
+    v = StoreValue(stmt.value, 
+                   actual_type(stmt),
                    valid_t
                 )
-    store.set(stmt["ID"], v)
+    store.set(stmt.id, v)
 
-    n = Node(stmt["ID"])
+    n = Node(stmt.id)
     graph.add_node(n)
     t = graph.find_node(valid_t.get_name())
     # t.add_edge(n)
@@ -280,37 +331,134 @@ def infer_attribute(stmt, store, graph, attributes) -> TypeRepr:
 def infer_object(stmt, store, graph, attributes):
     obj_def = {}
 
-    for i in stmt:
-        t = infer_generic(i["Args"][0], store, graph, attributes)
-        v = StoreValue(i["Args"][0]["Value"], TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.from_str(i["Args"][0]["Type_t"]))), t)
-        store.set(i["Args"][0]["ID"], v)
+    for i in stmt.args:
+        t = yield i.args[0]
+        v = StoreValue(i.args[0].value, actual_type(i.args[0]), t)
+        store.set(i.args[0].id, v)
         # construct obj def struct for TypeRepr
-        obj_def[i["Value"]] = t
-        n = Node(i["Args"][0]["ID"])
+        obj_def[i.value] = t
+        n = Node(i.args[0].id)
         graph.add_node(n)
         graph.add_edge(n.value, graph.find_node(t.get_name()).value)
 
-    return TypeRepr({"form": "Object", "meaning": obj_def})
+    # named after the literal rather than a fresh uuid so that a worker (see
+    # parallel.py) and a serial run give it the same name
+    return TypeRepr.of({"form": "Object", "meaning": obj_def, "name": uuid.uuid5(uuid.NAMESPACE_OID, stmt.id).hex})
+
+# tag -> handler of a lowered node, handlers with children are generators, see infer_generic
+HANDLERS = {
+    "Unary": infer_unary,
+    "Binary": infer_binary,
+    "Nary": infer_nary,
+    "Identifier": infer_identifier,
+    "If": infer_if,
+    "Compound": infer_compound,
+    "Call": infer_call,
+    "Return": infer_return,
+    "Object": infer_object,
+    "Member": infer_attribute,
+    "Constant": infer_constant,
+}
 
 def propogate_infer(store, graph, typedefs, attributes, check=False):
     primitives = graph.get_basal_types()
 
-    # dfs through each primitive and assign the same sutype to connecting nodes
-    for x, p in enumerate(primitives):
-        if x == 10:
-            pass
-        p = graph.find_node(p.value)
-        
-        type_value = None
-        if p.value in graph.get_primitive_type_string():
-            type_value = TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.from_str(p.value)))
-        elif typedefs.get(p.value) is not None:
-            type_value = TypeRepr(typedefs[p.value])
-        
-        if type_value is None:
-            raise ValueError(f"Type not found for {p.value}")
-
-        p.propogate_type(store, new_type=type_value, check=check)
+    # resolve each primitive, the graph then assigns the same sutype to connecting nodes
+    sources = [(p.value, resolve_basal_type(p.value, graph, typedefs)) for p in primitives]
+
+    conflicts = graph.propogate(store, sources, check=check)
+    # the graph engines label each component with one basal type and only record where two meet
+    if check and conflicts:
+        value, first, later = conflicts[0]
+        raise TypeError(f"Types {first} and {later} cannot be equated, they meet at {value}")
+
+def resolve_basal_type(value, graph, typedefs) -> TypeRepr:
+    if value in graph.get_primitive_type_string():
+        return TypeRepr.primitive(SuTypes.from_str(value))
+    elif typedefs.get(value) is not None:
+        return TypeRepr.of(typedefs[value])
+
+    raise ValueError(f"Type not found for {value}")
+
+def check_per_method(graph):
+    """
+    only Graph tracks which method owns a node, see Graph.drop_method
+    """
+    if not isinstance(graph, Graph):
+        raise ValueError(f"per method inference needs the graph engine, got {type(graph).__name__}")
+
+def propogate_method(fn, store, graph, typedefs, check=False):
+    """
+    like propogate_infer but only for the nodes owned by method fn, each node takes
+    the type of the basal type in its component, see Graph.basal_type_of
+    """
+    check_per_method(graph)
+    primitive_str = graph.get_primitive_type_string()
+    resolved = {}
+    set_owner(store, graph, fn)
+    for value in list(graph.owned.get(fn, {})):
+        basal = graph.basal_type_of(value)
+        if basal is None or value in primitive_str:
+            continue
+        if basal not in resolved:
+            resolved[basal] = resolve_basal_type(basal, graph, typedefs)
+        t = resolved[basal]
+        store.set_on_type_equivalence(value, StoreValue(value, t, t), check=check)
+    set_owner(store, graph, None)
+
+def infer_method(fn, methods, typedefs, bindings, param_t, store, graph, attributes, propogate=False, dbg=None):
+    """
+    infers method fn on its own inside a store transaction, when it conflicts only
+    fn is rolled back and the rest of the store and graph stay usable
+
+    @raises TypeError: once the store and graph hold nothing of fn anymore
+    """
+    check_per_method(graph)
+    method = {fn: methods[fn]}
+    try:
+        with store.transaction():
+            process_custom_types(method, typedefs, bindings, param_t, store, graph, attributes, dbg=dbg)
+            process_parameters(method, typedefs, bindings, param_t, store, graph, attributes, dbg=dbg)
+            process_methods(method, store, graph, attributes, dbg=dbg)
+            if propogate:
+                propogate_method(fn, store, graph, typedefs, check=False)
+    except TypeError:
+        set_owner(store, graph, None)
+        # the values of the dropped nodes were already rolled back
+        graph.drop_method(fn)
+        store.drop_method(fn)
+        raise
+
+def reinfer_method(fn, methods, typedefs, bindings, param_t, store, graph, attributes, dbg=None):
+    """
+    drops everything method fn added to the store and graph, then infers it again
+    the cost is proportional to the size of the method rather than the class
+    """
+    check_per_method(graph)
+    for value in graph.drop_method(fn):
+        store.delete(value)
+    store.drop_method(fn)
+
+    infer_method(fn, methods, typedefs, bindings, param_t, store, graph, attributes, propogate=True, dbg=dbg)
+
+def infer_streamed(path, typedefs, bindings, param_t, store, graph, attributes, dbg=None):
+    """
+    runs process_custom_types, process_parameters and process_methods one method
+    at a time as it is read from path (see astloader.iter_methods), only the
+    method being inferred is held in memory
+    """
+    for fn, func in iter_methods(path):
+        method = {fn: func}
+        process_custom_types(method, typedefs, bindings, param_t, store, graph, attributes, dbg=dbg)
+        process_parameters(method, typedefs, bindings, param_t, store, graph, attributes, dbg=dbg)
+        process_methods(method, store, graph, attributes, dbg=dbg)
+
+def set_owner(store, graph, method):
+    """
+    nodes and values created while method is the owner are dropped with it
+    """
+    store.owner = method
+    graph.owner = method
 
 def parse_class(clss):
     members = {}
@@ -324,6 +472,7 @@ def process_parameters(methods, typedefs, bindings, param_t, store, graph, attri
     for k, v in methods.items():
         if dbg is not None:
             dbg.set_func(k)
+        set_owner(store, graph, k)
         if v["Parameters"] != []:
             if param_t.get(k) is None:
                 continue
@@ -333,8 +482,8 @@ def process_parameters(methods, typedefs, bindings, param_t, store, graph, attri
                 p_id = p["ID"]
                 p_t = param_t.get(k).get(p["Value"])
                 if p_t is not None:
-                    tr = TypeRepr(p_t)
-                    v = StoreValue(p_id, TypeRepr(p_t), TypeRepr(p_t))
+                    tr = TypeRepr.of(p_t)
+                    v = StoreValue(p_id, tr, tr)
                     store.set(p_id, v)
                     n = Node(p_id)
                     graph.add_node(n)
@@ -347,87 +496,56 @@ def process_parameters(methods, typedefs, bindings, param_t, store, graph, attri
                             primitive_type_node = graph.find_node(b)
 
                     graph.add_edge(n.value, primitive_type_node.value)
-            
+
+    set_owner(store, graph, None)
+
 def process_custom_types(methods, typedefs, bindings, param_t, store, graph, attributes, dbg=None):
     for fn, body in methods.items():
         if dbg is not None:
             dbg.set_func(fn)
+        set_owner(store, graph, fn)
+        if fn not in store.symbols.indexed:
+            store.symbols.index_method(fn, body)
         # get all keys and values in bindings that begin with k_
         b = {k: v for k, v in bindings.items() if k.startswith(f"{fn}_")}
-        if b != {}:
-            addedQ = False
-            for var, var_t in b.items():
-                for i in body["Body"]:
-                    var = var.removeprefix(fn + "_")
-                    id_found = lookup_variable(var, i[0])
-                    if (id_found is not None) or ((not addedQ) and (var == list(param_t.get(fn).keys())[0])):
-                        if id_found is None:
-                            id_found = [x["ID"] for x in methods.get(fn).get("Parameters") if x["Value"] == var][0]
-
-                        unknown_type = TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.Unknown))
-                        inf_t = TypeRepr(typedefs[var_t])
-                        v = StoreValue(var, unknown_type, inf_t)
-                        store.set(id_found, v)
-
-                        if graph.find_node(typedefs[var_t]) is None:
-                            graph.add_basal_type(Node(var_t))
-                        
-                        n = Node(id_found)
-                        graph.add_node(n)
-
-                        primitive_type_node = graph.find_node(var_t)
-                        graph.add_edge(n.value, primitive_type_node.value)
-
-                        addedQ = True
-
-# like infer_generic, but no inference, just matches the string of the variable passed in and return the ID
-def lookup_variable(var, stmt):
-    match stmt["Tag"]:
-        case "Unary":
-            return lookup_variable(var, stmt["Args"][0])
-        case "Binary":
-            return lookup_variable(var, stmt["Args"][0]) or lookup_variable(var, stmt["Args"][1])
-        case "Nary":
-            return [lookup_variable(var, i) for i in stmt["Args"]]
-        case "Identifier":
-            if stmt["Value"] == var:
-                return stmt["ID"]
-            return None
-        case "If":
-            return lookup_variable(var, stmt["Args"][0]) or lookup_variable(var, stmt["Args"][1]) or lookup_variable(var, stmt["Args"][2])
-        case "Call" | "Compound":
-            return lookup_variable(var, stmt["Args"][0])
-        case "Return":
-            return lookup_variable(var, stmt["Args"][0])
-        case "Object":
-            return [lookup_variable(var, i) for i in stmt["Args"]]
-        case "Member":
-            return lookup_variable(var, stmt["Args"][0])
-        case "Constant":
-            return None
-        case _:
-            raise NotImplementedError(f"missed case {stmt['Tag']}")
+        for var, var_t in b.items():
+            var = var.removeprefix(fn + "_")
+            for id_found in store.symbols.lookup(fn, var):
+                unknown_type = TypeRepr.primitive(SuTypes.Unknown)
+                inf_t = TypeRepr.of(typedefs[var_t])
+                v = StoreValue(var, unknown_type, inf_t)
+                store.set(id_found, v)
+
+                if graph.find_node(var_t) is None:
+                    graph.add_basal_type(Node(var_t))
+
+                n = Node(id_found)
+                graph.add_node(n)
+
+                primitive_type_node = graph.find_node(var_t)
+                graph.add_edge(n.value, primitive_type_node.value)
 
+    set_owner(store, graph, None)
 
 def process_methods(methods, store, graph, attributes, dbg=None):
     for k, v in methods.items():
         if dbg is not None:
             dbg.set_func(k)
-        if k == "GetUserAuthCall":
-            pass
-        for x, i in enumerate(v["Body"]):
+        set_owner(store, graph, k)
+        for x, line in enumerate(v.get("Body") or []):
+            i = lower(line[0])
             if dbg is not None:
                 dbg.set_line(x + 1)
-            valid_t = infer_generic(i[0], store, graph, attributes)
+            valid_t = infer_generic(i, store, graph, attributes)
             if valid_t is None:
                 continue
             v = StoreValue(
-                i[0]["Value"], 
-                TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.from_str(i[0]["Type_t"]))), 
+                i.value, 
+                actual_type(i), 
                 valid_t
                 )
-            store.set(i[0]["ID"], v)
-            n = Node(i[0]["ID"])
+            store.set(i.id, v)
+            n = Node(i.id)
             graph.add_node(n)
 
             if graph.find_node(valid_t.get_name()) is None:
@@ -435,7 +553,116 @@ def process_methods(methods, store, graph, attributes, dbg=None):
 
             graph.add_edge(n.value, graph.find_node(valid_t.get_name()).value)
 
+    set_owner(store, graph, None)
+
+
+ENGINES = {
+    "graph": Graph,
+    "compact": CompactGraph,
+    "unionfind": ConstraintSolver,
+}
+
+def add_arguments(p):
+    """
+    the inference options shared with pipeline.py
+    """
+    p.add_argument("--engine", choices=list(ENGINES), default="graph",
+                   help="graph walks the type graph, compact walks an array backed graph, unionfind solves equality constraints with a disjoint set")
+    p.add_argument("--normalise", action="store_true",
+                   help="compress the graph into stars around the basal types before propogating (graph engine only)")
+    p.add_argument("--snapshot", metavar="PATH",
+                   help="also write the store and graph as a binary snapshot, see snapshot.py")
+    p.add_argument("--log", metavar="PATH",
+                   help="append what changed since the last run to a change log instead of rewriting type_store.json and type_graph.json, see changelog.py (graph engine only)")
+    p.add_argument("--jobs", type=int, metavar="N",
+                   help="infer the methods in N worker processes, see parallel.py (graph engine only). off by default, it is slower than a serial run unless the cores outrun the merge, measure with bench.py parallel")
+    p.add_argument("--capacity", type=int, metavar="N",
+                   help="keep at most N store values in memory and spill the rest to sqlite, see spillstore.py")
+    p.add_argument("--cache", metavar="PATH",
+                   help="restore methods unchanged since the last run from a cache, see methodcache.py (graph engine only)")
+
+def check_arguments(p, args):
+    if args.normalise and args.engine != "graph":
+        p.error("--normalise needs the graph engine")
+    if args.log is not None and args.engine != "graph":
+        p.error("--log needs the graph engine")
+    if (args.jobs is not None or args.cache is not None) and args.engine != "graph":
+        p.error("--jobs and --cache need the graph engine")
+    if args.jobs is not None and args.jobs < 1:
+        p.error("--jobs needs at least one worker")
+    if args.capacity is not None and args.capacity < 1:
+        p.error("--capacity needs room for at least one value")
+
+def infer(engine="graph", normalise=False, dbg=None, jobs=None, cache=None, capacity=None):
+    """
+    runs every inference pass over ast.json
+
+    @param jobs: number of worker processes for the per method passes, serial when None
+    @param cache: path of the method cache, see methodcache.py
+    @param capacity: values the store keeps in memory, unbounded when None, see
+                     spillstore.py. The caller closes the store once done with it
 
+    serial inference streams files larger than astloader.STREAM_ABOVE
+    @return: (store, graph)
+    """
+    graph = ENGINES[engine]()
+    if capacity is None:
+        store = KVStore()
+    else:
+        from spillstore import BoundedKVStore
+        store = BoundedKVStore(capacity)
+    attributes = parse_class(load_data_attributes())
+
+    param_t = get_test_parameter_type_values()
+    typedefs = get_test_custom_type_values()
+    bindings = get_test_custom_type_bindings()
+
+    # a large class is read a method at a time, the other paths need every method up front
+    streamed = jobs is None and cache is None and is_large('ast.json')
+    if not streamed:
+        methods = parse_class(load_data_body())
+
+    if streamed:
+        infer_streamed('ast.json', typedefs, bindings, param_t, store, graph, attributes, dbg=dbg)
+    elif cache is not None:
+        from methodcache import MethodCache, infer_cached
+        with MethodCache(cache) as method_cache:
+            infer_cached(methods, typedefs, bindings, param_t, store, graph, attributes, method_cache, jobs=jobs, source='ast.json')
+            stats = method_cache.stats()
+        print(f"method cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
+    elif jobs is not None:
+        from parallel import infer_parallel
+        infer_parallel(methods, typedefs, bindings, param_t, store, graph, attributes, jobs=jobs)
+    else:
+        process_custom_types(methods, typedefs, bindings, param_t, store, graph, attributes, dbg=dbg)
+        process_parameters(methods, typedefs, bindings, param_t, store, graph, attributes, dbg=dbg) 
+        process_methods(methods, store, graph, attributes, dbg=dbg)
+    if normalise:
+        stats = graph.normalise()
+        print(f"normalised graph: {stats['nodes_before']} -> {stats['nodes_after']} nodes, {stats['edges_before']} -> {stats['edges_after']} edges")
+    propogate_infer(store, graph, typedefs, attributes, check=False)
+
+    return store, graph
+
+def write_outputs(store, graph, json_files=True, snapshot=None, log=None):
+    """
+    @param json_files: write type_store.json and type_graph.json
+    @param snapshot: path of a binary snapshot to write, see snapshot.py
+    @param log: path of a change log to append the delta to, see changelog.py
+    """
+    if json_files:
+        with open("type_store.json", "w") as fobj:
+            store.write_flat(fobj)
+
+        with open("type_graph.json", "w") as fobj:
+            json.dump(graph.to_json(), fobj, indent=4)
+
+    if snapshot is not None:
+        write_snapshot(snapshot, store, graph)
+
+    if log is not None:
+        with ChangeLog(log) as changelog:
+            changelog.append_delta(store, graph)
 
 def main():
     global debug_info
@@ -443,12 +670,9 @@ def main():
 
     p = argparse.ArgumentParser("Type Inference")
     p.add_argument("-t", action="store_true")
+    add_arguments(p)
     args = p.parse_args()
-
-    graph = Graph()
-    store = KVStore()
-    attributes = parse_class(load_data_attributes())
-    methods = parse_class(load_data_body())
+    check_arguments(p, args)
 
     # print("=" * 80)
     ascii_blocks = """
@@ -461,15 +685,8 @@ def main():
     # print(ascii_blocks)
     # print("=" * 80)
 
-    param_t = get_test_parameter_type_values()
-    typedefs = get_test_custom_type_values()
-    bindings = get_test_custom_type_bindings()
-
     # try:
-    process_custom_types(methods, typedefs, bindings, param_t, store, graph, attributes, dbg=debug_info)
-    process_parameters(methods, typedefs, bindings, param_t, store, graph, attributes, dbg=debug_info) 
-    process_methods(methods, store, graph, attributes, dbg=debug_info)
-    propogate_infer(store, graph, typedefs, attributes, check=False)
+    store, graph = infer(args.engine, args.normalise, dbg=debug_info, jobs=args.jobs, cache=args.cache, capacity=args.capacity)
     # except Exception as e:
     #     if not args.t:
     #         print(f"Exception: {e}")
@@ -503,11 +720,10 @@ def main():
     # print("=" * 80)
     # print(json.dumps(graph.to_json(), indent=4))
 
-    with open("type_store.json", "w") as fobj:
-        json.dump(store.to_json(), fobj, indent=4)
-
-    with open("type_graph.json", "w") as fobj:
-        json.dump(graph.to_json(), fobj, indent=4)
+    # the checker reads a change log with --log, the JSON files would only be rewritten in full
+    write_outputs(store, graph, json_files=args.log is None, snapshot=args.snapshot, log=args.log)
+    if args.capacity is not None:
+        store.close()
 
 if __name__ == "__main__":
     main()
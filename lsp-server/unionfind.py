@@ -0,0 +1,330 @@
+from collections import deque
+import json
+
+from graph import Graph, Node
+from kvstore import StoreValue
+
+
+class DisjointSet:
+    """
+    Disjoint set forest with path compression and union by rank
+    elements are any hashable value, sets are created lazily on first use
+    """
+
+    def __init__(self):
+        self.parent = {}
+        self.rank = {}
+
+    def __contains__(self, x) -> bool:
+        return x in self.parent
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def make_set(self, x):
+        if x not in self.parent:
+            self.parent[x] = x
+            self.rank[x] = 0
+
+    def find(self, x):
+        self.make_set(x)
+
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+
+        # path compression, point everything on the way straight at the root
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+
+        return root
+
+    def union(self, x, y):
+        """
+        @return: (root, absorbed) the new root and the root that was merged into it,
+                 absorbed is None when x and y were already in the same set
+        """
+        rx, ry = self.find(x), self.find(y)
+        if rx == ry:
+            return rx, None
+
+        if self.rank[rx] < self.rank[ry]:
+            rx, ry = ry, rx
+        self.parent[ry] = rx
+        if self.rank[rx] == self.rank[ry]:
+            self.rank[rx] += 1
+
+        return rx, ry
+
+    def groups(self) -> dict:
+        """
+        root -> list of members, members are in insertion order
+        """
+        groups = {}
+        for x in self.parent:
+            groups.setdefault(self.find(x), []).append(x)
+        return groups
+
+
+class ConstraintSolver:
+    """
+    An alternative engine to Graph + Node.propogate_type
+
+    Every edge in the type graph means equality, so instead of keeping the edges
+    around and walking them later, each edge merges two equivalence classes.
+    Each class remembers the basal type (primitive or typedef) that labels it,
+    two different primitives landing in the same class is a type error and is
+    raised as soon as the offending union happens.
+
+    Exposes the subset of the Graph interface used by type_inference, nodes are
+    not owned by methods so the per method passes (type_inference.infer_method)
+    need the Graph engine
+    """
+
+    def __repr__(self) -> str:
+        return f"ConstraintSolver(\n\t{self.sets.groups()}\n)"
+
+    def __init__(self):
+        self.nodes = {}
+        self.sets = DisjointSet()
+        self.primitive_type_nodes = []
+        # root -> value of the basal type labelling the class
+        self.labels = {}
+        self.primitive_names = set()
+        # every edge that was added, in order, see propogate
+        self.edges = []
+
+        for i in Graph.get_primitive_type_nodes():
+            self.add_node(i)
+            self.primitive_type_nodes.append(i)
+            self.labels[i.value] = i.value
+            self.primitive_names.add(i.value)
+
+    @staticmethod
+    def get_primitive_type_string():
+        return Graph.get_primitive_type_string()
+
+    def get_basal_types(self):
+        return self.primitive_type_nodes
+
+    def add_basal_type(self, ty):
+        """
+        @side-effect: also adds the node to the graph
+        """
+        if not isinstance(ty, Node):
+            raise ValueError("ty must be of type Node")
+
+        if self.find_node(ty.value) is None:
+            self.add_node(ty)
+            self.primitive_type_nodes.append(ty)
+            self.labels[ty.value] = ty.value
+
+    def get_nodes(self):
+        return list(self.nodes.values())
+
+    def find_node(self, name):
+        return self.nodes.get(name, None)
+
+    def add_node(self, node):
+        """
+        @param node: Node instance
+        """
+        if node.value not in self.nodes:
+            self.nodes[node.value] = node
+            self.sets.make_set(node.value)
+
+    def add_edge(self, node1, node2):
+        """
+        @param node1: node value
+        @param node2: node value
+
+        @side-effect: merges the classes of node1 and node2
+        @raises TypeError: when the merge equates two different primitive types
+        """
+        if node1 not in self.nodes or node2 not in self.nodes:
+            raise Exception("Node not found")
+
+        r1, r2 = self.sets.find(node1), self.sets.find(node2)
+        if r1 == r2:
+            if node1 != node2:
+                self.edges.append((node1, node2))
+            return
+
+        l1, l2 = self.labels.get(r1), self.labels.get(r2)
+        if l1 in self.primitive_names and l2 in self.primitive_names:
+            raise TypeError(f"Types {l1} and {l2} cannot be equated")
+        self.edges.append((node1, node2))
+
+        # a primitive label wins over a typedef label
+        label = l1 if l1 in self.primitive_names or l2 is None else l2
+        root, absorbed = self.sets.union(r1, r2)
+        self.labels.pop(absorbed, None)
+        if label is not None:
+            self.labels[root] = label
+
+    def path_exists(self, node1, node2):
+        if node1 not in self.nodes or node2 not in self.nodes:
+            return False
+        return self.sets.find(node1) == self.sets.find(node2)
+
+    def conflicting_components(self, basal=None) -> list:
+        """
+        same as Graph.conflicting_components, always empty for a solver that was
+        only grown through add_edge since conflicts are raised on union
+        """
+        if basal is None:
+            basal = [n.value for n in self.primitive_type_nodes]
+
+        found = {}
+        for value in basal:
+            if value in self.nodes:
+                found.setdefault(self.sets.find(value), []).append(value)
+
+        return [v for v in found.values() if len(v) > 1]
+
+    def type_of(self, node):
+        """
+        @return: value of the basal type representing the class of node, or None
+        """
+        if node not in self.nodes:
+            return None
+        return self.labels.get(self.sets.find(node))
+
+    def propogate(self, store, sources, check=False):
+        """
+        @param sources: list of (basal type value, TypeRepr) in basal order
+
+        writes the same StoreValues Graph.propogate does, a class holding a single
+        basal type takes its type in one go while a class where several meet (a
+        primitive and a typedef) is walked like Graph.propogate, see propogate_shared
+        """
+        groups = self.sets.groups()
+        primitive_str = self.get_primitive_type_string()
+
+        found = {}
+        for value, _ in sources:
+            found.setdefault(self.sets.find(value), []).append(value)
+
+        for value, new_type in sources:
+            root = self.sets.find(value)
+            if len(found[root]) > 1:
+                continue
+            for member in groups.get(root, []):
+                if member not in primitive_str:
+                    store.set_on_type_equivalence(member, StoreValue(member, new_type, new_type), check=check)
+
+        shared = [(value, new_type) for value, new_type in sources if len(found[self.sets.find(value)]) > 1]
+        if shared:
+            self.propogate_shared(store, shared, check=check)
+
+    def propogate_shared(self, store, sources, check=False):
+        """
+        multi-source BFS over the edges of the classes of sources, each member
+        takes the type of the basal type that reaches it first as in Graph.propogate
+        """
+        roots = {self.sets.find(value) for value, _ in sources}
+        adjacency = {}
+        for node1, node2 in self.edges:
+            if self.sets.find(node1) in roots:
+                adjacency.setdefault(node1, {})[node2] = None
+                adjacency.setdefault(node2, {})[node1] = None
+
+        origin = {}
+        types = {}
+        queue = deque()
+        for value, new_type in sources:
+            types[value] = new_type
+            if value not in origin:
+                origin[value] = value
+                queue.append(value)
+
+        primitive_str = self.get_primitive_type_string()
+        while queue:
+            value = queue.popleft()
+            new_type = types[origin[value]]
+            if value not in primitive_str:
+                store.set_on_type_equivalence(value, StoreValue(value, new_type, new_type), check=check)
+            for edge in adjacency.get(value, ()):
+                if edge not in origin:
+                    origin[edge] = origin[value]
+                    queue.append(edge)
+
+    def to_json(self) -> dict:
+        """
+        classes are exported as stars around their representative so the output
+        can still be read back with Graph.from_json
+        """
+        nodes = []
+        for root, members in self.sets.groups().items():
+            centre = self.labels.get(root, root)
+            nodes.append({"value": centre, "edges": [m for m in members if m != centre]})
+            for m in members:
+                if m != centre:
+                    nodes.append({"value": m, "edges": [centre]})
+        return {"nodes": nodes}
+
+    @classmethod
+    def from_json(cls, json_data):
+        solver = cls()
+        graph_data = json.loads(json_data)
+
+        for node_data in graph_data.get('nodes', []):
+            solver.add_node(Node(node_data.get('value')))
+
+        for node_data in graph_data.get('nodes', []):
+            for edge_value in node_data.get('edges', []):
+                if edge_value in solver.nodes:
+                    solver.add_edge(node_data.get('value'), edge_value)
+
+        return solver
+
+
+def test_test():
+    solver = ConstraintSolver()
+
+    solver.add_node(Node("x"))
+    solver.add_node(Node("y"))
+    solver.add_node(Node("z"))
+
+    solver.add_edge("Number", "x")
+    solver.add_edge("x", "y")
+
+    assert solver.path_exists("Number", "y") is True
+    assert solver.path_exists("Number", "z") is False
+    assert solver.type_of("y") == "Number"
+
+    solver.add_edge("z", "String")
+    try:
+        solver.add_edge("y", "z")
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("Number and String should not be equated")
+
+    # Number - var_a - var_b - Currency, each side takes the type of the nearer basal type
+    from kvstore import KVStore
+    from sutypes import SuTypes, TypeRepr
+
+    number_t = TypeRepr.primitive(SuTypes.Number)
+    currency_t = TypeRepr.of({"form": "Union", "name": "Currency", "meaning": ["USD", "CAD"]})
+    sources = [("Number", number_t), ("Currency", currency_t)]
+    stores = []
+    for engine in (Graph, ConstraintSolver):
+        g = engine()
+        g.add_basal_type(Node("Currency"))
+        for value in ["var_a", "var_b", "var_c"]:
+            g.add_node(Node(value))
+        g.add_edge("Number", "var_a")
+        g.add_edge("var_a", "var_b")
+        g.add_edge("var_b", "Currency")
+        g.add_edge("var_c", "Number")
+        store = KVStore()
+        g.propogate(store, sources)
+        stores.append({k: v.inferred.get_key() for k, v in store.items()})
+    assert stores[0] == stores[1]
+    assert stores[1]["var_a"] == number_t.get_key() and stores[1]["var_b"] == currency_t.get_key()
+
+    print("tests passed")
+
+if __name__ == "__main__":
+    test_test()
@@ -1,7 +1,11 @@
-from graph import Graph
-from kvstore import KVStore
+import json
+import os
+import tempfile
+
+from graph import Graph, Node
+from kvstore import KVStore, StoreValue, SymbolTable
 from sutypes import SuTypes, TypeRepr
-from type_inference import parse_class, process_parameters, process_methods, process_custom_types, propogate_infer
+from type_inference import parse_class, process_parameters, process_methods, process_custom_types, propogate_infer, reinfer_method, infer_method
 
 
 def should_fail(func):
@@ -300,8 +304,389 @@ def test_raw_type_equality():
 
     # assert t1 == t2
 
+@should_pass
+def test_propogate_long_chain():
+    graph = Graph()
+    store = KVStore()
+
+    # longer than the recursion limit
+    prev = "Number"
+    for i in range(5000):
+        graph.add_node(Node(f"chain_{i}"))
+        graph.add_edge(prev, f"chain_{i}")
+        prev = f"chain_{i}"
+
+    number_t = TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.Number))
+    conflicts = graph.propogate(store, [("Number", number_t)])
+
+    assert conflicts == []
+    assert store.get("chain_4999").inferred == number_t
+
+@should_pass
+def test_propogate_records_conflicts():
+    graph = Graph()
+    store = KVStore()
+
+    graph.add_node(Node("conflict_x"))
+    graph.add_edge("Number", "conflict_x")
+    graph.add_edge("conflict_x", "String")
+
+    number_t = TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.Number))
+    string_t = TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.String))
+    conflicts = graph.propogate(store, [("String", string_t), ("Number", number_t)])
+
+    assert store.get("conflict_x").inferred.is_(string_t)
+    assert len(conflicts) == 1 and conflicts[0][1:] == ("String", "Number")
+
+@should_fail
+def test_propogate_infer_raises_conflicts():
+    graph = Graph()
+    store = KVStore()
+
+    graph.add_node(Node("conflict_x"))
+    graph.add_edge("Number", "conflict_x")
+    graph.add_edge("conflict_x", "String")
+
+    propogate_infer(store, graph, {}, {}, check=True)
+
+@should_pass
+def test_symbol_table_lookup():
+    methods = {
+        "Rename": {
+            "Parameters": [{"Tag": "Parameter", "Value": "x", "Type_t": "", "Args": None, "ID": "sym_p"}],
+            "Body": [
+                [
+                    {
+                        "Tag": "Binary",
+                        "Value": "Eq",
+                        "Type_t": "Operator",
+                        "Args": [
+                            {"Tag": "Identifier", "Value": "y", "Type_t": "Variable", "Args": None, "ID": "sym_y"},
+                            {"Tag": "Identifier", "Value": "x", "Type_t": "Variable", "Args": None, "ID": "sym_p"},
+                        ],
+                        "ID": "sym_eq"
+                    }
+                ]
+            ]
+        }
+    }
+
+    symbols = SymbolTable.from_methods(methods)
+
+    assert symbols.lookup("Rename", "x") == ["sym_p"]
+    assert symbols.lookup("Rename", "y") == ["sym_y"]
+    assert symbols.lookup("Other", "y") == []
+    assert symbols.name_of("sym_y") == "y"
+    assert symbols.method_of("sym_p") == "Rename"
+def assignment_stmt(lhs_id, name, const_t, const_v, const_id, stmt_id):
+    return [
+        {
+            "Tag": "Binary",
+            "Value": "Eq",
+            "Type_t": "Operator",
+            "Args": [
+                {"Tag": "Identifier", "Value": name, "Type_t": "Variable", "Args": None, "ID": lhs_id},
+                {"Tag": "Constant", "Value": const_v, "Type_t": const_t, "Args": None, "ID": const_id},
+            ],
+            "ID": stmt_id
+        }
+    ]
 
+@should_pass
+def test_reinfer_single_method():
+    methods = {
+        "Edited": {"Parameters": [], "Body": [assignment_stmt("re_x", "x", "Number", "1", "re_c1", "re_s")]},
+        "Untouched": {"Parameters": [], "Body": [assignment_stmt("re_y", "y", "String", "\"s\"", "re_c2", "re_t")]},
+    }
+    graph = Graph()
+    store = KVStore()
 
+    process_custom_types(methods, {}, {}, {}, store, graph, {})
+    process_parameters(methods, {}, {}, {}, store, graph, {})
+    process_methods(methods, store, graph, {})
+    propogate_infer(store, graph, {}, {})
+
+    # x = 1 is edited to x = "one"
+    methods["Edited"]["Body"] = [assignment_stmt("re_x", "x", "String", "\"one\"", "re_c3", "re_s")]
+    reinfer_method("Edited", methods, {}, {}, {}, store, graph, {})
+
+    string_t = TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.String))
+    assert graph.find_node("re_c1") is None and store.get("re_c1") is None
+    assert store.get("re_s").inferred.is_(string_t)
+    assert store.get("re_t").inferred.is_(string_t)
+    assert graph.basal_type_of("re_s") == "String"
+    assert graph.conflicting_components() == []
+
+@should_pass
+def test_rollback_conflicting_method():
+    number_t = TypeRepr.primitive(SuTypes.Number)
+    string_t = TypeRepr.primitive(SuTypes.String)
+
+    store = KVStore()
+    store.set("tx_a", StoreValue("a", number_t, number_t))
+    try:
+        with store.transaction():
+            store.delete("tx_a")
+            store.set("tx_b", StoreValue("b", string_t, string_t))
+            raise TypeError("conflict")
+    except TypeError:
+        pass
+    assert store.get("tx_a").inferred.is_(number_t) and store.get("tx_b") is None
+
+    # x = 1 then x = "one" inside the same method conflicts
+    methods = {
+        "Good": {"Parameters": [], "Body": [assignment_stmt("tx_y", "y", "Number", "1", "tx_c1", "tx_s1")]},
+        "Bad": {"Parameters": [], "Body": [
+            assignment_stmt("tx_x", "x", "Number", "1", "tx_c2", "tx_s2"),
+            assignment_stmt("tx_x", "x", "String", "\"one\"", "tx_c3", "tx_s3"),
+        ]},
+    }
+    graph = Graph()
+    infer_method("Good", methods, {}, {}, {}, store, graph, {})
+    try:
+        infer_method("Bad", methods, {}, {}, {}, store, graph, {})
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("Bad should conflict")
+
+    assert store.get("tx_x") is None and graph.find_node("tx_s2") is None and "Bad" not in store.owned
+    assert store.get("tx_y").inferred.is_(number_t) and graph.find_node("tx_s1") is not None
+    assert store.journal is None
+
+@should_pass
+def test_per_method_needs_graph_engine():
+    from unionfind import ConstraintSolver
+
+    methods = {"Only": {"Parameters": [], "Body": [assignment_stmt("pm_x", "x", "Number", "1", "pm_c", "pm_s")]}}
+    try:
+        infer_method("Only", methods, {}, {}, {}, KVStore(), ConstraintSolver(), {})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("the unionfind engine does not track owners")
+
+@should_pass
+def test_deep_expression():
+    def constant(const_t, value, const_id):
+        return {"Tag": "Constant", "Value": value, "Type_t": const_t, "Args": None, "ID": const_id}
+
+    # s = "a" $ "b" $ ... and n = ((...(1)...)), nested deeper than the recursion limit
+    cat = constant("String", "\"a\"", "deep_a")
+    parens = constant("Number", "1", "deep_1")
+    for i in range(10**4):
+        cat = {"Tag": "Nary", "Value": "Cat", "Type_t": "Operator", "ID": f"deep_cat_{i}",
+               "Args": [cat, constant("String", "\"b\"", f"deep_b_{i}")]}
+        parens = {"Tag": "Unary", "Value": "LParen", "Type_t": "Operator", "ID": f"deep_paren_{i}", "Args": [parens]}
+
+    def assign(name, rhs, stmt_id):
+        return [{"Tag": "Binary", "Value": "Eq", "Type_t": "Operator", "ID": stmt_id, "Args": [
+            {"Tag": "Identifier", "Value": name, "Type_t": "Variable", "Args": None, "ID": f"{stmt_id}_{name}"}, rhs,
+        ]}]
+
+    methods = {"Deep": {"Parameters": [], "Body": [assign("s", cat, "deep_s"), assign("n", parens, "deep_n")]}}
+    graph = Graph()
+    store = KVStore()
+    process_custom_types(methods, {}, {}, {}, store, graph, {})
+    process_methods(methods, store, graph, {})
+    propogate_infer(store, graph, {}, {})
+
+    string_t = TypeRepr.primitive(SuTypes.String)
+    number_t = TypeRepr.primitive(SuTypes.Number)
+    assert store.get("deep_s_s").inferred.is_(string_t)
+    assert store.get("deep_a").inferred.is_(string_t) and store.get("deep_cat_0").inferred.is_(string_t)
+    assert graph.basal_type_of("deep_a") == "String" and graph.basal_type_of("deep_b_9999") == "String"
+    assert store.get("deep_n_n").inferred.is_(number_t) and store.get("deep_1").inferred.is_(number_t)
+    assert store.get("deep_paren_0").inferred.is_(number_t)
+    assert graph.conflicting_components() == []
+
+@should_pass
+def test_deep_file():
+    from astloader import load_ast
+    from type_inference import infer_streamed
+
+    def constant(const_t, value, const_id):
+        return json.dumps({"Tag": "Constant", "Value": value, "Type_t": const_t, "Args": None, "ID": const_id})
+
+    # s = "a" $ "b" $ ... nested deeper than the recursion limit, json.dumps cannot
+    # write it so the levels are put around the innermost constant by hand
+    depth = 10**4
+    cat = "".join(f'{{"Tag": "Nary", "Value": "Cat", "Type_t": "Operator", "ID": "file_cat_{i}", "Args": ['
+                  for i in reversed(range(depth)))
+    cat += constant("String", "\"a\"", "file_a")
+    cat += "".join(", " + constant("String", "\"b\"", f"file_b_{i}") + "]}" for i in range(depth))
+    stmt = (f'[{{"Tag": "Binary", "Value": "Eq", "Type_t": "Operator", "ID": "file_s", "Args": ['
+            f'{{"Tag": "Identifier", "Value": "s", "Type_t": "Variable", "Args": null, "ID": "file_s_s"}}, {cat}]}}]')
+    path = os.path.join(tempfile.mkdtemp(), "ast.json")
+    with open(path, "w") as fobj:
+        fobj.write(f'{{"Tag": "Class", "Methods": {{"Deep": [{{"Parameters": [], "Body": [{stmt}]}}]}}, "Attributes": {{}}}}')
+
+    methods = {k: v[0] for k, v in load_ast(path)["Methods"].items()}
+    string_t = TypeRepr.primitive(SuTypes.String)
+    stores = []
+    for streamed in (False, True):
+        graph = Graph()
+        store = KVStore()
+        if streamed:
+            infer_streamed(path, {}, {}, {}, store, graph, {})
+        else:
+            process_custom_types(methods, {}, {}, {}, store, graph, {})
+            process_methods(methods, store, graph, {})
+        propogate_infer(store, graph, {}, {})
+        assert store.get("file_s_s").inferred.is_(string_t) and store.get("file_cat_0").inferred.is_(string_t)
+        assert graph.basal_type_of("file_b_9999") == "String"
+        stores.append({k: v.inferred.get_key() for k, v in store.items()})
+    assert stores[0] == stores[1]
+
+@should_pass
+def test_store_shards_merge():
+    number_t = TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.Number))
+    string_t = TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.String))
+
+    store = KVStore()
+    store.shard("a.su").set("shard_x", StoreValue("x", number_t, number_t))
+    store.shard("b.su").set("shard_y", StoreValue("y", string_t, string_t))
+
+    assert KVStore().get("shard_x") is None
+    assert store.shard_sizes() == {"a.su": 1, "b.su": 1}
+
+    store.merge_shards()
+    assert store.size() == 2 and store.shards == {}
+
+    any_t = TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.Any))
+    other = KVStore()
+    other.shard("c.su").set("shard_z", StoreValue("z", any_t, any_t))
+    other.merge_shards()
+    store.merge(other)
+    assert store.size() == 3 and other.size() == 1
+
+@should_pass
+def test_store_flat_roundtrip():
+    union_t = TypeRepr({"form": "Union", "name": "Currency", "meaning": ["USD", "CAD"]})
+    number_t = TypeRepr(TypeRepr.construct_definition_from_primitive(SuTypes.Number))
+
+    store = KVStore()
+    store.set("flat_x", StoreValue("x", number_t, number_t))
+    store.set("flat_c", StoreValue("c", union_t, union_t))
+
+    directory = tempfile.mkdtemp()
+    flat_path, old_path = os.path.join(directory, "flat.json"), os.path.join(directory, "old.json")
+    with open(flat_path, "w") as fobj:
+        store.write_flat(fobj)
+    with open(old_path, "w") as fobj:
+        json.dump(store.to_json(), fobj, indent=4)
+
+    for path in (flat_path, old_path):
+        values = dict(KVStore.iter_file(path))
+        assert list(values) == ["flat_x", "flat_c"]
+        assert values["flat_x"].inferred.is_(number_t)
+        assert values["flat_c"].inferred.name == "Currency"
+        assert values["flat_c"].inferred.in_union("USD")
+
+@should_pass
+def test_store_secondary_indexes():
+    number_t = TypeRepr.primitive(SuTypes.Number)
+    any_t = TypeRepr.primitive(SuTypes.Any)
+    currency_t = TypeRepr({"form": "Union", "name": "Currency", "meaning": ["USD", "CAD"]})
+
+    store = KVStore()
+    store.owner = "Pay"
+    store.set("idx_a1", StoreValue("amount", any_t, any_t))
+    store.set("idx_c", StoreValue("code", currency_t, currency_t))
+    store.owner = "Refund"
+    store.set("idx_a2", StoreValue("amount", number_t, number_t))
+    store.owner = None
+
+    assert [i for i, _ in store.query(name="amount")] == ["idx_a1", "idx_a2"]
+    assert [i for i, _ in store.query(type_name="Currency")] == ["idx_c"]
+    assert [i for i, _ in store.unresolved("Pay")] == ["idx_a1"]
+
+    # Any is overwritable, the value moves to the Number bucket
+    store.set_on_type_equivalence("idx_a1", StoreValue("amount", number_t, number_t))
+    assert store.unresolved() == []
+    assert [i for i, _ in store.query(name="amount", type_name="Number", method="Pay")] == ["idx_a1"]
+
+    store.delete("idx_c")
+    assert store.query(type_name="Currency") == []
+
+@should_pass
+def test_store_set_many():
+    number_t = TypeRepr.primitive(SuTypes.Number)
+    string_t = TypeRepr.primitive(SuTypes.String)
+    any_t = TypeRepr.primitive(SuTypes.Any)
+
+    store = KVStore()
+    store.set("many_a", StoreValue("a", any_t, any_t))
+    store.set("many_b", StoreValue("b", number_t, number_t))
+
+    # like set for each value, Any is overwritten and the indexes follow
+    store.owner = "Batch"
+    store.set_many({"many_a": StoreValue("a", number_t, number_t), "many_c": StoreValue("c", string_t, string_t)})
+    store.owner = None
+    assert list(store.owned["Batch"]) == ["many_a", "many_c"]
+    assert [i for i, _ in store.query(type_name="Number")] == ["many_b", "many_a"]
+    assert store.unresolved() == [] and [i for i, _ in store.query(name="c")] == ["many_c"]
+
+    # a rollback undoes the whole batch
+    store.begin()
+    store.set_many({"many_d": StoreValue("d", number_t, number_t), "many_b": StoreValue("b", string_t, string_t)})
+    store.rollback()
+    assert store.get("many_d") is None and store.get("many_b").inferred is number_t
+    assert [i for i, _ in store.query(type_name="String")] == ["many_c"]
+
+@should_pass
+def test_structural_subtyping():
+    with TypeRepr.session():
+        a = TypeRepr.of({"form": "Object", "name": "Account", "meaning": {"owner": "User", "balance": SuTypes.Number}})
+        b = TypeRepr.of({"form": "Object", "name": "Joint", "meaning": {"owner": "User", "balance": SuTypes.String}})
+        TypeRepr.of({"form": "Object", "name": "User", "meaning": {"name": SuTypes.String, "age": SuTypes.Number}})
+        assert a != b and not a < b
+
+        # recursive typedefs terminate
+        a = TypeRepr.of({"form": "Object", "name": "Link", "meaning": {"next": "Link", "value": SuTypes.Number}})
+        b = TypeRepr.of({"form": "Object", "name": "Chain", "meaning": {"next": "Chain", "value": SuTypes.Number, "size": SuTypes.Number}})
+        assert a < b and not b < a and a == a
+
+@should_pass
+def test_structural_subtyping_cache_invalidation():
+    with TypeRepr.session():
+        a = TypeRepr.of({"form": "Object", "name": "Order", "meaning": {"buyer": "Person"}})
+        b = TypeRepr.of({"form": "Object", "name": "Sale", "meaning": {"buyer": "Customer"}})
+        # neither field type is defined yet, the names are compared as they are
+        assert a != b
+
+        TypeRepr.of({"form": "Object", "name": "Person", "meaning": {"name": SuTypes.String}})
+        TypeRepr.of({"form": "Object", "name": "Customer", "meaning": {"name": SuTypes.String}})
+        assert a == b
+
+        TypeRepr.of({"form": "Object", "name": "Customer", "meaning": {"name": SuTypes.Number}})
+        assert a != b
+
+@should_pass
+def test_streamed_inference():
+    from type_inference import infer_streamed
+
+    methods = {
+        "First": {"Parameters": [], "Body": [assignment_stmt("st_x", "x", "Number", "1", "st_c1", "st_s1")]},
+        "Second": {"Parameters": [], "Body": [assignment_stmt("st_y", "y", "String", "\"s\"", "st_c2", "st_s2")]},
+    }
+    path = os.path.join(tempfile.mkdtemp(), "ast.json")
+    with open(path, "w") as fobj:
+        json.dump({"Tag": "Class", "Methods": {k: [v] for k, v in methods.items()}, "Attributes": {}}, fobj)
+
+    stores = []
+    for streamed in (False, True):
+        graph = Graph()
+        store = KVStore()
+        if streamed:
+            infer_streamed(path, {}, {}, {}, store, graph, {})
+        else:
+            process_custom_types(methods, {}, {}, {}, store, graph, {})
+            process_parameters(methods, {}, {}, {}, store, graph, {})
+            process_methods(methods, store, graph, {})
+        propogate_infer(store, graph, {}, {})
+        stores.append({k: v.inferred.get_key() for k, v in store.items()})
+    assert stores[0] == stores[1] and len(stores[1]) == 6
 
 
 def main():
@@ -310,6 +695,22 @@ def main():
     test_single_variable_reassignment()
     # test_parameter_type_mismatch()
     test_raw_type_equality()
-    
+    test_propogate_long_chain()
+    test_propogate_records_conflicts()
+    test_propogate_infer_raises_conflicts()
+    test_symbol_table_lookup()
+    test_reinfer_single_method()
+    test_rollback_conflicting_method()
+    test_per_method_needs_graph_engine()
+    test_deep_expression()
+    test_deep_file()
+    test_store_shards_merge()
+    test_store_flat_roundtrip()
+    test_store_secondary_indexes()
+    test_store_set_many()
+    test_structural_subtyping()
+    test_structural_subtyping_cache_invalidation()
+    test_streamed_inference()
+
 if __name__ == "__main__":
     main()